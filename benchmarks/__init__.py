@@ -0,0 +1,16 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Benchmarks for `libzfs_core`.
+
+Every benchmark is a module that is run from the top of the source tree
+as ``python -m benchmarks.<module> [arguments]`` and prints its results.
+The benchmarks are not tests, they check only that the compared variants
+produce the same results.  The setup that they share, like the selection
+of a simulated or a stub backend, the synthetic records and the timing,
+is in `harness`.
+
+The benchmarks are not installed with the package.
+"""
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,124 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Micro-benchmark for the overhead of the Python wrappers.
+
+`lzc_exists` is called against the stub library of `stub`, built
+on the fly, that implements ``lzc_exists`` as a trivial C function,
+so the time is dominated by the dispatch from the wrapper to the C
+function.
+The wrapper is measured with the library proxies that bind the C
+functions after the first call and with the previous proxies that
+looked every function up on every call.  The same is done for
+a wrapper marked as uncommitted, which checks `is_supported`.
+A direct call of the C function is the baseline.
+
+A C compiler is needed to build the stub library.
+
+Run as ``python -m benchmarks.bench_dispatch [calls]``.
+"""
+
+import functools
+import shutil
+import tempfile
+import threading
+
+from libzfs_core import _libzfs_core as lzc
+from libzfs_core.bindings import libzfs_core
+from libzfs_core.test.stub import build_stub, load_stub
+from .harness import arg, backend, best_time
+
+
+class _LegacyLibrary(object):
+
+    def __init__(self, ffi, libname):
+        self._ffi = ffi
+        self._libname = libname
+        self._lib = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._lib is None:
+            with self._lock:
+                if self._lib is None:
+                    self._lib = self._ffi.dlopen(self._libname)
+
+        return getattr(self._lib, name)
+
+
+class _LegacyInit(object):
+
+    def __init__(self, lib):
+        self._lib = lib
+        self._inited = False
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if not self._inited:
+            with self._lock:
+                if not self._inited:
+                    ret = self._lib.libzfs_core_init()
+                    if ret != 0:
+                        raise lzc.exceptions.ZFSInitializationFailed(ret)
+                    self._inited = True
+        return getattr(self._lib, name)
+
+
+def _legacy_is_supported(func):
+    fname = func.__name__
+    if fname not in vars(lzc):
+        raise ValueError(fname + ' is not from libzfs_core')
+    if not callable(func):
+        raise ValueError(fname + ' is not a function')
+    if not fname.startswith("lzc_"):
+        raise ValueError(fname + ' is not a libzfs_core API function')
+    check_func = getattr(func, "_check_func", None)
+    if check_func is not None:
+        return _legacy_is_supported(check_func)
+    return getattr(lzc._lib, fname, None) is not None
+
+
+def _legacy_uncommitted(func):
+    @functools.wraps(func)
+    def _f(*args, **kwargs):
+        if not _legacy_is_supported(_f):
+            raise NotImplementedError(func.__name__)
+        return func(*args, **kwargs)
+    return _f
+
+
+def bench(name, func, calls):
+    func("pool/fs")
+    elapsed = best_time(lambda: func("pool/fs"), calls, repeat=5)
+    print "%-22s %6.0f ns/call" % (name, elapsed / calls * 1e9)
+
+
+def main():
+    calls = arg(1, 1000000)
+    directory = tempfile.mkdtemp()
+    try:
+        path = build_stub(directory)
+        ffi = libzfs_core.ffi
+        # Keep the library referenced, it is closed when collected.
+        stub = ffi.dlopen(path)
+        direct = stub.lzc_exists
+        bench("direct", lambda name: bool(direct(name)), calls)
+
+        with backend(load_stub(path)):
+            bench("bound", lzc.lzc_exists, calls)
+            bench("bound uncommitted", lzc._uncommitted()(lzc.lzc_exists), calls)
+
+            # The proxies are replaced behind the back of set_backend,
+            # which restores the library afterwards.
+            lzc._lib = _LegacyInit(_LegacyLibrary(ffi, path))
+            bench("legacy", lzc.lzc_exists, calls)
+            bench("legacy uncommitted", _legacy_uncommitted(lzc.lzc_exists), calls)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,67 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Benchmark for the import time of `libzfs_core`.
+
+Every import is done by a fresh interpreter, as it would be done
+by a short-lived command or a worker process.  The import is timed
+with the C declarations loaded from the precompiled ``_ffi`` module
+and with the declarations parsed by ``ffi.cdef()``, the latter is
+forced by hiding the precompiled module.  The benchmark also reports
+whether the error translation, which is needed only for errors,
+was imported.
+
+The precompiled module is generated at install time or in place by
+``python libzfs_core/bindings/_ffi_build.py``.
+
+The loading of the precompiled module is tested by
+`libzfs_core.test.test_bindings`, this benchmark only reports the times.
+
+Run as ``python -m benchmarks.bench_import [runs]``.
+"""
+
+import subprocess
+import sys
+
+from .harness import arg
+
+_IMPORT = '''
+import sys
+import time
+if %(hide)r:
+    sys.modules['libzfs_core.bindings._ffi'] = None
+start = time.time()
+import libzfs_core
+elapsed = time.time() - start
+from libzfs_core.bindings import libnvpair
+print elapsed, type(libnvpair.ffi).__module__, \\
+    int('libzfs_core._error_translation' in sys.modules)
+'''
+
+
+def _run(hide):
+    out = subprocess.check_output([sys.executable, '-c', _IMPORT % {'hide': hide}])
+    (elapsed, ffi_module, translation) = out.split()
+    return (float(elapsed), ffi_module, translation == '1')
+
+
+def bench(name, hide, runs):
+    results = [_run(hide) for _ in xrange(runs)]
+    times = sorted(r[0] for r in results)
+    (_, ffi_module, translation) = results[-1]
+    print "%-10s best %6.1f ms median %6.1f ms (ffi from %s, errors imported: %s)" % (
+        name, times[0] * 1000, times[len(times) // 2] * 1000, ffi_module,
+        translation)
+
+
+def main():
+    runs = arg(1, 20)
+    bench("prebuilt", False, runs)
+    bench("cdef", True, runs)
+
+
+if __name__ == "__main__":
+    main()
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,114 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Memory benchmark for interning of decoded keys and values.
+
+A synthetic listing of snapshot records is decoded and kept in memory,
+as a caller collecting the results of ``lzc_list_snaps`` would do.
+Every record has a unique name, otherwise the records are identical.
+The memory retained by the decoded records is computed by walking them
+and adding up the sizes of all distinct objects, once for the decoding
+without interning and once for each interning mode.
+
+Run as ``python -m benchmarks.bench_intern [records]``,
+the default is a million records.
+"""
+
+import sys
+
+from libzfs_core import _nvlist
+from libzfs_core._nvlist import pack_nvlist, unpack_nvlist
+from libzfs_core._nvlist_native import unpack_native
+from .harness import arg
+
+
+_NAME_FORMAT = "pool/fs/child@snap%08d"
+
+
+def make_snapshot_record(i):
+    return {
+        "name": _NAME_FORMAT % (i,),
+        "dmu_objset_stats": {
+            "dds_num_clones": 0,
+            "dds_creation_txg": 123456,
+            "dds_guid": 2 ** 63 + i,
+            "dds_type": 2,
+            "dds_is_snapshot": True,
+            "dds_inconsistent": False,
+            "dds_origin": "",
+        },
+        "properties": {
+            "used": {"value": 1024, "source": "pool/fs/child"},
+            "referenced": {"value": 4096, "source": "pool/fs/child"},
+            "compression": {"value": "lz4", "source": "pool"},
+        },
+    }
+
+
+def make_listing(number):
+    '''
+    Return the packed records, the names are patched into a packed template.
+    '''
+    template = pack_nvlist(make_snapshot_record(0))
+    placeholder = _NAME_FORMAT % (0,)
+    offset = template.index(placeholder)
+    for i in xrange(number):
+        yield b''.join([template[:offset], _NAME_FORMAT % (i,),
+                        template[offset + len(placeholder):]])
+
+
+def retained_size(obj):
+    '''
+    Return the total size of the distinct objects reachable from ``obj``.
+    '''
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.iterkeys())
+            stack.extend(o.itervalues())
+        elif isinstance(o, list):
+            stack.extend(o)
+    return total
+
+
+def run(title, unpack, number, intern_keys=True, **kwargs):
+    # Key interning is disabled by a table that can not hold anything.
+    _nvlist._intern_key._size = _intern_key_size if intern_keys else 0
+    _nvlist._intern_key._table.clear()
+    _nvlist._intern_value._table.clear()
+    records = [unpack(data, **kwargs) for data in make_listing(number)]
+    size = retained_size(records)
+    print '%-32s %10.1f MB %8.1f bytes/record' % (
+        title, size / 2.0 ** 20, float(size) / number)
+    return size
+
+
+_intern_key_size = _nvlist._intern_key._size
+
+
+def main(number=1000000):
+    print 'memory retained by %d decoded listing records' % (number,)
+    try:
+        for (name, unpack) in (('libnvpair', unpack_nvlist), ('python', unpack_native)):
+            base = run('%s, no interning' % (name,), unpack, number, intern_keys=False)
+            keys = run('%s, keys' % (name,), unpack, number)
+            both = run('%s, keys and values' % (name,), unpack, number, intern_values=True)
+            print '%-32s %10.1f%% %10.1f%%' % (
+                '%s savings' % (name,), 100.0 * (base - keys) / base,
+                100.0 * (base - both) / base)
+    finally:
+        _nvlist._intern_key._size = _intern_key_size
+
+
+if __name__ == '__main__':
+    main(arg(1, 1000000))
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
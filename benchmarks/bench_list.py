@@ -0,0 +1,73 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Benchmark for large listings.
+
+The records are produced by the stub library of `libzfs_core.test.stub`,
+which writes them into the pipe from C, and by the simulator of
+`libzfs_core.simulator`, which writes them from Python.  Both write
+the records before ``lzc_list`` returns, as the kernel does, and
+the listings are far larger than a pipe, so they can complete only
+because the records are read while ``lzc_list`` is being called.  Every listing is measured with
+the default size of the pipe and with larger pipes, see
+:func:`libzfs_core.set_list_pipe_size`.  Only the names are decoded.
+The time to get the first few children of the stub listing with
+a limit is reported too, it does not depend on the size of the listing.
+
+A C compiler and libnvpair are needed to build the stub library.
+
+Run as ``python -m benchmarks.bench_list [stub records [snapshots]]``.
+"""
+
+from libzfs_core import _libzfs_core as lzc
+from .harness import arg, simulator, stub, timed
+
+_PIPE_SIZES = [0, 256 * 1024, 1024 * 1024]
+
+
+def _count(name, recurse, types=None):
+    count = 0
+    for _ in lzc._list(name, recurse=recurse, types=types,
+                       projection=lzc._LIST_NAMES_PROJECTION):
+        count += 1
+    return count
+
+
+def bench(backend, name, expected, types=None):
+    for size in _PIPE_SIZES:
+        lzc.set_list_pipe_size(size)
+        (count, elapsed) = timed(_count, name, 1, types)
+        assert count == expected
+        print "%-10s %8s pipe %8.3f s %10.0f records/s" % (
+            backend, size or "default", elapsed, count / elapsed)
+
+
+def bench_limit(limit):
+    (names, elapsed) = timed(list, lzc.lzc_list_children("pool", limit=limit))
+    assert len(names) == limit
+    print "%-10s first %d children %8.3f s" % ("stub", limit, elapsed)
+
+
+def main():
+    records = arg(1, 1000000)
+    snapshots = arg(2, 100000)
+    with stub() as built:
+        built.set_result(records=records)
+        print "%d records from the stub" % (records,)
+        bench("stub", "pool", records)
+        bench_limit(10)
+
+    with simulator():
+        lzc.lzc_create("pool/fs")
+        # A filesystem can be snapshotted once per call.
+        for i in xrange(snapshots):
+            lzc.lzc_snapshot(["pool/fs@snap%d" % i])
+        print "%d snapshots from the simulator" % (snapshots,)
+        bench("simulator", "pool/fs", snapshots, types=["snapshot"])
+
+
+if __name__ == "__main__":
+    main()
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
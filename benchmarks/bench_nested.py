@@ -0,0 +1,109 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Memory benchmark for converting large nested inputs to nvlists.
+
+The input resembles the argument of ``lzc_hold``-like calls:
+a hundred thousand entries each of which is a nested dictionary,
+plus an array of as many nested dictionaries.  The conversion is done
+by `nvlist_in`, which frees every temporary nested nvlist_t as soon
+as it is copied into its parent, and by the previous implementation,
+which left the temporary copies to the garbage collector.
+
+Each variant runs in its own process, so that the peak resident set
+size is not affected by the other variant.  The Python allocations
+are traced as well where `tracemalloc` is available.
+
+Run as ``python -m benchmarks.bench_nested [entries]``.
+"""
+
+import resource
+import subprocess
+import sys
+
+from libzfs_core._nvlist import nvlist_in, _ffi, _lib, _nvlist_add
+from .harness import arg, timed
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def make_input(number):
+    return {
+        "holds": {"pool/fs@snap%d" % (i,): {"tag": None, "index": i} for i in xrange(number)},
+        "array": [{"name": "pool/fs@snap%d" % (i,)} for i in xrange(number)],
+    }
+
+
+def _legacy_nvlist_in(props):
+    # The conversion used before temporary nested nvlists were freed
+    # immediately; every nested nvlist_t was left to the finalizers.
+    nvlistp = _ffi.new("nvlist_t **")
+    if _lib.nvlist_alloc(nvlistp, 1, 0) != 0:
+        raise MemoryError('nvlist_alloc failed')
+    nvlist = _ffi.gc(nvlistp[0], _lib.nvlist_free)
+    for k, v in props.items():
+        _legacy_nvlist_add(nvlist, k, v)
+    return nvlist
+
+
+def _legacy_nvlist_add(nvlist, k, v):
+    if isinstance(v, dict):
+        ret = _lib.nvlist_add_nvlist(nvlist, k, _legacy_nvlist_in(v))
+    elif isinstance(v, list) and v and isinstance(v[0], dict):
+        c_array = [_legacy_nvlist_in(x) for x in v]
+        ret = _lib.nvlist_add_nvlist_array(nvlist, k, c_array, len(c_array))
+    else:
+        ret = 0
+        _nvlist_add(nvlist, k, v)
+    if ret != 0:
+        raise MemoryError('nvlist_add failed')
+
+
+_variants = {
+    'before': _legacy_nvlist_in,
+    'after': nvlist_in,
+}
+
+
+def _max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run(variant, number):
+    props = make_input(number)
+    if tracemalloc is not None:
+        tracemalloc.start()
+    base_rss = _max_rss_mb()
+    (nvlist, elapsed) = timed(_variants[variant], props)
+    peak_rss = _max_rss_mb()
+    traced = ''
+    if tracemalloc is not None:
+        (_, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        traced = ' %8.1f MB traced peak' % (peak / 2.0 ** 20,)
+    del nvlist
+    print '%-8s %8.2f s %8.1f MB peak RSS growth%s' % (
+        variant, elapsed, peak_rss - base_rss, traced)
+    sys.stdout.flush()
+
+
+def main(number=100000):
+    print 'nvlist_in of %d nested entries' % (number,)
+    sys.stdout.flush()
+    for variant in sorted(_variants, reverse=True):
+        subprocess.check_call(
+            [sys.executable, '-m', 'benchmarks.bench_nested', '--run', variant, str(number)])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--run':
+        run(sys.argv[2], int(sys.argv[3]))
+    else:
+        main(arg(1, 100000))
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,99 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Benchmarks for _nvlist module.
+
+The benchmarks measure the cost of converting C ``nvlist_t`` objects
+to Python dictionaries.  The records resemble those produced by
+the listing interface: a handful of top-level pairs plus a nested
+nvlist of properties each of which has a value and a source.
+
+Run as ``python -m benchmarks.bench_nvlist``.
+"""
+
+from libzfs_core._nvlist import nvlist_in, _nvlist_to_dict, _ffi, _lib
+from .harness import best_time, count_pairs, make_record, report_pairs
+
+
+def _legacy_type_info(typeid):
+    # The per-pair type table that was used before the decoding engine.
+    # It is kept here only to provide a baseline for the measurements.
+    convert_nvlist = lambda x: _legacy_nvlist_to_dict(x, {})
+    return {
+        _lib.DATA_TYPE_BOOLEAN:         (None, None, None, None),
+        _lib.DATA_TYPE_BOOLEAN_VALUE:   ("boolean_value", "boolean_t *", False, bool),
+        _lib.DATA_TYPE_BYTE:            ("byte", "uchar_t *", False, int),
+        _lib.DATA_TYPE_INT8:            ("int8", "int8_t *", False, int),
+        _lib.DATA_TYPE_UINT8:           ("uint8", "uint8_t *", False, int),
+        _lib.DATA_TYPE_INT16:           ("int16", "int16_t *", False, int),
+        _lib.DATA_TYPE_UINT16:          ("uint16", "uint16_t *", False, int),
+        _lib.DATA_TYPE_INT32:           ("int32", "int32_t *", False, int),
+        _lib.DATA_TYPE_UINT32:          ("uint32", "uint32_t *", False, int),
+        _lib.DATA_TYPE_INT64:           ("int64", "int64_t *", False, int),
+        _lib.DATA_TYPE_UINT64:          ("uint64", "uint64_t *", False, int),
+        _lib.DATA_TYPE_STRING:          ("string", "char **", False, _ffi.string),
+        _lib.DATA_TYPE_NVLIST:          ("nvlist", "nvlist_t **", False, convert_nvlist),
+        _lib.DATA_TYPE_BOOLEAN_ARRAY:   ("boolean_array", "boolean_t **", True, bool),
+        _lib.DATA_TYPE_BYTE_ARRAY:      ("byte_array", "uchar_t **", True, int),
+        _lib.DATA_TYPE_INT8_ARRAY:      ("int8_array", "int8_t **", True, int),
+        _lib.DATA_TYPE_UINT8_ARRAY:     ("uint8_array", "uint8_t **", True, int),
+        _lib.DATA_TYPE_INT16_ARRAY:     ("int16_array", "int16_t **", True, int),
+        _lib.DATA_TYPE_UINT16_ARRAY:    ("uint16_array", "uint16_t **", True, int),
+        _lib.DATA_TYPE_INT32_ARRAY:     ("int32_array", "int32_t **", True, int),
+        _lib.DATA_TYPE_UINT32_ARRAY:    ("uint32_array", "uint32_t **", True, int),
+        _lib.DATA_TYPE_INT64_ARRAY:     ("int64_array", "int64_t **", True, int),
+        _lib.DATA_TYPE_UINT64_ARRAY:    ("uint64_array", "uint64_t **", True, int),
+        _lib.DATA_TYPE_STRING_ARRAY:    ("string_array", "char ***", True, _ffi.string),
+        _lib.DATA_TYPE_NVLIST_ARRAY:    ("nvlist_array", "nvlist_t ***", True, convert_nvlist),
+    }[typeid]
+
+
+def _legacy_nvlist_to_dict(nvlist, props):
+    pair = _lib.nvlist_next_nvpair(nvlist, _ffi.NULL)
+    while pair != _ffi.NULL:
+        name = _ffi.string(_lib.nvpair_name(pair))
+        typeid = int(_lib.nvpair_type(pair))
+        (suffix, ctype, is_array, convert) = _legacy_type_info(typeid)
+        cfunc = getattr(_lib, "nvpair_value_%s" % (suffix,), None)
+        val = None
+        if is_array:
+            valptr = _ffi.new(ctype)
+            lenptr = _ffi.new("uint_t *")
+            if cfunc(pair, valptr, lenptr) != 0:
+                raise RuntimeError('nvpair_value failed')
+            val = []
+            for i in range(int(lenptr[0])):
+                val.append(convert(valptr[0][i]))
+        elif typeid != _lib.DATA_TYPE_BOOLEAN:
+            valptr = _ffi.new(ctype)
+            if cfunc(pair, valptr) != 0:
+                raise RuntimeError('nvpair_value failed')
+            val = convert(valptr[0])
+        props[name] = val
+        pair = _lib.nvlist_next_nvpair(nvlist, pair)
+    return props
+
+
+def measure(func, nvlist, number):
+    '''
+    Return the best time, in seconds, of ``number`` conversions of ``nvlist``.
+    '''
+    return best_time(lambda: func(nvlist, {}), number)
+
+
+def main(number=2000):
+    record = make_record()
+    npairs = count_pairs(record)
+    nvlist = nvlist_in(record)
+    assert _legacy_nvlist_to_dict(nvlist, {}) == _nvlist_to_dict(nvlist, {})
+
+    print 'nvlist decode, %d pairs per record, %d records' % (npairs, number)
+    report_pairs('before (per-pair table)', measure(_legacy_nvlist_to_dict, nvlist, number), number, npairs)
+    report_pairs('after (decoder engine)', measure(_nvlist_to_dict, nvlist, number), number, npairs)
+
+
+if __name__ == '__main__':
+    main()
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
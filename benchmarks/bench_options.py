@@ -0,0 +1,64 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Benchmark for the extended options of the listings.
+
+Snapshots with a few user properties are created in the simulator of
+`libzfs_core.simulator` and listed by the listing helpers, once with
+a simulator that supports the "props", "mintxg" and "maxtxg" options
+of ``lzc_list``, so only the needed records and properties are written
+into the pipe, and once with a simulator that rejects them, so the
+records are selected after they are received.  The number of bytes
+written into the pipe is reported too.
+
+Run as ``python -m benchmarks.bench_options [snapshots]``.
+"""
+
+from libzfs_core import _libzfs_core as lzc
+from libzfs_core.simulator import Simulator
+from .harness import arg, simulator, timed
+
+
+class _CountingSimulator(Simulator):
+
+    written = 0
+
+    def _write(self, fd, data):
+        _CountingSimulator.written += len(data)
+        super(_CountingSimulator, self)._write(fd, data)
+
+
+def _make(count):
+    props = {"com.example:prop%d" % i: "value%d" % i for i in range(5)}
+    lzc.lzc_create("pool/fs", props=props)
+    for i in xrange(count):
+        lzc.lzc_snapshot(["pool/fs@snap%d" % i])
+    return lzc.lzc_get_props("pool/fs@snap%d" % (count * 9 // 10))["createtxg"]
+
+
+def bench(name, call):
+    _CountingSimulator.written = 0
+    (count, elapsed) = timed(lambda: sum(1 for _ in call()))
+    print "%-24s %8d listed %8.3f s %10.1f KB" % (
+        name, count, elapsed, _CountingSimulator.written / 1e3)
+
+
+def main():
+    count = arg(1, 20000)
+    for list_options in (("props", "mintxg", "maxtxg"), ()):
+        with simulator(_CountingSimulator, list_options=list_options):
+            txg = _make(count)
+            print "%d snapshots, options %s" % (count, "supported" if list_options else "rejected")
+            bench("names", lambda: lzc.lzc_list_snaps("pool/fs"))
+            bench("names since txg", lambda: lzc.lzc_list_snaps("pool/fs", min_txg=txg))
+            bench("one property", lambda: lzc.lzc_list_tree(
+                "pool/fs", types=["snapshot"], props=["com.example:prop0"]))
+            bench("all properties", lambda: lzc.lzc_get_props_many(
+                root="pool/fs", types=["snapshot"]))
+
+
+if __name__ == "__main__":
+    main()
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
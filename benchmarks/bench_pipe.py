@@ -0,0 +1,107 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Benchmark for reading the lzc_list records from a pipe.
+
+A thread writes a number of packed records, in the format used by
+the kernel, into a pipe while the records are read from the other end.
+The records are read by the buffered `_PipeRecordReader` and by the
+previous method of two ``os.read`` calls per record, with the short
+reads completed by more calls.  Only the framing of the records is
+measured, the records are not decoded.
+
+Run as ``python -m benchmarks.bench_pipe [records]``.
+"""
+
+import os
+import struct
+import threading
+import time
+
+from libzfs_core import _libzfs_core as lzc
+from libzfs_core._nvlist import pack_nvlist
+from .harness import arg, make_record
+
+
+def _writer(fd, record, count, per_write):
+    # The kernel writes a record at a time, but it does not compete for
+    # the GIL with the reader, more records per write make the writer
+    # cheaper in the same way.
+    try:
+        chunk = record * per_write
+        for _ in xrange(count // per_write):
+            os.write(fd, chunk)
+        os.write(fd, record * (count % per_write))
+        os.write(fd, lzc._pipe_record_header.pack(0, 0, 0, 0, 0))
+    finally:
+        os.close(fd)
+
+
+def _read_full(fd, size):
+    # A read returns less than requested when the writer has not
+    # finished writing the record, so the legacy reader needs a loop
+    # to be correct.
+    data = os.read(fd, size)
+    while data and len(data) < size:
+        chunk = os.read(fd, size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def read_legacy(fd):
+    count = 0
+    while True:
+        record_bytes = _read_full(fd, lzc._PIPE_RECORD_SIZE)
+        if not record_bytes:
+            break
+        (size, _, err, _, _) = struct.unpack(lzc._PIPE_RECORD_FORMAT, record_bytes)
+        if size == 0:
+            break
+        _read_full(fd, size)
+        count += 1
+    return count
+
+
+def read_buffered(fd):
+    count = 0
+    reader = lzc._PipeRecordReader(fd)
+    while True:
+        (_, data) = reader.read_record()
+        if len(data) == 0:
+            break
+        count += 1
+    return count
+
+
+def bench(name, read, record, count, per_write):
+    (rfd, wfd) = os.pipe()
+    writer = threading.Thread(target=_writer, args=(wfd, record, count, per_write))
+    start = time.time()
+    writer.start()
+    try:
+        assert read(rfd) == count
+    finally:
+        writer.join()
+        os.close(rfd)
+    elapsed = time.time() - start
+    print "%-10s %3d per write %8.3f s %10.0f records/s %8.1f MB/s" % (
+        name, per_write, elapsed, count / elapsed, count * len(record) / elapsed / 1e6)
+
+
+def main():
+    count = arg(1, 200000)
+    packed = pack_nvlist(make_record(nprops=10))
+    record = lzc._pipe_record_header.pack(len(packed), 0, 0, 0, 0) + packed
+    print "%d records of %d bytes" % (count, len(record))
+    for per_write in (1, 32):
+        bench("legacy", read_legacy, record, count, per_write)
+        bench("buffered", read_buffered, record, count, per_write)
+
+
+if __name__ == "__main__":
+    main()
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,45 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Benchmark for getting the properties of many datasets.
+
+Filesystems with a few properties are created in the simulator of
+`libzfs_core.simulator` and their properties are got with
+a :func:`libzfs_core.lzc_get_props` call per filesystem, which is
+a listing per filesystem, and with :func:`libzfs_core.lzc_get_props_many`
+given the root and given the names, which is a single listing.
+
+Run as ``python -m benchmarks.bench_props [filesystems]``.
+"""
+
+from libzfs_core import _libzfs_core as lzc
+from .harness import arg, simulator, timed
+
+
+def bench(name, get_props, count):
+    (result, elapsed) = timed(lambda: dict(get_props()))
+    assert len(result) == count
+    print "%-10s %8.3f s %10.0f datasets/s" % (name, elapsed, count / elapsed)
+    return result
+
+
+def main():
+    count = arg(1, 5000)
+    with simulator():
+        names = ["pool"]
+        for i in xrange(1, count):
+            name = "pool/group%d/fs%d" % (i % 10, i) if i > 10 else "pool/group%d" % (i % 10)
+            lzc.lzc_create(name, props={"com.example:index": str(i), "quota": 1 << 30})
+            names.append(name)
+        print "%d filesystems" % (count,)
+        single = bench("single", lambda: ((name, lzc.lzc_get_props(name)) for name in names), count)
+        root = bench("root", lambda: lzc.lzc_get_props_many(root="pool"), count)
+        many = bench("names", lambda: lzc.lzc_get_props_many(names=names), count)
+        assert single == root == many
+
+
+if __name__ == "__main__":
+    main()
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
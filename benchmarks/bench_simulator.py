@@ -0,0 +1,62 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Benchmark for code built on `libzfs_core` run against the simulator.
+
+A tree of filesystems is created in a simulated pool, then every
+filesystem is snapshotted in batches with ``lzc_snapshot``, all
+of them are listed with ``_list``, and the snapshots are destroyed
+in batches with ``lzc_destroy_snaps``.  The time and the rate of
+every step are reported.  No pool or privileges are needed.
+
+Run as ``python -m benchmarks.bench_simulator [datasets] [batch]``.
+"""
+
+from libzfs_core import _libzfs_core as lzc
+from .harness import arg, simulator, timed
+
+
+def step(name, count, func, *args):
+    (result, elapsed) = timed(func, *args)
+    print "%-20s %8d in %7.2f s, %9.0f per second" % (
+        name, count, elapsed, count / elapsed if elapsed else float('inf'))
+    return result
+
+
+def create(names):
+    for name in names:
+        lzc.lzc_create(name)
+
+
+def in_batches(func, names, batch, *args):
+    for i in xrange(0, len(names), batch):
+        func(names[i:i + batch], *args)
+
+
+def list_all(name):
+    return sum(1 for _ in lzc._list(name, recurse=None))
+
+
+def main():
+    count = arg(1, 10000)
+    batch = arg(2, 1000)
+    with simulator():
+        # Ten filesystems per parent, so that the tree has some depth.
+        names = []
+        for i in xrange(count):
+            parent = names[i // 10 - 1] if i >= 10 else "pool"
+            names.append("%s/fs%d" % (parent, i))
+        snaps = [name + "@snap" for name in names]
+
+        step("lzc_create", count, create, names)
+        step("lzc_snapshot", count, in_batches, lzc.lzc_snapshot, snaps, batch)
+        listed = step("_list", 2 * count + 1, list_all, "pool")
+        assert listed == 2 * count + 1
+        step("lzc_destroy_snaps", count, in_batches, lzc.lzc_destroy_snaps, snaps, batch, False)
+
+
+if __name__ == "__main__":
+    main()
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
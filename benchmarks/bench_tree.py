@@ -0,0 +1,69 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Benchmark for the inventory of a hierarchy of datasets.
+
+A hierarchy of filesystems is created in the simulator of
+`libzfs_core.simulator` and its names, guids and a property are
+collected by a single :func:`libzfs_core.lzc_list_tree` call and
+by a walk that calls :func:`libzfs_core.lzc_list_children` and
+:func:`libzfs_core.lzc_get_props` for every filesystem, which is
+a listing per filesystem for each.
+
+Run as ``python -m benchmarks.bench_tree [filesystems [fanout]]``.
+"""
+
+from libzfs_core import _libzfs_core as lzc
+from .harness import arg, simulator, timed
+
+_PROP = "com.example:prop"
+
+
+def make_tree(count, fanout):
+    names = ["pool"]
+    for i in xrange(1, count):
+        name = "%s/fs%d" % (names[(i - 1) // fanout], i)
+        lzc.lzc_create(name, props={_PROP: "value"} if i % 10 == 0 else None)
+        names.append(name)
+    return names
+
+
+def inventory_tree():
+    return [(r.name, r.guid, r.props.get(_PROP))
+            for r in lzc.lzc_list_tree("pool", types=["filesystem"], props=[_PROP])]
+
+
+def inventory_walk():
+    result = []
+    pending = ["pool"]
+    while pending:
+        name = pending.pop()
+        props = lzc.lzc_get_props(name)
+        result.append((name, props["guid"], props.get(_PROP)))
+        pending.extend(reversed(list(lzc.lzc_list_children(name))))
+    return result
+
+
+def bench(name, inventory, count):
+    (result, elapsed) = timed(inventory)
+    assert len(result) == count
+    print "%-6s %8.3f s %10.0f datasets/s" % (name, elapsed, count / elapsed)
+    return result
+
+
+def main():
+    count = arg(1, 5000)
+    fanout = arg(2, 10)
+    with simulator():
+        make_tree(count, fanout)
+        print "%d filesystems, %d children each" % (count, fanout)
+        tree = bench("tree", inventory_tree, count)
+        walk = bench("walk", inventory_walk, count)
+        assert sorted(tree) == sorted(walk)
+
+
+if __name__ == "__main__":
+    main()
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
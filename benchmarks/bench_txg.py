@@ -0,0 +1,82 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Benchmark for batching of snapshot creation and destruction.
+
+The snapshots of many filesystems are created and destroyed in batches
+of different sizes against the simulator wrapped by a fault injector
+that simulates the wait for the txg sync.  The delays are taken on
+a virtual clock, so the results are reproducible and are reported in
+the simulated time, together with the number of txgs.  A fraction
+of the names can be made to fail, then a failed batch is retried
+without the failed names.
+
+Run as ``python -m benchmarks.bench_txg [filesystems] [failure rate]``.
+"""
+
+import errno
+
+from libzfs_core import _libzfs_core as lzc
+from libzfs_core import exceptions as lzc_exc
+from libzfs_core.fault_injection import FaultInjector, VirtualClock, lognormal
+from libzfs_core.simulator import Simulator
+from .harness import arg, backend
+
+_BATCHES = [1, 10, 100, 1000]
+
+
+def run(func, names, batch):
+    '''
+    Call the function for the batches of names, retrying the failed batches
+    without the failed names, and return the number of the failed names.
+    '''
+    failed = 0
+    for i in xrange(0, len(names), batch):
+        pending = names[i:i + batch]
+        while pending:
+            try:
+                func(pending)
+                break
+            except (lzc_exc.SnapshotFailure, lzc_exc.SnapshotDestructionFailure) as e:
+                bad = set(err.name for err in e.errors)
+                failed += len(bad)
+                pending = [name for name in pending if name not in bad]
+    return failed
+
+
+def bench(count, batch, rate):
+    sim = Simulator(seed=0)
+    sim.create_pool("pool")
+    for i in xrange(count):
+        sim.lzc_create("pool/fs%d" % i, sim.DMU_OST_ZFS, lzc._ffi.NULL)
+    clock = VirtualClock()
+    injector = FaultInjector(sim, seed=0, clock=clock, sync_time=lognormal(0.1, 0.5),
+                             sync_time_per_name=0.0002)
+    if rate:
+        injector.inject("lzc_snapshot", errno.EEXIST, rate=rate)
+        injector.inject("lzc_destroy_snaps", errno.EBUSY, rate=rate)
+    snaps = ["pool/fs%d@snap" % i for i in xrange(count)]
+    with backend(injector):
+        start = clock.time()
+        failed = run(lzc.lzc_snapshot, snaps, batch)
+        created = clock.time() - start
+        start = clock.time()
+        failed += run(lambda names: lzc.lzc_destroy_snaps(names, False), snaps, batch)
+        destroyed = clock.time() - start
+    print "batch %5d: create %8.1f s (%7.0f/s), destroy %8.1f s (%7.0f/s), %5d txgs, %d failed" % (
+        batch, created, count / created, destroyed, count / destroyed, injector.txgs, failed)
+
+
+def main():
+    count = arg(1, 10000)
+    rate = arg(2, 0.0, float)
+    print "%d filesystems, simulated time" % (count,)
+    for batch in _BATCHES:
+        bench(count, batch, rate)
+
+
+if __name__ == "__main__":
+    main()
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
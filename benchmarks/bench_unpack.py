@@ -0,0 +1,46 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Benchmarks for decoding packed nvlists.
+
+The records are the synthetic listing records of `harness`
+packed in the native encoding, i.e. in the form in which they
+arrive through the ``lzc_list`` pipe.  Each record is decoded
+by unpacking it with libnvpair and converting the nvlist_t,
+which is what ``_list`` does by default, and by parsing
+the packed data directly in Python.
+
+Run as ``python -m benchmarks.bench_unpack``.
+"""
+
+from libzfs_core._nvlist import pack_nvlist, unpack_nvlist
+from libzfs_core._nvlist_native import unpack_native
+from .harness import best_time, count_pairs, make_record, report_pairs
+
+
+def measure(func, data, number):
+    '''
+    Return the best time, in seconds, of ``number`` decodings of ``data``.
+    '''
+    return best_time(lambda: func(data), number)
+
+
+def main(number=2000):
+    record = make_record()
+    npairs = count_pairs(record)
+    packed = pack_nvlist(record)
+    assert unpack_nvlist(packed) == unpack_native(packed) == record
+
+    print 'packed nvlist decode, %d pairs per record, %d bytes per record, %d records' % (
+        npairs, len(packed), number)
+    report_pairs('libnvpair unpack', measure(unpack_nvlist, packed, number), number, npairs)
+    report_pairs('python unpack', measure(unpack_native, packed, number), number, npairs)
+    view = memoryview(packed)
+    report_pairs('python unpack (view)', measure(unpack_native, view, number), number, npairs)
+
+
+if __name__ == '__main__':
+    main()
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
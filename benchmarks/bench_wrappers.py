@@ -0,0 +1,105 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Benchmark for the overhead of every `libzfs_core` wrapper.
+
+The wrappers are called against the stub library of
+`libzfs_core.test.stub`, which returns canned results immediately,
+so the reported time per call is the time spent in Python and in
+the CFFI calls: the conversion of the arguments to nvlists, the
+conversion of the results and the translation of the errors.  The functions that take many names are measured with
+inputs of several sizes, both when they succeed and when every name
+is reported in the error list.
+
+A C compiler and libnvpair are needed to build the stub library.
+
+Run as ``python -m benchmarks.bench_wrappers [seconds per case]``.
+"""
+
+import errno
+import functools
+
+from libzfs_core import _libzfs_core as lzc
+from libzfs_core import exceptions as lzc_exc
+from .harness import arg, ns_per_call, stub
+
+_SIZES = [1, 10, 100, 1000]
+
+
+def _snaps(n):
+    return ["pool/fs%d@snap" % i for i in xrange(n)]
+
+
+def _bookmarks(n):
+    return {"pool/fs%d#bmark" % i: "pool/fs%d@snap" % i for i in xrange(n)}
+
+
+def _holds(n):
+    return {"pool/fs%d@snap" % i: "tag" for i in xrange(n)}
+
+
+def _releases(n):
+    return {"pool/fs%d@snap" % i: ["tag"] for i in xrange(n)}
+
+
+def _list_children(name):
+    return list(lzc.lzc_list_children(name))
+
+
+# (wrapper, function of the input size that returns the arguments,
+#  input sizes or None if the size does not matter)
+_CASES = [
+    (lzc.lzc_create, lambda n: ("pool/fs",), None),
+    (lzc.lzc_clone, lambda n: ("pool/clone", "pool/fs@snap"), None),
+    (lzc.lzc_rollback, lambda n: ("pool/fs",), None),
+    (lzc.lzc_snapshot, lambda n: (_snaps(n),), _SIZES),
+    (lzc.lzc_destroy_snaps, lambda n: (_snaps(n), False), _SIZES),
+    (lzc.lzc_bookmark, lambda n: (_bookmarks(n),), _SIZES),
+    (lzc.lzc_get_bookmarks, lambda n: ("pool/fs",), None),
+    (lzc.lzc_destroy_bookmarks, lambda n: (_bookmarks(n).keys(),), _SIZES),
+    (lzc.lzc_snaprange_space, lambda n: ("pool/fs@a", "pool/fs@b"), None),
+    (lzc.lzc_hold, lambda n: (_holds(n),), _SIZES),
+    (lzc.lzc_release, lambda n: (_releases(n),), _SIZES),
+    (lzc.lzc_get_holds, lambda n: ("pool/fs@snap",), None),
+    (lzc.lzc_send_space, lambda n: ("pool/fs@snap",), None),
+    (lzc.lzc_exists, lambda n: ("pool/fs",), None),
+    (lzc.lzc_promote, lambda n: ("pool/clone",), None),
+    (lzc.lzc_rename, lambda n: ("pool/fs", "pool/fs2"), None),
+    (lzc.lzc_destroy, lambda n: ("pool/fs",), None),
+    (lzc.lzc_inherit_prop, lambda n: ("pool/fs", "user:prop"), None),
+    (lzc.lzc_set_prop, lambda n: ("pool/fs", "user:prop", "value"), None),
+    (lzc.lzc_get_props, lambda n: ("pool/fs",), None),
+    (_list_children, lambda n: ("pool/fs",), _SIZES),
+]
+
+
+def _failing(call):
+    def _call():
+        try:
+            call()
+        except lzc_exc.ZFSError:
+            pass
+    return _call
+
+
+def main():
+    seconds = arg(1, 0.2, float)
+    with stub() as built:
+        print "%-22s %6s %12s %12s" % ("wrapper", "size", "ok ns/call", "error ns/call")
+        for (func, make_args, sizes) in _CASES:
+            for size in sizes or [1]:
+                call = functools.partial(func, *make_args(size))
+                # The dataset itself is listed too.
+                built.set_result(records=size + 1)
+                ok = ns_per_call(call, seconds)
+                built.set_result(errno.EEXIST)
+                failed = ns_per_call(_failing(call), seconds)
+                print "%-22s %6s %12.0f %12.0f" % (
+                    func.__name__, size if sizes else "", ok, failed)
+
+
+if __name__ == "__main__":
+    main()
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,162 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+The setup shared by the benchmarks.
+"""
+
+import sys
+import time
+import timeit
+from contextlib import contextmanager
+
+from libzfs_core import _libzfs_core as lzc
+
+
+def arg(index, default, type=int):
+    '''
+    Return the command line argument at the given position,
+    converted to the type, or the default if it is not given.
+    '''
+    if len(sys.argv) > index:
+        return type(sys.argv[index])
+    return default
+
+
+def timed(func, *args):
+    '''
+    Call the function once and return its result and the elapsed time
+    in seconds.
+    '''
+    start = time.time()
+    result = func(*args)
+    return (result, time.time() - start)
+
+
+def best_time(call, number, repeat=3):
+    '''
+    Return the best time, in seconds, of `number` calls of `call`.
+    '''
+    return min(timeit.Timer(call).repeat(repeat=repeat, number=number))
+
+
+def ns_per_call(call, seconds):
+    '''
+    Return the best time per call, in nanoseconds, over a few runs
+    that take about the given time each.
+    '''
+    timer = timeit.Timer(call)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= seconds / 10:
+            break
+        number *= 10
+    number = max(1, int(number * seconds / elapsed / 10))
+    return min(timer.repeat(repeat=3, number=number)) / number * 1e9
+
+
+@contextmanager
+def backend(selected):
+    '''
+    Select the backend of `libzfs_core` for the duration of the block,
+    the previous backend and the size of the listing pipe are restored
+    afterwards.
+    '''
+    previous = lzc.set_backend(selected)
+    pipe_size = lzc._list_pipe_size
+    try:
+        yield selected
+    finally:
+        lzc.set_backend(previous)
+        lzc.set_list_pipe_size(pipe_size)
+
+
+@contextmanager
+def simulator(cls=None, **kwargs):
+    '''
+    Select a simulator with an empty pool named "pool" as the backend
+    for the duration of the block.
+
+    :param cls: the class of the simulator, a subclass of `Simulator`
+                or `None` for `Simulator` itself.
+    :param kwargs: the arguments of the simulator, the seed is 0
+                   if it is not given.
+    '''
+    from libzfs_core.simulator import Simulator
+
+    kwargs.setdefault('seed', 0)
+    sim = (cls or Simulator)(**kwargs)
+    sim.create_pool("pool")
+    with backend(sim):
+        yield sim
+
+
+@contextmanager
+def stub():
+    '''
+    Build the stub library of `libzfs_core.test.stub` and select it
+    as the backend for the duration of the block.
+
+    A C compiler and libnvpair are needed to build the stub library.
+    '''
+    from libzfs_core.test.stub import Stub
+
+    built = Stub()
+    try:
+        with backend(built.lib):
+            yield built
+    finally:
+        built.close()
+
+
+def make_record(nprops=50):
+    '''
+    Return a synthetic listing record: a handful of top-level pairs plus
+    a nested nvlist of properties each of which has a value and a source.
+    '''
+    props = {}
+    for i in range(nprops):
+        props["prop%d" % (i,)] = {
+            "value": i * 1024,
+            "source": "pool/fs%d" % (i,),
+        }
+    props["clones"] = {"value": {"pool/clone1": None, "pool/clone2": None}}
+    return {
+        "name": "pool/fs/child@snap",
+        "dmu_objset_stats": {
+            "dds_num_clones": 0,
+            "dds_creation_txg": 123456,
+            "dds_guid": 2 ** 63,
+            "dds_type": 2,
+            "dds_is_snapshot": True,
+            "dds_inconsistent": False,
+            "dds_origin": "",
+        },
+        "properties": props,
+    }
+
+
+def count_pairs(props):
+    '''
+    Return the number of the nvpairs of the dictionary, the nested
+    ones included.
+    '''
+    count = 0
+    for v in props.values():
+        count += 1
+        if isinstance(v, dict):
+            count += count_pairs(v)
+        elif isinstance(v, list) and v and isinstance(v[0], dict):
+            count += sum(count_pairs(x) for x in v)
+    return count
+
+
+def report_pairs(title, seconds, number, npairs):
+    '''
+    Print the time per nvpair and per record of `number` records.
+    '''
+    print '%-24s %10.1f ns/pair %12.1f us/record' % (
+        title, seconds * 1e9 / (number * npairs), seconds * 1e6 / number)
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -28,6 +28,15 @@ from ._constants import (
     MAXNAMELEN,
 )
 
+from ._nvlist import (
+    NVList,
+    NVListView,
+    pack_nvlist,
+    unpack_nvlist,
+    set_nvlist_cache_size,
+    set_nvlist_codec,
+)
+
 from ._libzfs_core import (
     lzc_create,
     lzc_clone,
@@ -48,20 +57,31 @@ from ._libzfs_core import (
     lzc_recv,
     lzc_exists,
     is_supported,
+    set_backend,
+    set_list_pipe_size,
     lzc_promote,
     lzc_rename,
     lzc_destroy,
     lzc_inherit_prop,
     lzc_set_prop,
     lzc_get_props,
+    lzc_get_props_many,
     lzc_list_children,
     lzc_list_snaps,
+    lzc_list_tree,
+    ListRecord,
 )
 
 __all__ = [
     'ctypes',
     'exceptions',
     'MAXNAMELEN',
+    'NVList',
+    'NVListView',
+    'pack_nvlist',
+    'unpack_nvlist',
+    'set_nvlist_cache_size',
+    'set_nvlist_codec',
     'lzc_create',
     'lzc_clone',
     'lzc_rollback',
@@ -81,14 +101,19 @@ __all__ = [
     'lzc_recv',
     'lzc_exists',
     'is_supported',
+    'set_backend',
+    'set_list_pipe_size',
     'lzc_promote',
     'lzc_rename',
     'lzc_destroy',
     'lzc_inherit_prop',
     'lzc_set_prop',
     'lzc_get_props',
+    'lzc_get_props_many',
     'lzc_list_children',
     'lzc_list_snaps',
+    'lzc_list_tree',
+    'ListRecord',
 ]
 
 # vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
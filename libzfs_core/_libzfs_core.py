@@ -13,18 +13,26 @@ are directly returned.  Error conditions are signalled by exceptions
 rather than by integer error codes.
 """
 
+import collections
 import errno
 import functools
 import fcntl
+import importlib
+import io
 import os
 import struct
+import sys
 import threading
 from . import exceptions
-from . import _error_translation as errors
-from .bindings import libzfs_core
+from .bindings import libnvpair, libzfs_core
 from ._constants import MAXNAMELEN
-from .ctypes import int32_t
-from ._nvlist import nvlist_in, nvlist_out
+from .ctypes import int32_t, uint64_t
+from ._nvlist import (
+    nvlist_in, nvlist_out, NVList, NVListBuilder, NVListView, _as_projection,
+    _extend_projection
+)
+from ._nvlist_native import unpack_native
+from ._properties import encode_props
 
 
 def lzc_create(name, ds_type='zfs', props=None):
@@ -36,7 +44,7 @@ def lzc_create(name, ds_type='zfs', props=None):
                         types are "zfs" (the default) for a filesystem
                         and "zvol" for a volume.
     :param props: a `dict` of ZFS dataset property name-value pairs (empty by default).
-    :type props: dict of bytes:Any
+    :type props: dict of bytes:Any or NVList
 
     :raises FilesystemExists: if a dataset with the given name already exists.
     :raises ParentNotFound: if a parent dataset of the requested dataset does not exist.
@@ -53,8 +61,13 @@ def lzc_create(name, ds_type='zfs', props=None):
         ds_type = _lib.DMU_OST_ZVOL
     else:
         raise exceptions.DatasetTypeInvalid(ds_type)
-    nvlist = nvlist_in(props)
-    ret = _lib.lzc_create(name, ds_type, nvlist)
+    encoded = encode_props(props, settable=True)
+    if encoded is None:
+        # The kernel would reject the properties, skip the call.
+        ret = errno.EINVAL
+    else:
+        nvlist = nvlist_in(encoded, cached=True)
+        ret = _lib.lzc_create(name, ds_type, nvlist)
     errors.lzc_create_translate_error(ret, name, ds_type, props)
 
 
@@ -65,7 +78,7 @@ def lzc_clone(name, origin, props=None):
     :param bytes name: a name of the dataset to be created.
     :param bytes origin: a name of the origin snapshot.
     :param props: a `dict` of ZFS dataset property name-value pairs (empty by default).
-    :type props: dict of bytes:Any
+    :type props: dict of bytes:Any or NVList
 
     :raises FilesystemExists: if a dataset with the given name already exists.
     :raises DatasetNotFound: if either a parent dataset of the requested dataset
@@ -87,8 +100,13 @@ def lzc_clone(name, origin, props=None):
     '''
     if props is None:
         props = {}
-    nvlist = nvlist_in(props)
-    ret = _lib.lzc_clone(name, origin, nvlist)
+    encoded = encode_props(props, settable=True)
+    if encoded is None:
+        # The kernel would reject the properties, skip the call.
+        ret = errno.EINVAL
+    else:
+        nvlist = nvlist_in(encoded, cached=True)
+        ret = _lib.lzc_clone(name, origin, nvlist)
     errors.lzc_clone_translate_error(ret, name, origin, props)
 
 
@@ -125,9 +143,11 @@ def lzc_snapshot(snaps, props=None):
     an exception is raised.
 
     :param snaps: a list of names of snapshots to be created.
+                  Any iterable can be used, the names are consumed
+                  one by one.
     :type snaps: list of bytes
     :param props: a `dict` of ZFS dataset property name-value pairs (empty by default).
-    :type props: dict of bytes:bytes
+    :type props: dict of bytes:bytes or NVList
 
     :raises SnapshotFailure: if one or more snapshots could not be created.
 
@@ -160,14 +180,20 @@ def lzc_snapshot(snaps, props=None):
           The latter is the case when the short name alone exceeds the maximum
           allowed length.
     '''
-    snaps_dict = {name: None for name in snaps}
+    snaps_nvlist = NVListBuilder()
+    snaps_nvlist.add_booleans(snaps)
     errlist = {}
-    snaps_nvlist = nvlist_in(snaps_dict)
     if props is None:
         props = {}
-    props_nvlist = nvlist_in(props)
-    with nvlist_out(errlist) as errlist_nvlist:
-        ret = _lib.lzc_snapshot(snaps_nvlist, props_nvlist, errlist_nvlist)
+    encoded = encode_props(props, snapshot=True)
+    if encoded is None:
+        # The kernel would reject the properties, skip the call.
+        ret = errno.EINVAL
+    else:
+        props_nvlist = nvlist_in(encoded, cached=True)
+        with nvlist_out(errlist) as errlist_nvlist:
+            ret = _lib.lzc_snapshot(nvlist_in(snaps_nvlist), props_nvlist, errlist_nvlist)
+    snaps = _consumed_names(ret, snaps, snaps_nvlist)
     errors.lzc_snapshot_translate_errors(ret, errlist, snaps, props)
 
 
@@ -193,6 +219,8 @@ def lzc_destroy_snaps(snaps, defer):
     later destruction if 'defer' is set) or didn't exist to begin with.
 
     :param snaps: a list of names of snapshots to be destroyed.
+                  Any iterable can be used, the names are consumed
+                  one by one.
     :type snaps: list of bytes
     :param bool defer: whether to mark busy snapshots for deferred destruction
                        rather than immediately failing.
@@ -210,20 +238,35 @@ def lzc_destroy_snaps(snaps, defer):
         A snapshot name referring to a filesystem that doesn't exist is ignored.
         However, non-existent pool name causes :exc:`PoolNotFound`.
     '''
-    snaps_dict = {name: None for name in snaps}
+    snaps_nvlist = NVListBuilder()
+    snaps_nvlist.add_booleans(snaps)
     errlist = {}
-    snaps_nvlist = nvlist_in(snaps_dict)
     with nvlist_out(errlist) as errlist_nvlist:
-        ret = _lib.lzc_destroy_snaps(snaps_nvlist, defer, errlist_nvlist)
+        ret = _lib.lzc_destroy_snaps(nvlist_in(snaps_nvlist), defer, errlist_nvlist)
+    snaps = _consumed_names(ret, snaps, snaps_nvlist)
     errors.lzc_destroy_snaps_translate_errors(ret, errlist, snaps, defer)
 
 
+def _consumed_names(ret, names, builder):
+    '''
+    Return the names for error reporting after they were consumed
+    by the given `NVListBuilder`.
+
+    A list or a tuple is returned as is, any other iterable is exhausted
+    by now, so the names are read back from the nvlist, but only
+    if there is an error to report.
+    '''
+    if ret == 0 or isinstance(names, (list, tuple)):
+        return names
+    return builder.keys()
+
+
 def lzc_bookmark(bookmarks):
     '''
     Create bookmarks.
 
     :param bookmarks: a dict that maps names of wanted bookmarks to names of existing snapshots.
-    :type bookmarks: dict of bytes to bytes
+    :type bookmarks: dict of bytes to bytes or NVList
 
     :raises BookmarkFailure: if any of the bookmarks can not be created for any reason.
 
@@ -281,6 +324,8 @@ def lzc_destroy_bookmarks(bookmarks):
 
     :param bookmarks: a list of the bookmarks to be destroyed.
                       The bookmarks are specified as :file:`{fs}#{bmark}`.
+                      Any iterable can be used, the names are consumed
+                      one by one.
     :type bookmarks: list of bytes
 
     :raises BookmarkDestructionFailure: if any of the bookmarks may not be destroyed.
@@ -295,10 +340,11 @@ def lzc_destroy_bookmarks(bookmarks):
     Either all bookmarks that existed are destroyed or an exception is raised.
     '''
     errlist = {}
-    bmarks_dict = {name: None for name in bookmarks}
-    nvlist = nvlist_in(bmarks_dict)
+    nvlist = NVListBuilder()
+    nvlist.add_booleans(bookmarks)
     with nvlist_out(errlist) as errlist_nvlist:
-        ret = _lib.lzc_destroy_bookmarks(nvlist, errlist_nvlist)
+        ret = _lib.lzc_destroy_bookmarks(nvlist_in(nvlist), errlist_nvlist)
+    bookmarks = _consumed_names(ret, bookmarks, nvlist)
     errors.lzc_destroy_bookmarks_translate_errors(ret, errlist, bookmarks)
 
 
@@ -342,7 +388,7 @@ def lzc_hold(holds, fd=None):
     by :func:`lzc_destroy_snaps` ( ``defer`` = `True` ).)
 
     :param holds: the dictionary of names of the snapshots to hold mapped to the hold names.
-    :type holds: dict of bytes : bytes
+    :type holds: dict of bytes : bytes or NVList
     :type fd: int or None
     :param fd: if not None then it must be the result of :func:`os.open` called as ``os.open("/dev/zfs", O_EXCL)``.
     :type fd: int or None
@@ -393,7 +439,10 @@ def lzc_release(holds):
 
     :param holds: a ``dict`` where keys are snapshot names and values are
                   lists of hold tags to remove.
-    :type holds: dict of bytes : list of bytes
+                  An `NVList` can be passed instead, it must map the snapshot
+                  names to dictionaries with the hold tags as keys and `None`
+                  as values.
+    :type holds: dict of bytes : list of bytes or NVList
     :return: a list of any snapshots that do not exist and of any tags that do not
              exist for existing snapshots.
              Such tags are qualified with a corresponding snapshot name
@@ -410,11 +459,17 @@ def lzc_release(holds):
     Otherwise an exception will be raised.
     '''
     errlist = {}
-    holds_dict = {}
-    for snap, hold_list in holds.iteritems():
-        if not isinstance(hold_list, list):
-            raise TypeError('holds must be in a list')
-        holds_dict[snap] = {hold: None for hold in hold_list}
+    if isinstance(holds, NVList):
+        holds_dict = holds
+        holds = {snap: tags.keys() for snap, tags in holds.iteritems()}
+    else:
+        holds_dict = NVListBuilder()
+        for snap, hold_list in holds.iteritems():
+            if not isinstance(hold_list, list):
+                raise TypeError('holds must be in a list')
+            tags = NVListBuilder()
+            tags.add_booleans(hold_list)
+            holds_dict.add_nested(snap, tags)
     nvlist = nvlist_in(holds_dict)
     with nvlist_out(errlist) as errlist_nvlist:
         ret = _lib.lzc_release(nvlist, errlist_nvlist)
@@ -562,7 +617,7 @@ def lzc_receive(snapname, fd, force=False, origin=None, props=None):
     :param origin: the optional origin snapshot name if the stream is for a clone.
     :type origin: bytes or None
     :param props: the properties to set on the snapshot as *received* properties.
-    :type props: dict of bytes : Any
+    :type props: dict of bytes : Any or NVList
 
     :raises IOError: if an input / output error occurs while reading from the ``fd``.
     :raises DatasetExists: if the snapshot named ``snapname`` already exists.
@@ -644,7 +699,7 @@ def lzc_receive(snapname, fd, force=False, origin=None, props=None):
         c_origin = _ffi.NULL
     if props is None:
         props = {}
-    nvlist = nvlist_in(props)
+    nvlist = nvlist_in(props, cached=True)
     ret = _lib.lzc_receive(snapname, nvlist, c_origin, force, fd)
     errors.lzc_receive_translate_error(ret, snapname, fd, force, origin, props)
 
@@ -668,6 +723,10 @@ def lzc_exists(name):
     return bool(ret)
 
 
+# The verdicts of is_supported, the library can not change once loaded.
+_supported = {}
+
+
 def is_supported(func):
     '''
     Check whether C *libzfs_core* provides implementation required
@@ -679,6 +738,10 @@ def is_supported(func):
     :param function func: the function to check.
     :return bool: whether the function can be used.
     '''
+    try:
+        return _supported[func]
+    except KeyError:
+        pass
     fname = func.__name__
     if fname not in globals():
         raise ValueError(fname + ' is not from libzfs_core')
@@ -688,8 +751,16 @@ def is_supported(func):
         raise ValueError(fname + ' is not a libzfs_core API function')
     check_func = getattr(func, "_check_func", None)
     if check_func is not None:
-        return is_supported(check_func)
-    return getattr(_lib, fname, None) is not None
+        supported = is_supported(check_func)
+    else:
+        supported = getattr(_lib, fname, None) is not None
+    _supported[func] = supported
+    return supported
+
+
+# The functions decorated with _uncommitted, their verdicts are reset
+# when the backend changes.
+_uncommitted_functions = []
 
 
 def _uncommitted(depends_on=None):
@@ -717,11 +788,16 @@ def _uncommitted(depends_on=None):
     def _uncommitted_decorator(func, depends_on=depends_on):
         @functools.wraps(func)
         def _f(*args, **kwargs):
-            if not is_supported(_f):
+            supported = _f._supported
+            if supported is None:
+                supported = _f._supported = is_supported(_f)
+            if not supported:
                 raise NotImplementedError(func.__name__)
             return func(*args, **kwargs)
+        _f._supported = None
         if depends_on is not None:
             _f._check_func = depends_on
+        _uncommitted_functions.append(_f)
         return _f
     return _uncommitted_decorator
 
@@ -838,9 +914,13 @@ def lzc_set_props(name, prop, val):
         An attempt to set a readonly / statistic property is ignored
         without reporting any error.
     '''
-    props = {prop: val}
-    props_nv = nvlist_in(props)
-    ret = _lib.lzc_set_props(name, props_nv, _ffi.NULL, _ffi.NULL)
+    props = encode_props({prop: val})
+    if props is None:
+        # The kernel would reject the property, skip the call.
+        ret = errno.EINVAL
+    else:
+        props_nv = nvlist_in(props, cached=True)
+        ret = _lib.lzc_set_props(name, props_nv, _ffi.NULL, _ffi.NULL)
     errors.lzc_set_prop_translate_error(ret, name, prop, val)
 
 
@@ -872,7 +952,7 @@ def lzc_list(name, options):
     :rtype: tuple of (int, int)
     :raises DatasetNotFound: if the dataset does not exist.
 
-    Two options are currently available:
+    Two options are always available:
 
     recurse : integer or None
         specifies depth of the recursive listing. If ``None`` the
@@ -885,6 +965,21 @@ def lzc_list(name, options):
         Currently allowed keys are "filesystem", "volume", "snapshot".
         Absence of this option implies all types.
 
+    The following options are extensions that a kernel may not support,
+    in which case the call fails with ``EINVAL``:
+
+    props : dict of bytes:None
+        specifies the properties to include into the records.
+        Absence of this option implies all properties.
+
+    mintxg : uint64_t
+        specifies the earliest txg in which the listed elements
+        were created.
+
+    maxtxg : uint64_t
+        specifies the latest txg in which the listed elements
+        were created.
+
     The first of the returned file descriptors can be used to
     read the listing in a binary encounded format.  The data is
     a series of variable sized records each starting with a fixed
@@ -897,10 +992,13 @@ def lzc_list(name, options):
     kernel driver is writing information.  It should not be closed
     until all interesting information has been read and it must
     be explicitly closed afterwards.
+
+    The size of the pipe is set by :func:`set_list_pipe_size`.
+    The call does not return until the kernel has written the records,
+    so a listing that does not fit into the pipe must be read
+    concurrently.
     '''
-    (rfd, wfd) = os.pipe()
-    fcntl.fcntl(rfd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
-    fcntl.fcntl(wfd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+    (rfd, wfd) = _list_pipe()
     options = options.copy()
     options['fd'] = int32_t(wfd)
     opts_nv = nvlist_in(options)
@@ -914,9 +1012,181 @@ def lzc_list(name, options):
 # Description of the binary format used to pass data from the kernel.
 _PIPE_RECORD_FORMAT = 'IBBBB'
 _PIPE_RECORD_SIZE = struct.calcsize(_PIPE_RECORD_FORMAT)
+_pipe_record_header = struct.Struct(_PIPE_RECORD_FORMAT)
+
+# The initial size of the buffer of _PipeRecordReader, the buffer grows
+# if a record does not fit.
+_PIPE_READ_SIZE = 128 * 1024
+
+# The requested size of the pipes of lzc_list, see set_list_pipe_size.
+# The default is the largest size that unprivileged users can set
+# with the default value of /proc/sys/fs/pipe-max-size.
+_list_pipe_size = 1024 * 1024
+
+# fcntl of Python 2 does not define the command.
+_F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+
+
+def set_list_pipe_size(size):
+    '''
+    Set the size of the pipes through which the kernel passes
+    the listings, for example, the listings of :func:`lzc_list_snaps`.
+
+    A larger pipe lets the kernel write more records before it has to
+    wait for them to be read.  The size is supported only on Linux,
+    where the kernel rounds it up to a power of two pages.  If the size
+    can not be set, for example, because it exceeds the limit in
+    ``/proc/sys/fs/pipe-max-size``, then the default size is used.
+
+    :param int size: the size in bytes, zero selects the default size
+                     of the system.  The default is 1 MiB.
+    '''
+    global _list_pipe_size
+    if size < 0:
+        raise ValueError('pipe size must not be negative')
+    _list_pipe_size = size
 
 
-def _list(name, recurse=None, types=None):
+def _list_pipe():
+    '''
+    Create a pipe for the records of ``lzc_list``.
+    '''
+    (rfd, wfd) = os.pipe()
+    fcntl.fcntl(rfd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+    fcntl.fcntl(wfd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+    if _list_pipe_size and sys.platform.startswith('linux'):
+        try:
+            fcntl.fcntl(wfd, _F_SETPIPE_SZ, _list_pipe_size)
+        except IOError:
+            pass
+    return (rfd, wfd)
+
+
+class _ListProducer(threading.Thread):
+    """
+    A thread that makes the ``lzc_list`` call for :func:`_list`.
+
+    The call blocks while the pipe is full, so it is made concurrently
+    with the reading of the records.  The return value of the call is kept
+    in :attr:`ret` for the reader to check after joining the thread.
+    If the call fails, then the thread also writes a record with the error
+    into the pipe, so that a reader that is waiting for more records stops.
+    The record can follow the end of the data written by the library,
+    so the reader must not rely on seeing it.  If the call raises
+    an exception, then the thread writes the end of the data and keeps
+    the exception in :attr:`exc_info` for the reader to re-raise.
+    """
+
+    def __init__(self, name, opts_nv, fd):
+        super(_ListProducer, self).__init__(name='lzc_list')
+        # A blocked call must not prevent the interpreter from exiting.
+        self.daemon = True
+        self._name = name
+        self._opts_nv = opts_nv
+        self._fd = fd
+        self.ret = 0
+        self.exc_info = None
+
+    def run(self):
+        try:
+            ret = _lib.lzc_list(self._name, self._opts_nv)
+        except BaseException:
+            self.exc_info = sys.exc_info()
+            ret = 0
+        else:
+            self.ret = ret
+            if ret == 0:
+                return
+        try:
+            os.write(self._fd, _pipe_record_header.pack(0, 0, ret, 0, 0))
+        except OSError:
+            # The reader has stopped reading.
+            pass
+
+    def reraise(self):
+        '''
+        Re-raise the exception of the call if there was one.
+        '''
+        if self.exc_info is not None:
+            (exc_type, exc_value, exc_tb) = self.exc_info
+            self.exc_info = None
+            raise exc_type, exc_value, exc_tb
+
+
+class _PipeRecordReader(object):
+    """
+    A reader of the records that the kernel writes into the pipe
+    of :func:`lzc_list`.
+
+    The data is read in large chunks into a buffer that is reused,
+    so a read system call is made per many records rather than two
+    per record.  A record can be split between reads, such records
+    are completed by the following reads.
+    """
+
+    def __init__(self, fd, size=_PIPE_READ_SIZE):
+        self._file = io.FileIO(fd, 'r', closefd=False)
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        # The unconsumed data is self._buf[self._start:self._end].
+        self._start = 0
+        self._end = 0
+
+    def _fill(self, needed):
+        '''
+        Read until at least `needed` bytes are available.
+
+        :return: `False` if the end of the data is reached first.
+        '''
+        if self._start + needed > len(self._buf):
+            # Move the unconsumed data to the front, grow the buffer
+            # if even then the data would not fit.
+            pending = self._buf[self._start:self._end]
+            if needed > len(self._buf):
+                self._buf = bytearray(max(needed, 2 * len(self._buf)))
+                self._view = memoryview(self._buf)
+            self._buf[:len(pending)] = pending
+            self._start = 0
+            self._end = len(pending)
+        while self._end - self._start < needed:
+            count = self._file.readinto(self._view[self._end:])
+            if not count:
+                return False
+            self._end += count
+        return True
+
+    def read_record(self):
+        '''
+        Read the next record.
+
+        :return: a tuple of the error number of the record and a `memoryview`
+            of its packed nvlist, or `None` at the end of the data.
+            The view is valid only until the next call.
+        :raises ZFSGenericError: if the data ends in the middle of a record.
+        '''
+        start = self._start
+        end = start + _PIPE_RECORD_SIZE
+        if end > self._end:
+            if not self._fill(_PIPE_RECORD_SIZE):
+                if self._end != self._start:
+                    raise exceptions.ZFSGenericError(errno.EIO, None, "Truncated list data")
+                return None
+            start = self._start
+            end = start + _PIPE_RECORD_SIZE
+        (size, _, err, _, _) = _pipe_record_header.unpack_from(self._buf, start)
+        stop = end + size
+        if stop > self._end:
+            self._start = end
+            if not self._fill(size):
+                raise exceptions.ZFSGenericError(errno.EIO, None, "Truncated list data")
+            end = self._start
+            stop = end + size
+        self._start = stop
+        return (err, self._view[end:stop])
+
+
+def _list(name, recurse=None, types=None, lazy=False, decoder='libnvpair',
+          projection=None, props=None, min_txg=None, max_txg=None):
     '''
     A wrapper for :func:`lzc_list` that hides details of working
     with the file descriptors and provides data in an easy to
@@ -932,10 +1202,45 @@ def _list(name, recurse=None, types=None):
         named by `name`.
     :type types: list of bytes or None
     :type recurse: integer or None
+    :param bool lazy: if `True` then each element is described by
+                      an :class:`NVListView` that converts only the accessed
+                      values, otherwise by a fully converted `dict`.
+    :param bytes decoder: selects how the records are decoded:
+        "libnvpair" unpacks them into nvlists using libnvpair,
+        "python" parses the packed data directly in Python.
+        `lazy` is supported only by the former.
+    :param projection: if not `None` then only the given key paths
+        are decoded, see :func:`nvlist_out`.  It can not be used
+        together with `lazy`.
+    :type projection: iterable of bytes or tuple
+    :param props: if not `None` then only the given properties
+        are listed.  It can not be used together with `lazy`.
+    :type props: iterable of bytes or None
+    :param min_txg: if not `None` then only the elements created
+                    in this txg or later are listed.
+    :param max_txg: if not `None` then only the elements created
+                    in this txg or earlier are listed.
     :return: a list of dictionaries each describing a single listed
              element.
-    :rtype: list of dict
+    :rtype: list of dict or list of NVListView
+
+    `props`, `min_txg` and `max_txg` are passed to the kernel as
+    the "props", "mintxg" and "maxtxg" options of :func:`lzc_list`,
+    so that it does not write what is not needed.  They are applied
+    to the received elements too, so the result is the same if the
+    kernel ignores the options.  If the kernel rejects them, then
+    the listing is repeated without them.  If the repeated listing
+    produces an element, then the options are not passed again
+    until the backend is changed.
     '''
+    if decoder not in ('libnvpair', 'python'):
+        raise ValueError('Unknown decoder %r' % (decoder,))
+    if lazy and decoder != 'libnvpair':
+        raise ValueError('Lazy decoding requires the libnvpair decoder')
+    if projection is not None:
+        if lazy:
+            raise ValueError('Lazy decoding does not support projections')
+        projection = _as_projection(projection)
     options = {}
 
     # Convert types to a dict suitable for mapping to an nvlist.
@@ -945,38 +1250,159 @@ def _list(name, recurse=None, types=None):
     if recurse is None or recurse > 0:
         options['recurse'] = recurse
 
+    extensions = {}
+    if props is not None:
+        if lazy:
+            raise ValueError('Lazy decoding does not support property subsets')
+        props = frozenset(props)
+        extensions['props'] = {x: None for x in props}
+    if min_txg is not None:
+        extensions['mintxg'] = uint64_t(min_txg)
+    if max_txg is not None:
+        extensions['maxtxg'] = uint64_t(max_txg)
+    if (min_txg is not None or max_txg is not None) and projection is not None:
+        projection = _extend_projection(projection, [_CREATION_TXG_PATH])
+    if not is_supported(lzc_list):
+        raise NotImplementedError('lzc_list')
+
+    pushed = {k: v for (k, v) in extensions.iteritems() if k not in _list_rejected_options}
+    rejected = None
+    while True:
+        records = _list_records(name, dict(options, **pushed), bool(pushed),
+                                lazy, decoder, projection)
+        try:
+            for result in records:
+                if rejected:
+                    # The listing works without the options, they are
+                    # the cause of the failure.
+                    _list_rejected_options.update(rejected)
+                    rejected = None
+                if extensions and not _list_filter(result, props, min_txg, max_txg):
+                    continue
+                yield result
+            # An empty listing does not show that the options were
+            # the cause of the failure.
+            return
+        except _ListOptionsRejected:
+            rejected = pushed
+            pushed = {}
+        finally:
+            records.close()
+
+
+# The extended options of lzc_list that the backend has rejected,
+# they are reset by set_backend.
+_list_rejected_options = set()
+
+_CREATION_TXG_PATH = ('dmu_objset_stats', 'dds_creation_txg')
+
+
+class _ListOptionsRejected(Exception):
+    """
+    The kernel has rejected the extended options of a listing.
+    """
+
+
+def _list_filter(result, props, min_txg, max_txg):
+    '''
+    Apply the extended options of :func:`_list` to a listed element.
+
+    :return: whether the element is selected.
+    '''
+    if min_txg is not None or max_txg is not None:
+        txg = result['dmu_objset_stats']['dds_creation_txg']
+        if min_txg is not None and txg < min_txg:
+            return False
+        if max_txg is not None and txg > max_txg:
+            return False
+    if props is not None:
+        properties = result.get('properties')
+        if properties:
+            for prop in properties.keys():
+                if prop not in props:
+                    del properties[prop]
+    return True
+
+
+def _list_records(name, options, rejectable, lazy, decoder, projection):
+    '''
+    Make the listing and produce the decoded elements.
+
+    :raises _ListOptionsRejected: if `rejectable` and the listing
+        fails with an error that means that the options are not supported.
+    '''
     # Note that other_fd is used by the kernel side to write
     # the data, so we have to keep that descriptor open until
     # we are done.
     # Also, we have to explicitly close the descriptor as the
     # kernel doesn't do that.
-    (fd, other_fd) = lzc_list(name, options)
-    if fd is None:
-        return
-
+    (fd, other_fd) = _list_pipe()
+    producer = None
     try:
+        opts_nv = nvlist_in(dict(options, fd=int32_t(other_fd)))
+        # The records are read while the kernel writes them.
+        producer = _ListProducer(name, opts_nv, other_fd)
+        producer.start()
+        reader = _PipeRecordReader(fd)
+        first = True
         while True:
-            record_bytes = os.read(fd, _PIPE_RECORD_SIZE)
-            if not record_bytes:
+            record = reader.read_record()
+            if record is None:
                 break
-            (size, _, err, _, _) = struct.unpack(
-                _PIPE_RECORD_FORMAT, record_bytes)
+            (err, data) = record
             if err == errno.ESRCH:
                 break
+            if first and rejectable and err in (errno.EINVAL, errno.ENOTSUP):
+                raise _ListOptionsRejected()
+            first = False
             errors.lzc_list_translate_error(err, name, options)
+            size = len(data)
             if size == 0:
                 break
-            data_bytes = os.read(fd, size)
-            result = {}
-            with nvlist_out(result) as nvp:
-                ret = _lib.nvlist_unpack(data_bytes, size, nvp, 0)
+            if decoder == 'python':
+                try:
+                    result = unpack_native(data, intern_values=True,
+                                           projection=projection)
+                except ValueError:
+                    raise exceptions.ZFSGenericError(errno.EINVAL, None,
+                                                     "Failed to unpack list data")
+                yield result
+                continue
+            if lazy:
+                result = NVListView()
+            else:
+                result = {}
+            with nvlist_out(result, intern_values=True, projection=projection) as nvp:
+                ret = libnvpair.lib.nvlist_unpack(_ffi.from_buffer(data), size, nvp, 0)
             if ret != 0:
                 raise exceptions.ZFSGenericError(ret, None,
                                                  "Failed to unpack list data")
             yield result
+        producer.join()
+        producer.reraise()
+        # The error record is not seen if it follows the end of the data.
+        if producer.ret != errno.ESRCH:
+            errors.lzc_list_translate_error(producer.ret, name, options)
     finally:
-        os.close(other_fd)
+        # Closing the read end first fails the writes of a producer
+        # that is blocked on the full pipe, so that it can be joined.
         os.close(fd)
+        if producer is not None:
+            producer.join()
+        os.close(other_fd)
+
+
+# Only the values of the properties are returned, except for 'mountpoint'
+# the final value of which depends on its source too.
+_GET_PROPS_PATHS = [
+    ('dmu_objset_stats', 'dds_is_snapshot'),
+    ('properties', '*', 'value'),
+    ('properties', 'mountpoint', 'source'),
+]
+_GET_PROPS_PROJECTION = _as_projection(_GET_PROPS_PATHS)
+
+# Only the names of the listed datasets are needed.
+_LIST_NAMES_PROJECTION = _as_projection(['name'])
 
 
 @_uncommitted(lzc_list)
@@ -1000,9 +1426,19 @@ def lzc_get_props(name):
         with default values.  One exception is the ``mountpoint`` property
         for which the default value is derived from the dataset name.
     '''
-    result = next(_list(name, recurse=0))
+    result = next(_list(name, recurse=0, projection=_GET_PROPS_PROJECTION))
     is_snapshot = result['dmu_objset_stats']['dds_is_snapshot']
-    result = result['properties']
+    return _record_props(name, is_snapshot, result['properties'])
+
+
+def _record_props(name, is_snapshot, result, default_mountpoint=True):
+    '''
+    Convert the properties of a listing record to the values returned
+    by :func:`lzc_get_props`.
+
+    :param bool default_mountpoint: whether the default value of ``mountpoint``
+                                    is added if the property is not in the record.
+    '''
     # In most cases the source of the property is uninteresting and the
     # value alone is sufficient.  One exception is the 'mountpoint'
     # property the final value of which is not the same as the inherited
@@ -1021,7 +1457,7 @@ def lzc_get_props(name):
         # unlike the special values "none" and "legacy".
         if mountpoint_val.startswith('/') and not mountpoint_src.startswith('$'):
             mountpoint_val = mountpoint_val + name[len(mountpoint_src):]
-    elif not is_snapshot:
+    elif not is_snapshot and default_mountpoint:
         mountpoint_val = '/' + name
     else:
         mountpoint_val = None
@@ -1033,17 +1469,67 @@ def lzc_get_props(name):
     return result
 
 
+def _list_names(name, types, limit, min_txg, max_txg):
+    '''
+    Produce the names of the elements of the given types
+    that are immediately subordinate to the given dataset.
+    No properties are listed.
+
+    The pipe of the listing is closed as soon as `limit` names
+    are produced or the consumer stops, so the listing is not
+    continued for nothing.
+    '''
+    if limit is not None and limit < 0:
+        raise ValueError('limit must not be negative')
+    if limit == 0:
+        return iter([])
+    return _iter_names(name, types, limit, min_txg, max_txg)
+
+
+def _iter_names(name, types, limit, min_txg, max_txg):
+    # Only the names are decoded.  The properties are not excluded by the
+    # "props" option, as a kernel that does not know it would fail
+    # the first listing.
+    listing = _list(name, recurse=1, types=types, projection=_LIST_NAMES_PROJECTION,
+                    min_txg=min_txg, max_txg=max_txg)
+    try:
+        count = 0
+        for entry in listing:
+            child = entry['name']
+            if child == name:
+                continue
+            yield child
+            count += 1
+            if count == limit:
+                break
+    finally:
+        listing.close()
+
+
 @_uncommitted(lzc_list)
-def lzc_list_children(name):
+def lzc_list_children(name, limit=None, min_txg=None, max_txg=None):
     '''
     List the children of the ZFS dataset.
 
     :param bytes name: the name of the dataset.
+    :param limit: the maximum number of the children to produce,
+                  `None` for all of them.
+    :type limit: int or None
+    :param min_txg: if not `None` then only the children created
+                    in this txg or later are produced.
+    :type min_txg: int or None
+    :param max_txg: if not `None` then only the children created
+                    in this txg or earlier are produced.
+    :type max_txg: int or None
     :return: an iterator that produces the names of the children.
     :raises NameInvalid: if the dataset name is invalid.
     :raises NameTooLong: if the dataset name is too long.
     :raises DatasetNotFound: if the dataset does not exist.
 
+    The names are produced as they are listed, so the errors are
+    raised by the iterator and the listing is stopped when
+    the iterator is closed or discarded.
+
     .. warning::
         If the dataset does not exist, then the returned iterator would produce
         no results and no error is reported.
@@ -1051,26 +1537,33 @@ def lzc_list_children(name):
 
         An attempt to list children of a snapshot is silently ignored as well.
     '''
-    children = []
-    for entry in _list(name, recurse=1, types=['filesystem', 'volume']):
-        child = entry['name']
-        if child != name:
-            children.append(child)
-
-    return iter(children)
+    return _list_names(name, ['filesystem', 'volume'], limit, min_txg, max_txg)
 
 
 @_uncommitted(lzc_list)
-def lzc_list_snaps(name):
+def lzc_list_snaps(name, limit=None, min_txg=None, max_txg=None):
     '''
     List the snapshots of the ZFS dataset.
 
     :param bytes name: the name of the dataset.
+    :param limit: the maximum number of the snapshots to produce,
+                  `None` for all of them.
+    :type limit: int or None
+    :param min_txg: if not `None` then only the snapshots created
+                    in this txg or later are produced.
+    :type min_txg: int or None
+    :param max_txg: if not `None` then only the snapshots created
+                    in this txg or earlier are produced.
+    :type max_txg: int or None
     :return: an iterator that produces the names of the snapshots.
     :raises NameInvalid: if the dataset name is invalid.
     :raises NameTooLong: if the dataset name is too long.
     :raises DatasetNotFound: if the dataset does not exist.
 
+    The names are produced as they are listed, so the errors are
+    raised by the iterator and the listing is stopped when
+    the iterator is closed or discarded.
+
     .. warning::
         If the dataset does not exist, then the returned iterator would produce
         no results and no error is reported.
@@ -1078,17 +1571,265 @@ def lzc_list_snaps(name):
 
         An attempt to list snapshots of a snapshot is silently ignored as well.
     '''
-    snaps = []
-    for entry in _list(name, recurse=1, types=['snapshot']):
-        snap = entry['name']
-        if snap != name:
-            snaps.append(snap)
+    return _list_names(name, ['snapshot'], limit, min_txg, max_txg)
+
+
+#: A dataset produced by :func:`lzc_list_tree`.
+ListRecord = collections.namedtuple('ListRecord', ['name', 'type', 'parent', 'guid', 'createtxg', 'props'])
+
+_ALL_TYPES = ('filesystem', 'volume', 'snapshot')
+
+# The fields of the records of lzc_list_tree other than the properties.
+_LIST_TREE_FIELDS = [
+    'name',
+    ('dmu_objset_stats', 'dds_is_snapshot'),
+    ('dmu_objset_stats', 'dds_type'),
+    ('dmu_objset_stats', 'dds_guid'),
+    ('dmu_objset_stats', 'dds_creation_txg'),
+]
+
+
+def _list_types(types):
+    '''
+    Check the dataset types to list, `None` selects all types.
+    '''
+    if types is None:
+        return _ALL_TYPES
+    types = list(types)
+    for t in types:
+        if t not in _ALL_TYPES:
+            raise ValueError('Unknown dataset type %r' % (t,))
+    return types
 
-    return iter(snaps)
+
+def _parent_name(name):
+    '''
+    Return the name of the filesystem that contains the given dataset
+    or `None` for a pool.
+    '''
+    for sep in ('@', '/'):
+        pos = name.rfind(sep)
+        if pos >= 0:
+            return name[:pos]
+    return None
+
+
+@_uncommitted(lzc_list)
+def lzc_list_tree(root, depth=None, types=None, props=None, min_txg=None, max_txg=None):
+    '''
+    List the ZFS dataset and its descendants with a single recursive
+    listing.
+
+    :param bytes root: the name of the dataset.
+    :param depth: the maximum depth of the listed datasets relative to
+                  `root`, `None` for no limit.  Zero lists `root` alone,
+                  one lists its children and snapshots too.
+    :type depth: int or None
+    :param types: the types of the datasets to list, "filesystem",
+                  "volume" and "snapshot".  `None` lists all types.
+    :type types: list of bytes or None
+    :param props: the names of the properties to get for each dataset.
+    :type props: list of bytes or None
+    :param min_txg: if not `None` then only the datasets created
+                    in this txg or later are listed.
+    :type min_txg: int or None
+    :param max_txg: if not `None` then only the datasets created
+                    in this txg or earlier are listed.
+    :type max_txg: int or None
+    :return: an iterator that produces a :class:`ListRecord` for each
+             dataset.
+    :raises NameInvalid: if the dataset name is invalid.
+    :raises NameTooLong: if the dataset name is too long.
+    :raises DatasetNotFound: if the dataset does not exist.
+
+    Each record has the following fields:
+
+    name : bytes
+        the name of the dataset
+    type : bytes
+        "filesystem", "volume" or "snapshot"
+    parent : bytes or None
+        the name of the filesystem that contains the dataset,
+        `None` for a pool
+    guid : int
+        the globally unique identifier of the dataset
+    createtxg : int
+        the txg in which the dataset was created
+    props : dict of bytes:Any
+        the values of the requested properties as returned by
+        :func:`lzc_get_props`, the properties with default values
+        are missing except for ``mountpoint``
+
+    Only the requested properties are listed.  A dataset created
+    outside of the range of `min_txg` and `max_txg` is not listed,
+    but its descendants are.
+
+    The records are produced in the order of the listing in which
+    a dataset precedes its snapshots and its descendants.  The records
+    are produced as they are listed, so the errors are raised by
+    the iterator and the listing is stopped when the iterator is closed
+    or discarded.
+    '''
+    if depth is not None and depth < 0:
+        raise ValueError('depth must not be negative')
+    types = _list_types(types)
+    props = list(props) if props is not None else []
+    projection = list(_LIST_TREE_FIELDS)
+    projection.extend(('properties', prop, 'value') for prop in props)
+    if 'mountpoint' in props:
+        projection.append(('properties', 'mountpoint', 'source'))
+    listing = _list(root, recurse=depth, types=types,
+                    projection=_as_projection(projection), props=props,
+                    min_txg=min_txg, max_txg=max_txg)
+    return _iter_tree(listing, 'mountpoint' in props)
+
+
+def _iter_tree(listing, mountpoint):
+    zvol = _lib.DMU_OST_ZVOL
+    try:
+        for entry in listing:
+            name = entry['name']
+            stats = entry['dmu_objset_stats']
+            is_snapshot = stats['dds_is_snapshot']
+            if is_snapshot:
+                ds_type = 'snapshot'
+            elif stats['dds_type'] == zvol:
+                ds_type = 'volume'
+            else:
+                ds_type = 'filesystem'
+            props = _record_props(name, is_snapshot, entry.get('properties', {}),
+                                  default_mountpoint=mountpoint)
+            yield ListRecord(name, ds_type, _parent_name(name), stats['dds_guid'],
+                             stats['dds_creation_txg'], props)
+    finally:
+        listing.close()
+
+
+# The properties of lzc_get_props together with the names of the datasets.
+_GET_PROPS_MANY_PROJECTION = _as_projection(['name'] + _GET_PROPS_PATHS)
+
+
+@_uncommitted(lzc_list)
+def lzc_get_props_many(root=None, names=None, types=None, props=None):
+    '''
+    Get properties of many ZFS datasets.
+
+    Either `root` or `names` must be given.  With `root` the properties
+    of the dataset and all its descendants are got with a single
+    recursive listing.  With `names` the names are grouped by their pool
+    and the properties of a group are got with a listing of the common
+    ancestor of the names, down to the depth of the deepest name.
+
+    :param bytes root: the name of the dataset the descendants of which
+                       are listed.
+    :param names: the names of the datasets.
+    :type names: list of bytes
+    :param types: the types of the datasets listed under `root`,
+        "filesystem", "volume" and "snapshot".  `None` lists all types.
+        It can not be used together with `names`.
+    :type types: list of bytes or None
+    :param props: the names of the properties to get, `None` for all.
+    :type props: list of bytes or None
+    :return: an iterator that produces a pair of the name of a dataset
+             and a dictionary of its properties, the same as returned
+             by :func:`lzc_get_props`, for each dataset.
+    :raises DatasetNotFound: if `root` or one of `names` does not exist.
+    :raises NameInvalid: if a dataset name is invalid.
+    :raises NameTooLong: if a dataset name is too long.
+
+    The pairs are produced as the datasets are listed, so the errors
+    are raised by the iterator.  If some of `names` do not exist, then
+    the pairs of the others in the same group are produced before
+    the error is raised.
+    '''
+    if (root is None) == (names is None):
+        raise ValueError('Exactly one of root and names must be given')
+    if props is not None:
+        props = list(props)
+    default_mountpoint = props is None or 'mountpoint' in props
+    if root is not None:
+        listing = _list(root, recurse=None, types=_list_types(types),
+                        projection=_GET_PROPS_MANY_PROJECTION, props=props)
+        return _iter_props(listing, None, default_mountpoint)
+    if types is not None:
+        raise ValueError('types can not be used together with names')
+    return _iter_props_of_names(_group_names(names), props, default_mountpoint)
+
+
+def _group_names(names):
+    '''
+    Group the names by their pool.
+
+    :return: a list of tuples of the common ancestor of a group,
+             the depth of the deepest name relative to it,
+             the types of the datasets and the names in their order.
+    '''
+    groups = collections.OrderedDict()
+    for name in names:
+        (fs, sep, _) = name.partition('@')
+        group = groups.setdefault(fs.partition('/')[0], collections.OrderedDict())
+        group[name] = (fs.split('/'), bool(sep))
+    result = []
+    for group in groups.itervalues():
+        components = None
+        for (fs_components, _) in group.itervalues():
+            if components is None:
+                components = fs_components
+                continue
+            i = 0
+            while i < min(len(components), len(fs_components)) and \
+                    components[i] == fs_components[i]:
+                i += 1
+            components = components[:i]
+        depth = max(len(c) - len(components) + is_snap
+                    for (c, is_snap) in group.itervalues())
+        types = set()
+        for (_, is_snap) in group.itervalues():
+            types.update(['snapshot'] if is_snap else ['filesystem', 'volume'])
+        result.append(('/'.join(components), depth, sorted(types), group.keys()))
+    return result
+
+
+def _iter_props(listing, wanted, default_mountpoint):
+    '''
+    Produce the properties of the listed datasets, or only of those
+    in the `wanted` set, which are removed from it.
+    The listing is closed when all wanted datasets are found.
+    '''
+    try:
+        for entry in listing:
+            name = entry['name']
+            if wanted is not None:
+                if name not in wanted:
+                    continue
+                wanted.remove(name)
+            is_snapshot = entry['dmu_objset_stats']['dds_is_snapshot']
+            yield (name, _record_props(name, is_snapshot, entry.get('properties', {}),
+                                       default_mountpoint=default_mountpoint))
+            if wanted is not None and not wanted:
+                break
+    finally:
+        listing.close()
+
+
+def _iter_props_of_names(groups, props, default_mountpoint):
+    for (ancestor, depth, types, names) in groups:
+        wanted = set(names)
+        listing = _list(ancestor, recurse=depth, types=types,
+                        projection=_GET_PROPS_MANY_PROJECTION, props=props)
+        try:
+            for pair in _iter_props(listing, wanted, default_mountpoint):
+                yield pair
+        except exceptions.DatasetNotFound:
+            # None of the names exists if their ancestor does not.
+            pass
+        for name in names:
+            if name in wanted:
+                raise exceptions.DatasetNotFound(name)
 
 
 # TODO: a better way to init and uninit the library
-def _initialize():
+def _initialize(lib):
     class LazyInit(object):
 
         def __init__(self, lib):
@@ -1104,12 +1845,86 @@ def _initialize():
                         if ret != 0:
                             raise exceptions.ZFSInitializationFailed(ret)
                         self._inited = True
-            return getattr(self._lib, name)
+            attr = getattr(self._lib, name)
+            # Bind the attribute, so that it is found without calling
+            # this method next time.
+            setattr(self, name, attr)
+            return attr
+
+    return LazyInit(lib)
+
+
+class _LazyModule(object):
+    """
+    A stand-in for a module that is imported when its attribute
+    is used for the first time.
+
+    The error translation is needed only when an operation fails,
+    so it is not imported with this module.
+    """
+
+    def __init__(self, module_name):
+        self._module_name = module_name
+
+    def _module(self):
+        return importlib.import_module(self._module_name, __package__)
+
+    def __getattr__(self, name):
+        value = getattr(self._module(), name)
+        setattr(self, name, value)
+        return value
+
+
+class _LazyErrorTranslation(_LazyModule):
+    """
+    A stand-in for `_error_translation`.
+
+    The translation routines do nothing for a successful call,
+    so the module is imported only when there is an error to translate.
+    """
+
+    def __getattr__(self, name):
+        def _translate(ret, *args):
+            if ret != 0:
+                getattr(self._module(), name)(ret, *args)
+        _translate.__name__ = name
+        setattr(self, name, _translate)
+        return _translate
+
+
+def set_backend(backend=None):
+    '''
+    Select the implementation of the C *libzfs_core* interface used by
+    the functions of this module.
+
+    :param backend: an object that provides the functions and the constants
+        of the C interface with the same signatures and semantics, for example
+        :class:`.simulator.Simulator`, or `None` for the *libzfs_core* library.
+    :return: the previously selected backend or `None` for the library.
+
+    .. note::
+        The selection is global, it should not be changed while the functions
+        of this module are being called.
+    '''
+    global _lib, _backend
+    previous = _backend
+    if backend is None:
+        _lib = _library
+    else:
+        _lib = _initialize(backend)
+    _backend = backend
+    _supported.clear()
+    _list_rejected_options.clear()
+    for func in _uncommitted_functions:
+        func._supported = None
+    return previous
 
-    return LazyInit(libzfs_core.lib)
 
+errors = _LazyErrorTranslation('._error_translation')
 _ffi = libzfs_core.ffi
-_lib = _initialize()
+_library = _initialize(libzfs_core.lib)
+_lib = _library
+_backend = None
 
 
 # vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -13,6 +13,22 @@ nvlist_out takes a dictionary and produces a CData object corresponding
 to a C nvlist_t pointer to pointer suitable for passing as an output parameter.
 Upon exit from a with-block the dictionary is populated based on the nvlist_t.
 
+Instead of a dictionary nvlist_out can also be given an empty NVListView.
+In that case the view takes over the nvlist_t upon exit from the with-block
+and the nvpairs are converted to Python values only when they are accessed.
+
+pack_nvlist and unpack_nvlist convert between a dictionary and
+the serialized form of the corresponding nvlist_t.
+
+The keys of the produced dictionaries are interned in a bounded table
+shared by all conversions, so that many records of the same shape
+share a single copy of each key.  Short string values can be interned
+as well on request.
+
+The conversion from the nvlist_t can be restricted to a projection,
+a set of key paths, so that the nvpairs outside of it are never
+converted, see `nvlist_out`.
+
 The dictionary must follow a certain format to be convertible
 to the nvlist_t.  The dictionary produced from the nvlist_t
 will follow the same format.
@@ -29,38 +45,103 @@ Format:
 - a value can be a list of bools, byte strings, integers or CData objects of types specified above
 - a value can be a list of dictionaries that adhere to this format
 - all elements of a list value must be of the same type
+- a value can be a CFFI CData array of one of the C types specified above,
+  e.g. as created by `libzfs_core.ctypes.uint64_array`
+- a value can be an array.array, a bytearray, a one-dimensional memoryview
+  or a NumPy array of integers in which case it is passed to the C side
+  as a whole and its C type is determined by its item type;
+  a bytearray becomes an array of uchar_t
 """
 
+import array
+import collections
+import functools
 import numbers
+import threading
 from collections import namedtuple
 from contextlib import contextmanager
 from .bindings import libnvpair
 from .ctypes import _type_to_suffix
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 _ffi = libnvpair.ffi
 _lib = libnvpair.lib
 
+# The nvlist_alloc flag of nvlists with unique names.
+_NV_UNIQUE_NAME = 1
+
 
-def nvlist_in(props):
+def nvlist_in(props, cached=False):
     """
     This function converts a python dictionary to a C nvlist_t
     and provides automatic memory management for the latter.
 
-    :param dict props: the dictionary to be converted.
+    If 'props' is an `NVList` or an `NVListBuilder` then its nvlist_t
+    is returned as is.
+
+    :param props: the dictionary to be converted.
+    :type props: dict or NVList or NVListBuilder
+    :param bool cached: whether the conversion result can be looked up in
+                        and stored to the nvlist cache, see `set_nvlist_cache_size`.
+                        The returned nvlist_t may then be shared with other
+                        callers and it must not be modified.
     :return: an FFI CData object representing the nvlist_t pointer.
     :rtype: CData
     """
+    if isinstance(props, (NVList, NVListBuilder)):
+        return props._nvlist
+    if cached and _nvlist_cache.size > 0:
+        return _nvlist_cache.get(props)
+    return _new_nvlist(props)
+
+
+def _new_nvlist(props):
+    nvlist = _ffi.gc(_alloc_nvlist(), _lib.nvlist_free)
+    _dict_to_nvlist(props, nvlist)
+    return nvlist
+
+
+def _alloc_nvlist():
     nvlistp = _ffi.new("nvlist_t **")
-    res = _lib.nvlist_alloc(nvlistp, 1, 0)  # UNIQUE_NAME == 1
+    res = _lib.nvlist_alloc(nvlistp, _NV_UNIQUE_NAME, 0)
     if res != 0:
         raise MemoryError('nvlist_alloc failed')
-    nvlist = _ffi.gc(nvlistp[0], _lib.nvlist_free)
-    _dict_to_nvlist(props, nvlist)
-    return nvlist
+    return nvlistp[0]
 
 
 @contextmanager
-def nvlist_out(props):
+def _temporary_nvlists(dicts):
+    """
+    A context manager that converts dictionaries to C nvlist_t objects
+    that are needed only until they are copied into a parent nvlist_t.
+
+    The nvlist_t objects are not tracked by the garbage collector,
+    they are freed as soon as the 'with' block is left, so a large
+    nested input never has more than one extra copy of a nested level
+    and no finalizers are queued for the temporary copies.
+
+    :param dicts: the dictionaries to be converted.
+    :type dicts: list of dict
+    :return: a list of FFI CData objects representing the nvlist_t pointers.
+    :rtype: list of CData
+    """
+    nvlists = []
+    try:
+        for props in dicts:
+            nvlists.append(_alloc_nvlist())
+            _dict_to_nvlist(props, nvlists[-1])
+        yield nvlists
+    finally:
+        for nvlist in nvlists:
+            _lib.nvlist_free(nvlist)
+
+
+@contextmanager
+def nvlist_out(props, typed_arrays=False, intern_values=False, projection=None):
     """
     A context manager that allocates a pointer to a C nvlist_t and yields
     a CData object representing a pointer to the pointer via 'as' target.
@@ -70,55 +151,429 @@ def nvlist_out(props):
     and also populates the 'props' dictionary with data from the nvlist_t
     upon leaving the 'with' block.
 
-    :param dict props: the dictionary to be populated with data from the nvlist.
+    If 'props' is an `NVListView` then the view takes ownership of
+    the nvlist_t instead and no data is converted upon leaving the block.
+
+    :param props: the dictionary to be populated with data from the nvlist
+                  or the view to be attached to the nvlist.
+    :type props: dict or NVListView
+    :param bool typed_arrays: if `True` then arrays of 8-bit unsigned integers
+                              are produced as `bytes` and arrays of other
+                              integers as `array.array`, both copied from
+                              the nvlist_t in one go; otherwise all arrays
+                              are produced as lists.
+                              Ignored for an `NVListView`, the view has
+                              its own setting.
+    :param bool intern_values: if `True` then short string values are
+                               interned like the keys.  This is useful
+                               when many records with repeated values,
+                               e.g. property sources, are kept around.
+                               Ignored for an `NVListView`.
+    :param projection: if not `None` then only the given key paths are
+        converted and all other nvpairs are skipped.
+        A path is either a tuple of keys or a string of keys separated
+        by dots, e.g. ``"properties.used.value"``, and it selects
+        the whole value at its end.  A key ``*`` matches any key.
+        A projection can not be used with an `NVListView`.
+    :type projection: iterable of bytes or tuple
     :return: an FFI CData object representing the pointer to nvlist_t pointer.
     :rtype: CData
     """
+    if projection is not None:
+        if isinstance(props, NVListView):
+            raise ValueError('NVListView does not support projections')
+        projection = _as_projection(projection)
     nvlistp = _ffi.new("nvlist_t **")
     nvlistp[0] = _ffi.NULL  # to be sure
     try:
         yield nvlistp
-        # clear old entries, if any
-        props.clear()
-        _nvlist_to_dict(nvlistp[0], props)
+        if isinstance(props, NVListView):
+            props._adopt(nvlistp[0])
+            nvlistp[0] = _ffi.NULL
+        else:
+            # clear old entries, if any
+            props.clear()
+            _nvlist_to_dict(nvlistp[0], props, typed_arrays, intern_values, projection)
     finally:
         if nvlistp[0] != _ffi.NULL:
             _lib.nvlist_free(nvlistp[0])
             nvlistp[0] = _ffi.NULL
 
 
+_encodings = {
+    'native': 'NV_ENCODE_NATIVE',
+    'xdr':    'NV_ENCODE_XDR',
+}
+
+
+def pack_nvlist(props, encoding='native'):
+    """
+    Serialize a dictionary in the format of a packed nvlist_t.
+
+    :param props: the dictionary to be serialized.
+    :type props: dict or NVList or NVListBuilder
+    :param str encoding: 'native' for the encoding of the host (the default)
+                         or 'xdr' for the portable XDR encoding.
+    :return: the packed nvlist.
+    :rtype: bytes
+    :raises ValueError: if the encoding is unknown.
+    """
+    try:
+        c_encoding = getattr(_lib, _encodings[encoding])
+    except KeyError:
+        raise ValueError('Unknown nvlist encoding ' + str(encoding))
+    nvlist = nvlist_in(props)
+    sizep = _ffi.new("size_t *")
+    ret = _lib.nvlist_size(nvlist, sizep, c_encoding)
+    if ret != 0:
+        raise RuntimeError('nvlist_size failed, err = %d' % ret)
+    size = sizep[0]
+    buf = _ffi.new("char[]", size)
+    bufp = _ffi.new("char **", buf)
+    ret = _lib.nvlist_pack(nvlist, bufp, sizep, c_encoding, 0)
+    if ret != 0:
+        raise MemoryError('nvlist_pack failed, err = %d' % ret)
+    return _ffi.buffer(buf, sizep[0])[:]
+
+
+def unpack_nvlist(buf, lazy=False, typed_arrays=False, intern_values=False,
+                  projection=None):
+    """
+    Deserialize a packed nvlist_t.
+
+    Both encodings are recognized automatically.
+    The data is not copied on the Python side, so a `memoryview`
+    of a larger buffer can be used to unpack a part of it.
+
+    :param buf: the packed nvlist.
+    :type buf: bytes or bytearray or memoryview
+    :param bool lazy: if `True` then an `NVListView` is returned,
+                      otherwise a `dict`.
+    :param bool typed_arrays: how arrays of integers are produced,
+                              see `nvlist_out`.
+    :param bool intern_values: whether short string values are interned,
+                               see `nvlist_out`.
+    :param projection: the key paths to be converted, see `nvlist_out`.
+    :return: the unpacked data.
+    :rtype: dict or NVListView
+    :raises ValueError: if the data can not be unpacked.
+    """
+    if isinstance(buf, bytes):
+        data = buf
+        size = len(buf)
+    else:
+        try:
+            data = _ffi.from_buffer(buf)
+        except TypeError:
+            # e.g. a memoryview of a string
+            data = memoryview(buf).tobytes()
+        size = len(data)
+    if lazy:
+        result = NVListView(typed_arrays)
+    else:
+        result = {}
+    with nvlist_out(result, typed_arrays, intern_values, projection) as nvp:
+        ret = _lib.nvlist_unpack(data, size, nvp, 0)
+    if ret != 0:
+        raise ValueError('nvlist_unpack failed, err = %d' % ret)
+    return result
+
+
 _TypeInfo = namedtuple('_TypeInfo', ['suffix', 'ctype', 'is_array', 'convert'])
 
+# Conversion information for each nvpair type keyed by the name of the type.
+# convert is None when the value produced by CFFI can be used as is
+# or, for the nested nvlist types, when the value is converted recursively.
+_type_infos = {
+    'DATA_TYPE_BOOLEAN':         _TypeInfo(None, None, False, None),
+    'DATA_TYPE_BOOLEAN_VALUE':   _TypeInfo("boolean_value", "boolean_t *", False, bool),
+    'DATA_TYPE_BYTE':            _TypeInfo("byte", "uchar_t *", False, None),
+    'DATA_TYPE_INT8':            _TypeInfo("int8", "int8_t *", False, None),
+    'DATA_TYPE_UINT8':           _TypeInfo("uint8", "uint8_t *", False, None),
+    'DATA_TYPE_INT16':           _TypeInfo("int16", "int16_t *", False, None),
+    'DATA_TYPE_UINT16':          _TypeInfo("uint16", "uint16_t *", False, None),
+    'DATA_TYPE_INT32':           _TypeInfo("int32", "int32_t *", False, None),
+    'DATA_TYPE_UINT32':          _TypeInfo("uint32", "uint32_t *", False, None),
+    'DATA_TYPE_INT64':           _TypeInfo("int64", "int64_t *", False, None),
+    'DATA_TYPE_UINT64':          _TypeInfo("uint64", "uint64_t *", False, None),
+    'DATA_TYPE_STRING':          _TypeInfo("string", "char **", False, _ffi.string),
+    'DATA_TYPE_NVLIST':          _TypeInfo("nvlist", "nvlist_t **", False, None),
+    'DATA_TYPE_BOOLEAN_ARRAY':   _TypeInfo("boolean_array", "boolean_t **", True, bool),
+    'DATA_TYPE_BYTE_ARRAY':      _TypeInfo("byte_array", "uchar_t **", True, None),
+    'DATA_TYPE_INT8_ARRAY':      _TypeInfo("int8_array", "int8_t **", True, None),
+    'DATA_TYPE_UINT8_ARRAY':     _TypeInfo("uint8_array", "uint8_t **", True, None),
+    'DATA_TYPE_INT16_ARRAY':     _TypeInfo("int16_array", "int16_t **", True, None),
+    'DATA_TYPE_UINT16_ARRAY':    _TypeInfo("uint16_array", "uint16_t **", True, None),
+    'DATA_TYPE_INT32_ARRAY':     _TypeInfo("int32_array", "int32_t **", True, None),
+    'DATA_TYPE_UINT32_ARRAY':    _TypeInfo("uint32_array", "uint32_t **", True, None),
+    'DATA_TYPE_INT64_ARRAY':     _TypeInfo("int64_array", "int64_t **", True, None),
+    'DATA_TYPE_UINT64_ARRAY':    _TypeInfo("uint64_array", "uint64_t **", True, None),
+    'DATA_TYPE_STRING_ARRAY':    _TypeInfo("string_array", "char ***", True, _ffi.string),
+    'DATA_TYPE_NVLIST_ARRAY':    _TypeInfo("nvlist_array", "nvlist_t ***", True, None),
+}
+
+
+_nested_types = ('DATA_TYPE_NVLIST', 'DATA_TYPE_NVLIST_ARRAY')
+
+
+def _bulk_convert(ctype):
+    '''
+    Return a function that converts raw memory of a C array of integers
+    of the given type to `bytes` or `array.array` or `None` if there is
+    no matching `array.array` type code.
+    '''
+    if ctype in (_ffi.typeof('uint8_t'), _ffi.typeof('uchar_t')):
+        return bytes
+    size = _ffi.sizeof(ctype)
+    signed = int(_ffi.cast(ctype, -1)) < 0
+    for code in ('bhilq' if signed else 'BHILQ'):
+        try:
+            if array.array(code).itemsize == size:
+                return functools.partial(array.array, code)
+        except ValueError:
+            # 'q' and 'Q' are not supported by older Pythons.
+            pass
+    return None
+
+
+if hasattr(_ffi, 'unpack'):
+    _unpack = _ffi.unpack
+else:
+    def _unpack(cdata, length):
+        return list(cdata[0:length])
+
+
+class _Decoder(object):
+    """
+    The engine that converts nvpairs to Python values.
+
+    The engine binds the C functions needed for every nvpair type
+    and arranges them in a table indexed by the type identifier.
+    The output cells passed to the C functions are allocated once
+    per thread and are reused for all nvpairs.
+
+    If requested, arrays of integers are converted with a single copy of
+    their memory to `bytes` (8-bit unsigned integers) or to `array.array`
+    (all other widths) rather than to a `list` element by element.
+
+    There is only one engine per process, see `_decoder`.
+    """
+
+    def __init__(self):
+        elements = _ffi.typeof('data_type_t').relements
+        size = max(elements.values()) + 1
+        self._table = [None] * size
+        self._ctypes = [None] * size
+        for type_name, info in _type_infos.items():
+            cfunc = None
+            if info.suffix is not None:
+                cfunc = getattr(_lib, "nvpair_value_%s" % (info.suffix,))
+            nested = type_name in _nested_types
+            bulk = None
+            itemsize = 0
+            if info.is_array and info.convert is None and not nested:
+                item = _ffi.typeof(info.ctype).item.item
+                bulk = _bulk_convert(item)
+                itemsize = _ffi.sizeof(item)
+            self._table[elements[type_name]] = (
+                cfunc, info.is_array, info.convert, nested, bulk, itemsize)
+            self._ctypes[elements[type_name]] = info.ctype
+        self._next_nvpair = _lib.nvlist_next_nvpair
+        self._nvpair_name = _lib.nvpair_name
+        self._nvpair_type = _lib.nvpair_type
+        self._local = threading.local()
+
+    def _scratch(self):
+        local = self._local
+        try:
+            return (local.cells, local.lenp)
+        except AttributeError:
+            local.cells = [_ffi.new(ctype) if ctype is not None else None
+                           for ctype in self._ctypes]
+            local.lenp = _ffi.new("uint_t *")
+            return (local.cells, local.lenp)
+
+    def value(self, pair, typeid, typed_arrays=False):
+        (cells, lenp) = self._scratch()
+        return self._value(pair, typeid, cells, lenp, typed_arrays, False, None)
+
+    def _value(self, pair, typeid, cells, lenp, typed_arrays, intern_values, projection):
+        try:
+            (cfunc, is_array, convert, nested, bulk, itemsize) = self._table[typeid]
+        except (IndexError, TypeError):
+            raise RuntimeError('unsupported nvpair type %d' % (typeid,))
+        if cfunc is None:
+            return None  # XXX or should it be True ?
+        cell = cells[typeid]
+        # XXX nvpair_type_is_array() is broken for  DATA_TYPE_INT8_ARRAY at the moment
+        # see https://www.illumos.org/issues/5778
+        # is_array = bool(_lib.nvpair_type_is_array(pair))
+        if is_array:
+            if cfunc(pair, cell, lenp) != 0:
+                raise RuntimeError('nvpair_value failed')
+            # Read the cells before any nested conversion reuses them.
+            items = cell[0]
+            length = lenp[0]
+            if nested:
+                return [self.to_dict(items[i], {}, typed_arrays, intern_values, projection)
+                        for i in xrange(length)]
+            if typed_arrays and bulk is not None:
+                if length == 0:
+                    return bulk(b'')
+                return bulk(_ffi.buffer(items, length * itemsize)[:])
+            if convert is None:
+                return _unpack(items, length)
+            return [convert(items[i]) for i in xrange(length)]
+        if cfunc(pair, cell) != 0:
+            raise RuntimeError('nvpair_value failed')
+        if nested:
+            return self.to_dict(cell[0], {}, typed_arrays, intern_values, projection)
+        if convert is None:
+            return cell[0]
+        return convert(cell[0])
+
+    def to_dict(self, nvlist, props, typed_arrays=False, intern_values=False,
+                projection=None):
+        if projection is not None:
+            return self._project(nvlist, props, typed_arrays, intern_values, projection)
+        (cells, lenp) = self._scratch()
+        next_nvpair = self._next_nvpair
+        nvpair_name = self._nvpair_name
+        nvpair_type = self._nvpair_type
+        string = _ffi.string
+        null = _ffi.NULL
+        value = self._value
+        intern_key = _intern_key
+        pair = next_nvpair(nvlist, null)
+        while pair != null:
+            val = value(pair, nvpair_type(pair), cells, lenp, typed_arrays, intern_values, None)
+            if intern_values:
+                val = _maybe_intern_value(val)
+            props[intern_key(string(nvpair_name(pair)))] = val
+            pair = next_nvpair(nvlist, pair)
+        return props
+
+    def _project(self, nvlist, props, typed_arrays, intern_values, projection):
+        (cells, lenp) = self._scratch()
+        for (name, pair, sub) in self._select(nvlist, projection):
+            val = self._value(pair, self._nvpair_type(pair), cells, lenp,
+                              typed_arrays, intern_values, sub)
+            if intern_values:
+                val = _maybe_intern_value(val)
+            props[name] = val
+        return props
+
+    def _select(self, nvlist, projection):
+        '''
+        Find the nvpairs selected by the projection.
+
+        Without a wildcard each selected nvpair is looked up on the C side,
+        otherwise all names are compared on the Python side.
+        '''
+        wildcard = projection.get(_WILDCARD, _NOT_SELECTED)
+        if wildcard is _NOT_SELECTED:
+            pairp = self._local_pairp()
+            for (name, sub) in projection.iteritems():
+                if _lib.nvlist_lookup_nvpair(nvlist, name, pairp) == 0:
+                    yield (name, pairp[0], sub)
+            return
+        next_nvpair = self._next_nvpair
+        nvpair_name = self._nvpair_name
+        string = _ffi.string
+        null = _ffi.NULL
+        pair = next_nvpair(nvlist, null)
+        while pair != null:
+            name = _intern_key(string(nvpair_name(pair)))
+            sub = projection.get(name, wildcard)
+            if sub is not _NOT_SELECTED:
+                yield (name, pair, sub)
+            pair = next_nvpair(nvlist, pair)
+
+    def _local_pairp(self):
+        local = self._local
+        try:
+            return local.pairp
+        except AttributeError:
+            local.pairp = _ffi.new("nvpair_t **")
+            return local.pairp
+
+
+_decoder_instance = None
+_decoder_lock = threading.Lock()
+
+
+def _decoder():
+    global _decoder_instance
+    if _decoder_instance is None:
+        with _decoder_lock:
+            if _decoder_instance is None:
+                _decoder_instance = _Decoder()
+    return _decoder_instance
+
+
+_flat_decoder_instance = None
+_flat_decoder_loaded = False
+_flat_decoder_enabled = False
+
+
+def _flat_decoder():
+    '''
+    Return the decoder that uses the compiled codec, see `_nvlist_flat`,
+    or `None` if the codec is not built.
+    '''
+    global _flat_decoder_instance, _flat_decoder_loaded
+    if not _flat_decoder_loaded:
+        with _decoder_lock:
+            if not _flat_decoder_loaded:
+                from ._nvlist_flat import flat_decoder
+                _flat_decoder_instance = flat_decoder()
+                _flat_decoder_loaded = True
+    return _flat_decoder_instance
+
+
+class _InternTable(object):
+    """
+    A bounded table of canonical byte strings.
+
+    Calling the table with a string returns the equal string stored
+    in the table, adding the given one if there is none yet.
+    When the table reaches its size it is cleared rather than grown,
+    so a run of unique strings can not make it grow without bound,
+    while frequently seen strings are quickly added back.
+    A table of size zero returns every string as is.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._table = {}
+
+    def __call__(self, s):
+        table = self._table
+        try:
+            return table[s]
+        except KeyError:
+            if len(table) >= self._size:
+                if self._size == 0:
+                    return s
+                table.clear()
+            return table.setdefault(s, s)
+
+    def __len__(self):
+        return len(self._table)
+
+
+# Separate tables, so that unique values can not push out the keys.
+_intern_key = _InternTable(4096)
+_intern_value = _InternTable(4096)
+# Longer values are unlikely to repeat, e.g. names of datasets.
+_INTERN_VALUE_MAX_LEN = 32
+
+
+def _maybe_intern_value(val):
+    if type(val) is bytes and len(val) <= _INTERN_VALUE_MAX_LEN:
+        return _intern_value(val)
+    return val
 
-def _type_info(typeid):
-    return {
-        _lib.DATA_TYPE_BOOLEAN:         _TypeInfo(None, None, None, None),
-        _lib.DATA_TYPE_BOOLEAN_VALUE:   _TypeInfo("boolean_value", "boolean_t *", False, bool),
-        _lib.DATA_TYPE_BYTE:            _TypeInfo("byte", "uchar_t *", False, int),
-        _lib.DATA_TYPE_INT8:            _TypeInfo("int8", "int8_t *", False, int),
-        _lib.DATA_TYPE_UINT8:           _TypeInfo("uint8", "uint8_t *", False, int),
-        _lib.DATA_TYPE_INT16:           _TypeInfo("int16", "int16_t *", False, int),
-        _lib.DATA_TYPE_UINT16:          _TypeInfo("uint16", "uint16_t *", False, int),
-        _lib.DATA_TYPE_INT32:           _TypeInfo("int32", "int32_t *", False, int),
-        _lib.DATA_TYPE_UINT32:          _TypeInfo("uint32", "uint32_t *", False, int),
-        _lib.DATA_TYPE_INT64:           _TypeInfo("int64", "int64_t *", False, int),
-        _lib.DATA_TYPE_UINT64:          _TypeInfo("uint64", "uint64_t *", False, int),
-        _lib.DATA_TYPE_STRING:          _TypeInfo("string", "char **", False, _ffi.string),
-        _lib.DATA_TYPE_NVLIST:          _TypeInfo("nvlist", "nvlist_t **", False, lambda x: _nvlist_to_dict(x, {})),
-        _lib.DATA_TYPE_BOOLEAN_ARRAY:   _TypeInfo("boolean_array", "boolean_t **", True, bool),
-        # XXX use bytearray ?
-        _lib.DATA_TYPE_BYTE_ARRAY:      _TypeInfo("byte_array", "uchar_t **", True, int),
-        _lib.DATA_TYPE_INT8_ARRAY:      _TypeInfo("int8_array", "int8_t **", True, int),
-        _lib.DATA_TYPE_UINT8_ARRAY:     _TypeInfo("uint8_array", "uint8_t **", True, int),
-        _lib.DATA_TYPE_INT16_ARRAY:     _TypeInfo("int16_array", "int16_t **", True, int),
-        _lib.DATA_TYPE_UINT16_ARRAY:    _TypeInfo("uint16_array", "uint16_t **", True, int),
-        _lib.DATA_TYPE_INT32_ARRAY:     _TypeInfo("int32_array", "int32_t **", True, int),
-        _lib.DATA_TYPE_UINT32_ARRAY:    _TypeInfo("uint32_array", "uint32_t **", True, int),
-        _lib.DATA_TYPE_INT64_ARRAY:     _TypeInfo("int64_array", "int64_t **", True, int),
-        _lib.DATA_TYPE_UINT64_ARRAY:    _TypeInfo("uint64_array", "uint64_t **", True, int),
-        _lib.DATA_TYPE_STRING_ARRAY:    _TypeInfo("string_array", "char ***", True, _ffi.string),
-        _lib.DATA_TYPE_NVLIST_ARRAY:    _TypeInfo("nvlist_array", "nvlist_t ***", True, lambda x: _nvlist_to_dict(x, {})),
-    }[typeid]
 
 # only integer properties need to be here
 _prop_name_to_type_str = {
@@ -157,18 +612,8 @@ def _nvlist_add_array(nvlist, key, array):
                                 _ffi.typeof(element).cname)
 
     if isinstance(specimen, dict):
-        # NB: can't use automatic memory management via nvlist_in() here,
-        # we have a loop, but 'with' would require recursion
-        c_array = []
-        for dictionary in array:
-            nvlistp = _ffi.new('nvlist_t **')
-            res = _lib.nvlist_alloc(nvlistp, 1, 0)  # UNIQUE_NAME == 1
-            if res != 0:
-                raise MemoryError('nvlist_alloc failed')
-            nested_nvlist = _ffi.gc(nvlistp[0], _lib.nvlist_free)
-            _dict_to_nvlist(dictionary, nested_nvlist)
-            c_array.append(nested_nvlist)
-        ret = _lib.nvlist_add_nvlist_array(nvlist, key, c_array, len(c_array))
+        with _temporary_nvlists(array) as c_array:
+            ret = _lib.nvlist_add_nvlist_array(nvlist, key, c_array, len(c_array))
     elif isinstance(specimen, bytes):
         c_array = []
         for string in array:
@@ -190,70 +635,583 @@ def _nvlist_add_array(nvlist, key, array):
         raise MemoryError('nvlist_add failed, err = %d' % ret)
 
 
-def _nvlist_to_dict(nvlist, props):
-    pair = _lib.nvlist_next_nvpair(nvlist, _ffi.NULL)
-    while pair != _ffi.NULL:
-        name = _ffi.string(_lib.nvpair_name(pair))
-        typeid = int(_lib.nvpair_type(pair))
-        typeinfo = _type_info(typeid)
-        # XXX nvpair_type_is_array() is broken for  DATA_TYPE_INT8_ARRAY at the moment
-        # see https://www.illumos.org/issues/5778
-        # is_array = bool(_lib.nvpair_type_is_array(pair))
-        is_array = typeinfo.is_array
-        cfunc = getattr(_lib, "nvpair_value_%s" % (typeinfo.suffix,), None)
-        val = None
-        ret = 0
-        if is_array:
-            valptr = _ffi.new(typeinfo.ctype)
-            lenptr = _ffi.new("uint_t *")
-            ret = cfunc(pair, valptr, lenptr)
-            if ret != 0:
-                raise RuntimeError('nvpair_value failed')
-            length = int(lenptr[0])
-            val = []
-            for i in range(length):
-                val.append(typeinfo.convert(valptr[0][i]))
-        else:
-            if typeid == _lib.DATA_TYPE_BOOLEAN:
-                val = None  # XXX or should it be True ?
+def _nvlist_to_dict(nvlist, props, typed_arrays=False, intern_values=False,
+                    projection=None):
+    if projection is not None:
+        projection = _as_projection(projection)
+    elif _flat_decoder_enabled and not typed_arrays:
+        flat = _flat_decoder()
+        if flat is not None and flat.to_dict(nvlist, props, intern_values):
+            return props
+    return _decoder().to_dict(nvlist, props, typed_arrays, intern_values, projection)
+
+
+_WILDCARD = '*'
+_NOT_SELECTED = object()
+
+
+class _Projection(dict):
+    """
+    A compiled projection: a tree of dictionaries mapping a key to
+    the projection of its value or to `None` if the whole value is
+    selected.
+
+    The projection of a wildcard key is merged into the projections
+    of its sibling keys, as those keys are matched by the wildcard too.
+
+    :param paths: the key paths, see `nvlist_out`.
+    """
+
+    def __init__(self, paths):
+        super(_Projection, self).__init__()
+        if isinstance(paths, bytes):
+            raise TypeError('projection must be an iterable of key paths')
+        for path in paths:
+            if isinstance(path, bytes):
+                path = path.split('.')
+            if not path:
+                raise ValueError('empty key path in projection')
+            _merge_path(self, tuple(path))
+        _merge_wildcards(self)
+
+
+def _merge_path(tree, path):
+    (key, rest) = (path[0], path[1:])
+    if not rest:
+        tree[key] = None
+        return
+    if key in tree:
+        sub = tree[key]
+        if sub is None:
+            return  # the whole value is already selected
+    else:
+        sub = tree[key] = {}
+    _merge_path(sub, rest)
+
+
+def _merge_trees(tree, other):
+    for (key, sub) in other.items():
+        if key not in tree:
+            tree[key] = _copy_tree(sub)
+        elif tree[key] is not None:
+            if sub is None:
+                tree[key] = None
             else:
-                valptr = _ffi.new(typeinfo.ctype)
-                ret = cfunc(pair, valptr)
-                if ret != 0:
-                    raise RuntimeError('nvpair_value failed')
-                val = typeinfo.convert(valptr[0])
-        props[name] = val
-        pair = _lib.nvlist_next_nvpair(nvlist, pair)
-    return props
+                _merge_trees(tree[key], sub)
+
+
+def _copy_tree(tree):
+    if tree is None:
+        return None
+    return {k: _copy_tree(v) for (k, v) in tree.items()}
+
+
+def _merge_wildcards(tree):
+    if tree is None:
+        return
+    wildcard = tree.get(_WILDCARD, _NOT_SELECTED)
+    if wildcard is not _NOT_SELECTED:
+        for key in tree:
+            if key == _WILDCARD or tree[key] is None:
+                continue
+            if wildcard is None:
+                tree[key] = None
+            else:
+                _merge_trees(tree[key], wildcard)
+    for sub in tree.values():
+        _merge_wildcards(sub)
+
+
+def _extend_projection(projection, paths):
+    '''
+    Return a projection that selects the given key paths in addition
+    to what the given projection selects.
+    '''
+    extended = _Projection(paths)
+    _merge_trees(extended, projection)
+    _merge_wildcards(extended)
+    return extended
+
+
+def _as_projection(projection):
+    if isinstance(projection, _Projection):
+        return projection
+    return _Projection(projection)
+
+
+# Maps signedness and size of an integer to the nvlist_add_*_array suffix.
+_int_to_suffix = {
+    (True, 1):  "int8",
+    (False, 1): "uint8",
+    (True, 2):  "int16",
+    (False, 2): "uint16",
+    (True, 4):  "int32",
+    (False, 4): "uint32",
+    (True, 8):  "int64",
+    (False, 8): "uint64",
+}
+
+
+def _is_buffer_array(value):
+    if isinstance(value, (array.array, bytearray, memoryview)):
+        return True
+    return numpy is not None and isinstance(value, numpy.ndarray)
+
+
+def _buffer_array_info(value):
+    '''
+    Determine the nvlist array type of a buffer-like value.
+
+    :return: the suffix of the nvlist_add_*_array function, the object that
+             exposes the memory of the array and the size of an array item.
+    :raises TypeError: if the items are not integers or the memory layout is not supported.
+    '''
+    if isinstance(value, bytearray):
+        return ("byte", value, 1)
+    if isinstance(value, array.array):
+        code = value.typecode
+        if code not in 'bBhHiIlLqQ':
+            raise TypeError('Unsupported array type code ' + code)
+        signed = code.islower()
+        obj = value
+    elif isinstance(value, memoryview):
+        code = value.format.lstrip('@=')
+        if not code or code not in 'bBhHiIlLqQ':
+            raise TypeError('Unsupported memoryview format ' + value.format)
+        if value.ndim != 1 or value.strides != (value.itemsize,):
+            raise TypeError('Only contiguous one-dimensional memoryviews are supported')
+        signed = code.islower()
+        obj = value
+    else:
+        if value.ndim != 1:
+            raise TypeError('Only one-dimensional NumPy arrays are supported')
+        dtype = value.dtype
+        if dtype.kind == 'b':
+            return ("boolean", numpy.ascontiguousarray(value, dtype=numpy.intc), 4)
+        if dtype.kind not in 'iu':
+            raise TypeError('Unsupported NumPy array type ' + str(dtype))
+        signed = dtype.kind == 'i'
+        obj = numpy.ascontiguousarray(value, dtype=dtype.newbyteorder('='))
+    suffix = _int_to_suffix.get((signed, obj.itemsize))
+    if suffix is None:
+        raise TypeError('Unsupported array item size %d' % (obj.itemsize,))
+    return (suffix, obj, obj.itemsize)
+
+
+def _nvlist_add_buffer(nvlist, key, value):
+    (suffix, obj, itemsize) = _buffer_array_info(value)
+    try:
+        buf = _ffi.from_buffer(obj)
+    except TypeError:
+        # e.g. a read-only buffer, it has to be copied.
+        obj = bytearray(memoryview(obj).tobytes())
+        buf = _ffi.from_buffer(obj)
+    length = len(buf) // itemsize
+    ctype = "uchar_t *" if suffix == "byte" else "%s_t *" % (suffix,)
+    cfunc = getattr(_lib, "nvlist_add_%s_array" % (suffix,))
+    ret = cfunc(nvlist, key, _ffi.cast(ctype, buf), length)
+    if ret != 0:
+        raise MemoryError('nvlist_add failed, err = %d' % ret)
 
 
 def _dict_to_nvlist(props, nvlist):
     for k, v in props.items():
-        if not isinstance(k, bytes):
-            raise TypeError('Unsupported key type ' + type(k).__name__)
-        ret = 0
-        if isinstance(v, dict):
-            ret = _lib.nvlist_add_nvlist(nvlist, k, nvlist_in(v))
-        elif isinstance(v, list):
-            _nvlist_add_array(nvlist, k, v)
-        elif isinstance(v, bytes):
-            ret = _lib.nvlist_add_string(nvlist, k, v)
-        elif isinstance(v, bool):
-            ret = _lib.nvlist_add_boolean_value(nvlist, k, v)
-        elif v is None:
-            ret = _lib.nvlist_add_boolean(nvlist, k)
-        elif isinstance(v, numbers.Integral):
-            suffix = _prop_name_to_type_str.get(k, "uint64")
-            cfunc = getattr(_lib, "nvlist_add_%s" % (suffix,))
-            ret = cfunc(nvlist, k, v)
-        elif isinstance(v, _ffi.CData) and _ffi.typeof(v) in _type_to_suffix:
-            suffix = _type_to_suffix[_ffi.typeof(v)][False]
-            cfunc = getattr(_lib, "nvlist_add_%s" % (suffix,))
-            ret = cfunc(nvlist, k, v)
-        else:
-            raise TypeError('Unsupported value type ' + type(v).__name__)
-        if ret != 0:
+        _nvlist_add(nvlist, k, v)
+
+
+def _nvlist_add(nvlist, k, v):
+    if not isinstance(k, bytes):
+        raise TypeError('Unsupported key type ' + type(k).__name__)
+    ret = 0
+    if isinstance(v, dict):
+        with _temporary_nvlists([v]) as (nested,):
+            ret = _lib.nvlist_add_nvlist(nvlist, k, nested)
+    elif isinstance(v, (NVList, NVListBuilder)):
+        ret = _lib.nvlist_add_nvlist(nvlist, k, v._nvlist)
+    elif isinstance(v, list):
+        _nvlist_add_array(nvlist, k, v)
+    elif _is_buffer_array(v):
+        _nvlist_add_buffer(nvlist, k, v)
+    elif isinstance(v, bytes):
+        ret = _lib.nvlist_add_string(nvlist, k, v)
+    elif isinstance(v, bool):
+        ret = _lib.nvlist_add_boolean_value(nvlist, k, v)
+    elif v is None:
+        ret = _lib.nvlist_add_boolean(nvlist, k)
+    elif isinstance(v, numbers.Integral):
+        suffix = _prop_name_to_type_str.get(k, "uint64")
+        cfunc = getattr(_lib, "nvlist_add_%s" % (suffix,))
+        ret = cfunc(nvlist, k, v)
+    elif isinstance(v, _ffi.CData) and _ffi.typeof(v) in _type_to_suffix:
+        suffix = _type_to_suffix[_ffi.typeof(v)][False]
+        cfunc = getattr(_lib, "nvlist_add_%s" % (suffix,))
+        ret = cfunc(nvlist, k, v)
+    elif _is_c_array(v):
+        suffix = _type_to_suffix[_ffi.typeof(v).item][True]
+        cfunc = getattr(_lib, "nvlist_add_%s_array" % (suffix,))
+        ret = cfunc(nvlist, k, v, len(v))
+    else:
+        raise TypeError('Unsupported value type ' + type(v).__name__)
+    if ret != 0:
+        raise MemoryError('nvlist_add failed')
+
+
+def _is_c_array(value):
+    if not isinstance(value, _ffi.CData):
+        return False
+    ctype = _ffi.typeof(value)
+    return ctype.kind == 'array' and ctype.item in _type_to_suffix
+
+
+class NVListBuilder(object):
+    """
+    An incremental constructor of a C nvlist_t.
+
+    The values are added directly to the nvlist_t, no intermediate
+    Python dictionary is needed.  This is useful for large inputs
+    that are produced by an iterator.
+    The values follow the same format as the values of a dictionary
+    that is converted with `nvlist_in`.
+
+    A builder can be passed to `nvlist_in`, in that case its nvlist_t is
+    used as is.  It can also be a value in a dictionary or it can be
+    added to another builder, in that case its nvlist_t is copied.
+    The nvlist_t is freed when the builder is garbage collected.
+    """
+
+    def __init__(self):
+        self._nvlist = _new_nvlist({})
+
+    def add(self, key, value):
+        '''
+        Add a value of any supported type.
+        '''
+        _nvlist_add(self._nvlist, key, value)
+
+    def add_boolean(self, key):
+        '''
+        Add a boolean that represents truth by its mere presence.
+        '''
+        if not isinstance(key, bytes):
+            raise TypeError('Unsupported key type ' + type(key).__name__)
+        if _lib.nvlist_add_boolean(self._nvlist, key) != 0:
             raise MemoryError('nvlist_add failed')
 
+    def add_booleans(self, keys):
+        '''
+        Add a boolean for each of the keys produced by the iterable.
+
+        :return: the number of the consumed keys.
+        :rtype: int
+        '''
+        nvlist = self._nvlist
+        add_boolean = _lib.nvlist_add_boolean
+        count = 0
+        for key in keys:
+            if not isinstance(key, bytes):
+                raise TypeError('Unsupported key type ' + type(key).__name__)
+            if add_boolean(nvlist, key) != 0:
+                raise MemoryError('nvlist_add failed')
+            count += 1
+        return count
+
+    def add_boolean_value(self, key, value):
+        if not isinstance(value, bool):
+            raise TypeError('Unsupported value type ' + type(value).__name__)
+        self.add(key, value)
+
+    def add_string(self, key, value):
+        if not isinstance(value, bytes):
+            raise TypeError('Unsupported value type ' + type(value).__name__)
+        self.add(key, value)
+
+    def add_integer(self, key, value):
+        if not isinstance(value, (numbers.Integral, _ffi.CData)) or isinstance(value, bool):
+            raise TypeError('Unsupported value type ' + type(value).__name__)
+        self.add(key, value)
+
+    def add_nested(self, key, value):
+        '''
+        Add a nested nvlist given as a dictionary, an `NVList` or another builder.
+        '''
+        if not isinstance(value, (dict, NVList, NVListBuilder)):
+            raise TypeError('Unsupported value type ' + type(value).__name__)
+        self.add(key, value)
+
+    def keys(self):
+        '''
+        Return the names of the values added so far, in the order of addition.
+
+        :rtype: list of bytes
+        '''
+        names = []
+        pair = _lib.nvlist_next_nvpair(self._nvlist, _ffi.NULL)
+        while pair != _ffi.NULL:
+            names.append(_ffi.string(_lib.nvpair_name(pair)))
+            pair = _lib.nvlist_next_nvpair(self._nvlist, pair)
+        return names
+
+
+class NVListView(collections.Mapping):
+    """
+    A read-only mapping over a C nvlist_t.
+
+    The view does not convert the whole nvlist_t upfront.
+    Instead, a value is converted when it is accessed for the first time
+    and the converted value is cached.
+    Nested nvlists are represented as views too, they share the memory
+    of the top-level nvlist_t and keep it alive.
+
+    An empty view is created by the constructor.  It can be passed to
+    `nvlist_out` in place of a dictionary, the view then takes ownership
+    of the produced nvlist_t and frees it when the view and all views
+    derived from it are garbage collected.
+
+    If the nvlist_t allows several nvpairs with the same name, then
+    the last of them is the value of the name, the same as in
+    the dictionary produced by `nvlist_out`.
+
+    :param bool typed_arrays: whether arrays of integers are converted
+                              to `bytes` and `array.array` rather than
+                              to lists, see `nvlist_out`.
+    """
+
+    def __init__(self, typed_arrays=False):
+        self._nvlist = _ffi.NULL
+        self._typed_arrays = typed_arrays
+        # A reference to the view that owns the memory of a nested nvlist.
+        self._owner = None
+        self._cache = {}
+        self._names = None
+        self._unique = None
+
+    @classmethod
+    def _nested(cls, nvlist, owner):
+        view = cls(owner._typed_arrays)
+        view._nvlist = nvlist
+        view._owner = owner
+        return view
+
+    def _adopt(self, nvlist):
+        self._cache = {}
+        self._names = None
+        self._unique = None
+        if nvlist == _ffi.NULL:
+            self._nvlist = _ffi.NULL
+        else:
+            self._nvlist = _ffi.gc(nvlist, _lib.nvlist_free)
+
+    def _is_unique(self):
+        if self._unique is None:
+            self._unique = bool(_lib.nvlist_nvflag(self._nvlist) & _NV_UNIQUE_NAME)
+        return self._unique
+
+    def _lookup(self, key):
+        if not isinstance(key, bytes) or self._nvlist == _ffi.NULL:
+            return None
+        if not self._is_unique():
+            # nvlist_lookup_nvpair would find the first of the nvpairs
+            # with the name, the decoded dictionary has the last one.
+            found = None
+            pair = _lib.nvlist_next_nvpair(self._nvlist, _ffi.NULL)
+            while pair != _ffi.NULL:
+                if _ffi.string(_lib.nvpair_name(pair)) == key:
+                    found = pair
+                pair = _lib.nvlist_next_nvpair(self._nvlist, pair)
+            return found
+        pairp = _ffi.new("nvpair_t **")
+        if _lib.nvlist_lookup_nvpair(self._nvlist, key, pairp) != 0:
+            return None
+        return pairp[0]
+
+    def _decode(self, pair):
+        typeid = int(_lib.nvpair_type(pair))
+        owner = self._owner if self._owner is not None else self
+        if typeid == _lib.DATA_TYPE_NVLIST:
+            valptr = _ffi.new("nvlist_t **")
+            if _lib.nvpair_value_nvlist(pair, valptr) != 0:
+                raise RuntimeError('nvpair_value failed')
+            return NVListView._nested(valptr[0], owner)
+        if typeid == _lib.DATA_TYPE_NVLIST_ARRAY:
+            valptr = _ffi.new("nvlist_t ***")
+            lenptr = _ffi.new("uint_t *")
+            if _lib.nvpair_value_nvlist_array(pair, valptr, lenptr) != 0:
+                raise RuntimeError('nvpair_value failed')
+            return [NVListView._nested(valptr[0][i], owner) for i in range(int(lenptr[0]))]
+        return _decoder().value(pair, typeid, self._typed_arrays)
+
+    def __getitem__(self, key):
+        try:
+            return self._cache[key]
+        except (KeyError, TypeError):
+            pass
+        pair = self._lookup(key)
+        if pair is None:
+            raise KeyError(key)
+        val = self._decode(pair)
+        self._cache[key] = val
+        return val
+
+    def __contains__(self, key):
+        return key in self._cache or self._lookup(key) is not None
+
+    def __iter__(self):
+        if self._names is None:
+            names = []
+            if self._nvlist != _ffi.NULL:
+                pair = _lib.nvlist_next_nvpair(self._nvlist, _ffi.NULL)
+                while pair != _ffi.NULL:
+                    names.append(_intern_key(_ffi.string(_lib.nvpair_name(pair))))
+                    pair = _lib.nvlist_next_nvpair(self._nvlist, pair)
+                if not self._is_unique():
+                    seen = set()
+                    names = [n for n in names if not (n in seen or seen.add(n))]
+            self._names = names
+        return iter(self._names)
+
+    def __len__(self):
+        if self._names is None:
+            iter(self)
+        return len(self._names)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, dict(self.iteritems()))
+
+
+class NVList(collections.Mapping):
+    """
+    An immutable dictionary with a prebuilt C nvlist_t.
+
+    The dictionary is converted to the nvlist_t once, when the `NVList`
+    is created, and the nvlist_t is reused every time the `NVList` is passed
+    to a function that would otherwise have to convert the dictionary.
+    This saves repeated conversions when the same properties are used
+    for many operations.
+
+    The nvlist_t is freed when the last reference to the `NVList`
+    goes away.
+
+    :param props: the dictionary to be converted, it must follow the same
+                  format as for any other nvlist input.
+                  The dictionary is copied, subsequent changes to it
+                  do not affect the `NVList`.
+    :type props: dict of bytes:Any
+    """
+
+    def __init__(self, props):
+        if isinstance(props, NVList):
+            self._props = props._props
+            self._nvlist = props._nvlist
+        else:
+            self._props = dict(props)
+            self._nvlist = _new_nvlist(self._props)
+
+    def __getitem__(self, key):
+        return self._props[key]
+
+    def __iter__(self):
+        return iter(self._props)
+
+    def __len__(self):
+        return len(self._props)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self._props)
+
+
+def _freeze(value):
+    '''
+    Produce a hashable representation of a value of a dictionary that can be
+    converted to an nvlist.  The representation includes the types of values
+    as they affect the conversion, e.g. ``1`` and ``True`` are different.
+
+    :raises TypeError: if the value is mutable memory or of an unknown type.
+    '''
+    if isinstance(value, (dict, NVList)):
+        return (dict, frozenset((k, _freeze(v)) for k, v in value.iteritems()))
+    if isinstance(value, list):
+        return (list, tuple(_freeze(x) for x in value))
+    if isinstance(value, _ffi.CData):
+        return (_ffi.typeof(value), int(value))
+    if value is None or isinstance(value, (bytes, numbers.Integral)):
+        return (type(value), value)
+    raise TypeError('Unsupported value type ' + type(value).__name__)
+
+
+class _NVListCache(object):
+    """
+    A least recently used cache of nvlist_t objects keyed by the frozen
+    representation of the dictionaries they were converted from.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def resize(self, size):
+        with self._lock:
+            self.size = size
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def get(self, props):
+        try:
+            key = _freeze(props)
+        except TypeError:
+            return _new_nvlist(props)
+        with self._lock:
+            nvlist = self._entries.pop(key, None)
+            if nvlist is not None:
+                self._entries[key] = nvlist
+                return nvlist
+        nvlist = _new_nvlist(props)
+        with self._lock:
+            self._entries[key] = nvlist
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return nvlist
+
+
+_nvlist_cache = _NVListCache(0)
+
+
+def set_nvlist_cache_size(size):
+    """
+    Set the maximum number of property dictionaries for which converted
+    nvlists are remembered and reused.
+
+    The cache is consulted by the functions that take ZFS properties,
+    for example :func:`.lzc_create` and :func:`.lzc_clone`, when they are
+    given a plain `dict`.  An `NVList` can be used instead of the cache
+    for explicit control over reuse.
+
+    :param int size: the number of entries, zero disables the cache.
+                     The cache is disabled by default.
+    """
+    if size < 0:
+        raise ValueError('cache size must not be negative')
+    _nvlist_cache.resize(size)
+
+
+def set_nvlist_codec(enabled):
+    """
+    Select whether the optional compiled codec converts nvlists
+    to dictionaries.
+
+    The codec converts a whole nvlist with a single call into C.
+    It is built at install time only if a C compiler and the ZFS headers
+    are available, so it is not used unless it is enabled explicitly.
+
+    :param bool enabled: whether the codec is used, it is not used
+                         by default.
+    :return: whether the codec is built, if it is not, then enabling it
+             has no effect.
+    :rtype: bool
+    """
+    global _flat_decoder_enabled
+    _flat_decoder_enabled = bool(enabled)
+    return _flat_decoder() is not None
+
 
 # vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
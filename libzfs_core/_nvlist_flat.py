@@ -0,0 +1,153 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Conversion of a C nvlist_t to a dictionary with the compiled codec.
+
+The optional compiled codec, see `bindings._codec_build`, walks
+the nvlist_t in C and produces a flat encoding of it, which is then
+decoded here.  So, a whole nvlist_t is converted with a single call
+into C instead of several calls per nvpair.  The codec is used only
+after it is enabled with `set_nvlist_codec`.
+
+If the codec is not built, then `flat_decoder` returns `None` and
+the nvlist_t objects are converted nvpair by nvpair as usual.
+"""
+
+import errno
+import struct
+import threading
+
+from ._nvlist import _intern_key, _maybe_intern_value
+
+try:
+    from .bindings import _nvlist_codec
+except ImportError:
+    _nvlist_codec = None
+
+
+class _FlatDecoder(object):
+    """
+    The decoder of the flat encoding.
+
+    The buffer for the encoding is allocated once per thread and
+    it grows as needed.
+    """
+
+    _INITIAL_SIZE = 4096
+
+    def __init__(self, codec):
+        self._ffi = codec.ffi
+        self._lib = codec.lib
+        self._flatten = codec.lib.pyzfs_nvlist_flatten
+        self._u16 = struct.Struct('=H').unpack_from
+        self._u32 = struct.Struct('=I').unpack_from
+        self._i64 = struct.Struct('=q').unpack_from
+        self._u64 = struct.Struct('=Q').unpack_from
+        self._local = threading.local()
+
+    def _scratch(self, size):
+        local = self._local
+        buf = getattr(local, 'buf', None)
+        if buf is None or len(buf) < size:
+            local.buf = buf = self._ffi.new("char[]", max(size, self._INITIAL_SIZE))
+            local.usedp = self._ffi.new("size_t *")
+        return (buf, local.usedp)
+
+    def to_dict(self, nvlist, props, intern_values=False):
+        '''
+        Convert the nvlist_t to the given dictionary.
+
+        :return: `False` if the nvlist_t has nvpairs of a type
+                 not supported by the codec, `True` otherwise.
+        '''
+        (buf, usedp) = self._scratch(0)
+        ret = self._flatten(nvlist, buf, len(buf), usedp)
+        if ret == errno.ENOMEM:
+            (buf, usedp) = self._scratch(usedp[0])
+            ret = self._flatten(nvlist, buf, len(buf), usedp)
+        if ret == errno.ENOTSUP:
+            return False
+        if ret != 0:
+            raise RuntimeError('nvlist flattening failed, err = %d' % (ret,))
+        data = self._ffi.buffer(buf, usedp[0])[:]
+        self._decode(data, 0, props, intern_values)
+        return True
+
+    def _decode(self, data, offset, props, intern_values):
+        lib = self._lib
+        u16 = self._u16
+        u64 = self._u64
+        intern_key = _intern_key
+        while True:
+            kind = ord(data[offset])
+            offset += 1
+            if kind == lib.FLAT_END:
+                return offset
+            (length,) = u16(data, offset)
+            offset += 2
+            name = intern_key(data[offset:offset + length])
+            offset += length
+            if kind == lib.FLAT_UINT:
+                (val,) = u64(data, offset)
+                offset += 8
+            elif kind == lib.FLAT_STRING:
+                (val, offset) = self._string(data, offset)
+                if intern_values:
+                    val = _maybe_intern_value(val)
+            elif kind == lib.FLAT_NVLIST:
+                val = {}
+                offset = self._decode(data, offset, val, intern_values)
+            else:
+                (val, offset) = self._value(data, offset, kind, intern_values)
+            props[name] = val
+
+    def _string(self, data, offset):
+        (length,) = self._u32(data, offset)
+        offset += 4
+        return (data[offset:offset + length], offset + length)
+
+    def _value(self, data, offset, kind, intern_values):
+        lib = self._lib
+        if kind == lib.FLAT_NONE:
+            return (None, offset)
+        if kind == lib.FLAT_BOOL:
+            return (data[offset] != '\0', offset + 1)
+        if kind == lib.FLAT_INT:
+            return (self._i64(data, offset)[0], offset + 8)
+        (count,) = self._u32(data, offset)
+        offset += 4
+        if kind == lib.FLAT_UINT_ARRAY:
+            end = offset + 8 * count
+            return (list(struct.unpack_from('=%dQ' % (count,), data, offset)), end)
+        if kind == lib.FLAT_INT_ARRAY:
+            end = offset + 8 * count
+            return (list(struct.unpack_from('=%dq' % (count,), data, offset)), end)
+        if kind == lib.FLAT_BOOL_ARRAY:
+            end = offset + count
+            return ([x != '\0' for x in data[offset:end]], end)
+        val = []
+        if kind == lib.FLAT_STRING_ARRAY:
+            for _ in xrange(count):
+                (item, offset) = self._string(data, offset)
+                val.append(item)
+            return (val, offset)
+        if kind == lib.FLAT_NVLIST_ARRAY:
+            for _ in xrange(count):
+                item = {}
+                offset = self._decode(data, offset, item, intern_values)
+                val.append(item)
+            return (val, offset)
+        raise RuntimeError('unsupported flat encoding kind %d' % (kind,))
+
+
+def flat_decoder():
+    '''
+    Return the decoder that uses the compiled codec or `None`
+    if the codec is not available.
+    '''
+    if _nvlist_codec is None:
+        return None
+    return _FlatDecoder(_nvlist_codec)
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,246 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+unpack_native converts a packed nvlist_t in the native encoding to
+a dictionary without calling into libnvpair.
+
+The data is parsed in place with `struct.unpack_from`, so it can be
+a `memoryview` of a larger buffer, e.g. of data read from the pipe
+used by ``lzc_list``.  The produced dictionary follows the same
+format as the one produced by `nvlist_out`, its keys and, on request,
+short string values are interned in the same tables.  A projection
+limits the decoding to the given key paths in the same way too,
+the skipped nvpairs are stepped over using only their headers.
+
+The native encoding is a copy of the in-memory nvpair_t structures:
+
+- a 4 byte stream header: encoding, endianness and two reserved bytes
+- nvl_version and nvl_nvflag of the top-level nvlist, 4 bytes each
+- a series of nvpairs each starting with nvp_size, nvp_name_sz,
+  nvp_reserve, nvp_value_elem and nvp_type (16 bytes) followed by
+  the name and by the value at the next 8 byte boundary
+- 4 zero bytes that terminate the nvlist
+- an nvpair of an nvlist (array) type is immediately followed
+  by the nvpairs of the embedded nvlist(s), each terminated
+  by 4 zero bytes
+"""
+
+import struct
+from .bindings import libnvpair
+from ._nvlist import (
+    _intern_key, _maybe_intern_value, _as_projection, _WILDCARD, _NOT_SELECTED
+)
+
+_ffi = libnvpair.ffi
+
+_NV_ENCODE_NATIVE = 0
+_NV_LITTLE_ENDIAN = 1
+
+_STREAM_HEADER_SIZE = 4
+_NVLIST_HEADER_SIZE = 8
+_NVPAIR_HEADER_SIZE = 16
+# Pointers are stored as 64-bit values regardless of the platform.
+_POINTER_SIZE = 8
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _data_types():
+    elements = _ffi.typeof('data_type_t').relements
+
+    def _t(name):
+        return elements['DATA_TYPE_' + name]
+
+    scalars = {
+        _t('BYTE'):             'B',
+        _t('INT8'):             'b',
+        _t('UINT8'):            'B',
+        _t('INT16'):            'h',
+        _t('UINT16'):           'H',
+        _t('INT32'):            'i',
+        _t('UINT32'):           'I',
+        _t('INT64'):            'q',
+        _t('UINT64'):           'Q',
+        _t('HRTIME'):           'q',
+    }
+    arrays = {
+        _t('BYTE_ARRAY'):       'B',
+        _t('INT8_ARRAY'):       'b',
+        _t('UINT8_ARRAY'):      'B',
+        _t('INT16_ARRAY'):      'h',
+        _t('UINT16_ARRAY'):     'H',
+        _t('INT32_ARRAY'):      'i',
+        _t('UINT32_ARRAY'):     'I',
+        _t('INT64_ARRAY'):      'q',
+        _t('UINT64_ARRAY'):     'Q',
+    }
+    return (_t, scalars, arrays)
+
+
+class _NativeDecoder(object):
+    """
+    The decoder for one byte order, all formats are compiled upfront.
+    """
+
+    def __init__(self, order):
+        (_t, scalars, arrays) = _data_types()
+        self._size = struct.Struct(order + 'i')
+        self._pair_header = struct.Struct(order + 'ihhii')
+        self._scalars = {k: struct.Struct(order + v) for k, v in scalars.items()}
+        self._arrays = {k: order + '%d' + v for k, v in arrays.items()}
+        self._boolean_value = struct.Struct(order + 'i')
+        self._BOOLEAN = _t('BOOLEAN')
+        self._BOOLEAN_VALUE = _t('BOOLEAN_VALUE')
+        self._BOOLEAN_ARRAY = _t('BOOLEAN_ARRAY')
+        self._STRING = _t('STRING')
+        self._STRING_ARRAY = _t('STRING_ARRAY')
+        self._NVLIST = _t('NVLIST')
+        self._NVLIST_ARRAY = _t('NVLIST_ARRAY')
+
+    def nvlist(self, buf, offset, intern_values, projection):
+        '''
+        Decode nvpairs starting at the given offset up to and including
+        the terminator.  Only the nvpairs selected by the projection
+        are decoded if it is not `None`.
+
+        :return: the dictionary and the offset after the terminator.
+        '''
+        props = {}
+        read_size = self._size.unpack_from
+        read_header = self._pair_header.unpack_from
+        intern_key = _intern_key
+        if projection is not None:
+            wildcard = projection.get(_WILDCARD, _NOT_SELECTED)
+        while True:
+            (size,) = read_size(buf, offset)
+            if size == 0:
+                return (props, offset + 4)
+            if size < _NVPAIR_HEADER_SIZE or offset + size > len(buf):
+                raise ValueError('Invalid nvpair size %d at offset %d' % (size, offset))
+            (_, name_sz, _, nelem, typeid) = read_header(buf, offset)
+            name_off = offset + _NVPAIR_HEADER_SIZE
+            name = intern_key(buf[name_off:name_off + name_sz - 1].tobytes())
+            value_off = offset + _align(_NVPAIR_HEADER_SIZE + name_sz)
+            end = offset + size
+            sub = None
+            if projection is not None:
+                sub = projection.get(name, wildcard)
+                if sub is _NOT_SELECTED:
+                    offset = self._skip(buf, typeid, nelem, end)
+                    continue
+            (val, offset) = self._value(
+                buf, typeid, nelem, value_off, end, intern_values, sub)
+            if intern_values:
+                val = _maybe_intern_value(val)
+            props[name] = val
+
+    def _skip(self, buf, typeid, nelem, end):
+        '''
+        Step over the embedded nvlists, if any, of the nvpair ending at
+        the given offset.
+
+        :return: the offset after the embedded nvlists.
+        '''
+        if typeid == self._NVLIST:
+            nelem = 1
+        elif typeid != self._NVLIST_ARRAY:
+            return end
+        read_size = self._size.unpack_from
+        read_header = self._pair_header.unpack_from
+        offset = end
+        for _ in xrange(nelem):
+            while True:
+                (size,) = read_size(buf, offset)
+                if size == 0:
+                    offset += 4
+                    break
+                if size < _NVPAIR_HEADER_SIZE or offset + size > len(buf):
+                    raise ValueError('Invalid nvpair size %d at offset %d' % (size, offset))
+                (_, _, _, nested_nelem, nested_typeid) = read_header(buf, offset)
+                offset = self._skip(buf, nested_typeid, nested_nelem, offset + size)
+        return offset
+
+    def _value(self, buf, typeid, nelem, offset, end, intern_values, projection):
+        fmt = self._scalars.get(typeid)
+        if fmt is not None:
+            return (fmt.unpack_from(buf, offset)[0], end)
+        fmt = self._arrays.get(typeid)
+        if fmt is not None:
+            return (list(struct.unpack_from(fmt % (nelem,), buf, offset)), end)
+        if typeid == self._STRING:
+            return (_cstring(buf, offset, end), end)
+        if typeid == self._BOOLEAN:
+            return (None, end)
+        if typeid == self._BOOLEAN_VALUE:
+            return (bool(self._boolean_value.unpack_from(buf, offset)[0]), end)
+        if typeid == self._NVLIST:
+            return self.nvlist(buf, end, intern_values, projection)
+        if typeid == self._NVLIST_ARRAY:
+            val = []
+            for _ in xrange(nelem):
+                (nested, end) = self.nvlist(buf, end, intern_values, projection)
+                val.append(nested)
+            return (val, end)
+        if typeid == self._BOOLEAN_ARRAY:
+            fmt = self._boolean_value.format[0] + '%di' % (nelem,)
+            return ([bool(x) for x in struct.unpack_from(fmt, buf, offset)], end)
+        if typeid == self._STRING_ARRAY:
+            data = buf[offset + nelem * _POINTER_SIZE:end].tobytes()
+            return (data.split(b'\0')[:nelem], end)
+        raise ValueError('Unsupported nvpair type %d' % (typeid,))
+
+
+def _cstring(buf, start, end):
+    data = buf[start:end].tobytes()
+    nul = data.find(b'\0')
+    if nul < 0:
+        raise ValueError('Unterminated string at offset %d' % (start,))
+    return data[:nul]
+
+
+_decoders = {}
+
+
+def _decoder(endian):
+    decoder = _decoders.get(endian)
+    if decoder is None:
+        order = '<' if endian == _NV_LITTLE_ENDIAN else '>'
+        decoder = _decoders.setdefault(endian, _NativeDecoder(order))
+    return decoder
+
+
+def unpack_native(buf, intern_values=False, projection=None):
+    """
+    Convert a packed nvlist_t in the native encoding to a dictionary.
+
+    :param buf: the packed nvlist.
+    :type buf: bytes or bytearray or memoryview
+    :param bool intern_values: whether short string values are interned,
+                               see `nvlist_out`.
+    :param projection: the key paths to be decoded, see `nvlist_out`.
+    :return: the unpacked data.
+    :rtype: dict
+    :raises ValueError: if the data is not a valid packed nvlist
+                        in the native encoding.
+    """
+    if not isinstance(buf, memoryview):
+        buf = memoryview(buf)
+    if len(buf) < _STREAM_HEADER_SIZE + _NVLIST_HEADER_SIZE + 4:
+        raise ValueError('Packed nvlist is too short')
+    (encoding, endian) = struct.unpack_from('BB', buf, 0)
+    if encoding != _NV_ENCODE_NATIVE:
+        raise ValueError('Unsupported nvlist encoding %d' % (encoding,))
+    decoder = _decoder(endian)
+    if projection is not None:
+        projection = _as_projection(projection)
+    try:
+        (props, _) = decoder.nvlist(
+            buf, _STREAM_HEADER_SIZE + _NVLIST_HEADER_SIZE, intern_values, projection)
+    except struct.error as e:
+        raise ValueError('Truncated packed nvlist: %s' % (e,))
+    return props
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
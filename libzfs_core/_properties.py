@@ -0,0 +1,272 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+A registry of ZFS dataset properties.
+
+The registry describes the native properties known to this module:
+the type of each property, the valid range or the valid values and
+whether the property is read-only.  User properties, the names of which
+contain a colon, always have string values.
+
+`encode_props` uses the registry to convert a dictionary of properties
+to the form expected by the kernel and to validate it before
+the dictionary is passed to an ioctl.  For example, the values of
+index properties like ``compression`` can be given by their names
+and they are converted to the numeric values, while a string value
+for a numeric property is rejected without a round-trip to the kernel.
+
+Properties that are not in the registry and that do not look like
+user properties are passed through as is, they may be supported
+by a newer ZFS version.
+"""
+
+from collections import namedtuple
+from .bindings.libnvpair import ffi as _ffi
+from ._nvlist import NVList
+
+_PropSchema = namedtuple('_PropSchema', ['name', 'type', 'values', 'readonly', 'min', 'max'])
+
+_UINT64_MAX = 2 ** 64 - 1
+# ZFS_MAXPROPLEN, the maximum length of a native string property.
+_MAX_STRING_LEN = 1023
+# ZAP_MAXNAMELEN and ZAP_MAXVALUELEN, the limits of a user property.
+_MAX_USER_NAME_LEN = 255
+_MAX_USER_VALUE_LEN = 8191
+_MIN_BLOCK_SIZE = 512
+_MAX_BLOCK_SIZE = 16 * 1024 * 1024
+
+_on_off = {"off": 0, "on": 1}
+_checksum = {
+    "on": 1, "off": 2, "fletcher2": 6, "fletcher4": 7, "sha256": 8,
+    "sha512": 11, "skein": 12, "edonr": 13,
+}
+_dedup = {
+    "on": 1, "off": 2, "verify": 1 | 256, "sha256": 8, "sha256,verify": 8 | 256,
+}
+_compression = {
+    "on": 1, "off": 2, "lzjb": 3, "gzip": 10,
+    "gzip-1": 5, "gzip-2": 6, "gzip-3": 7, "gzip-4": 8, "gzip-5": 9,
+    "gzip-6": 10, "gzip-7": 11, "gzip-8": 12, "gzip-9": 13,
+    "zle": 14, "lz4": 15,
+}
+
+
+def _number(name, min=0, max=_UINT64_MAX, readonly=False):
+    return _PropSchema(name, 'number', None, readonly, min, max)
+
+
+def _string(name, readonly=False):
+    return _PropSchema(name, 'string', None, readonly, None, None)
+
+
+def _index(name, values, readonly=False):
+    return _PropSchema(name, 'index', values, readonly, None, None)
+
+
+_native_props = [
+    # settable
+    _index("aclinherit", {
+        "discard": 0, "noallow": 1, "restricted": 4, "passthrough": 3,
+        "secure": 4, "passthrough-x": 5}),
+    _index("acltype", {"off": 0, "disabled": 0, "noacl": 0, "posixacl": 1}),
+    _index("atime", _on_off),
+    _index("canmount", {"off": 0, "on": 1, "noauto": 2}),
+    _index("checksum", _checksum),
+    _index("compression", _compression),
+    _string("context"),
+    _index("copies", {"1": 1, "2": 2, "3": 3}),
+    _index("dedup", _dedup),
+    _string("defcontext"),
+    _index("devices", _on_off),
+    _index("exec", _on_off),
+    _number("filesystem_limit"),
+    _string("fscontext"),
+    _index("logbias", {"latency": 0, "throughput": 1}),
+    _string("mlslabel"),
+    _string("mountpoint"),
+    _index("nbmand", _on_off),
+    _index("overlay", _on_off),
+    _index("primarycache", {"none": 0, "metadata": 1, "all": 2}),
+    _number("quota"),
+    _index("readonly", _on_off),
+    _number("recordsize", min=_MIN_BLOCK_SIZE, max=_MAX_BLOCK_SIZE),
+    _index("redundant_metadata", {"all": 0, "most": 1}),
+    _number("refquota"),
+    _number("refreservation"),
+    _index("relatime", _on_off),
+    _number("reservation"),
+    _string("rootcontext"),
+    _index("secondarycache", {"none": 0, "metadata": 1, "all": 2}),
+    _index("setuid", _on_off),
+    _string("sharenfs"),
+    _string("sharesmb"),
+    _number("snapshot_limit"),
+    _index("snapdir", {"hidden": 0, "visible": 1}),
+    _index("sync", {"standard": 0, "always": 1, "disabled": 2}),
+    _index("version", {"1": 1, "2": 2, "3": 3, "4": 4, "5": 5, "current": 5}),
+    _index("volmode", {"default": 0, "geom": 1, "dev": 2, "none": 3}),
+    _number("volsize", min=1),
+    _index("vscan", _on_off),
+    _index("xattr", {"off": 0, "on": 1, "dir": 1, "sa": 2}),
+    _index("zoned", _on_off),
+    # settable only at creation
+    _index("casesensitivity", {"sensitive": 0, "insensitive": 1, "mixed": 2}),
+    # The values are the U8_TEXTPREP_* flags.
+    _index("normalization", {
+        "none": 0, "formC": 0x50, "formD": 0x10, "formKC": 0x60, "formKD": 0x20}),
+    _index("utf8only", _on_off),
+    _number("volblocksize", min=_MIN_BLOCK_SIZE, max=_MAX_BLOCK_SIZE),
+    # read-only
+    _number("available", readonly=True),
+    _string("clones", readonly=True),
+    _number("compressratio", readonly=True),
+    _number("createtxg", readonly=True),
+    _number("creation", readonly=True),
+    _index("defer_destroy", _on_off, readonly=True),
+    _number("filesystem_count", readonly=True),
+    _number("guid", readonly=True),
+    _index("inconsistent", _on_off, readonly=True),
+    _number("logicalreferenced", readonly=True),
+    _number("logicalused", readonly=True),
+    _index("mounted", {"no": 0, "yes": 1}, readonly=True),
+    _number("numclones", readonly=True),
+    _number("objsetid", readonly=True),
+    _string("origin", readonly=True),
+    _string("receive_resume_token", readonly=True),
+    _number("referenced", readonly=True),
+    _number("refcompressratio", readonly=True),
+    _number("snapshot_count", readonly=True),
+    _number("type", readonly=True),
+    _number("unique", readonly=True),
+    _number("used", readonly=True),
+    _number("usedbychildren", readonly=True),
+    _number("usedbydataset", readonly=True),
+    _number("usedbyrefreservation", readonly=True),
+    _number("usedbysnapshots", readonly=True),
+    _number("userrefs", readonly=True),
+    _number("written", readonly=True),
+]
+
+_native_schemas = {schema.name: schema for schema in _native_props}
+
+_USER_PROP = _PropSchema(None, 'user', None, False, None, None)
+_VALID_USER_CHARS = frozenset("abcdefghijklmnopqrstuvwxyz0123456789-_.:")
+
+# Lookups are cached, as the same few names are used over and over.
+# The cache is cleared when it fills up, as the names of user properties
+# are not limited.
+_schema_cache = {}
+_SCHEMA_CACHE_SIZE = 1024
+
+
+def prop_schema(name):
+    '''
+    Look up the schema of a property.
+
+    :param bytes name: the name of the property.
+    :return: the schema of a native property, a shared schema
+             for a valid user property or `None` for an unknown
+             or an invalid name.
+    '''
+    try:
+        return _schema_cache[name]
+    except KeyError:
+        pass
+    schema = _native_schemas.get(name)
+    if schema is None and _is_user_prop(name):
+        schema = _USER_PROP
+    if len(_schema_cache) >= _SCHEMA_CACHE_SIZE:
+        _schema_cache.clear()
+    _schema_cache[name] = schema
+    return schema
+
+
+def _is_user_prop(name):
+    return (':' in name and len(name) <= _MAX_USER_NAME_LEN and
+            all(c in _VALID_USER_CHARS for c in name))
+
+
+def _is_integer(value):
+    return isinstance(value, (int, long)) and not isinstance(value, bool)
+
+
+def _encode_value(schema, value):
+    '''
+    Return the value in the form expected by the kernel or `None`
+    if the value is not valid for the property.
+    '''
+    if schema.type == 'user':
+        if isinstance(value, bytes) and len(value) <= _MAX_USER_VALUE_LEN:
+            return value
+        return None
+    if schema.type == 'string':
+        if not isinstance(value, bytes) or len(value) > _MAX_STRING_LEN:
+            return None
+        if schema.name == 'mountpoint' and not (
+                value.startswith('/') or value in ('none', 'legacy')):
+            return None
+        return value
+    if schema.type == 'index':
+        if isinstance(value, bool) and schema.values is _on_off:
+            return int(value)
+        if isinstance(value, bytes):
+            return schema.values.get(value)
+        if _is_integer(value) and value in schema.values.values():
+            return value
+        return None
+    if not _is_integer(value) or not schema.min <= value <= schema.max:
+        return None
+    if schema.name in ('recordsize', 'volblocksize') and value & (value - 1) != 0:
+        return None
+    return value
+
+
+def encode_props(props, snapshot=False, settable=False):
+    '''
+    Convert properties to the form expected by the kernel and validate them.
+
+    Values of properties not known to the registry and CFFI CData values
+    are passed through as is.  Values of read-only properties are passed
+    through as is unless `settable` is set.
+
+    :param props: the properties.
+    :type props: dict of bytes:Any or NVList
+    :param bool snapshot: whether the properties are for snapshots,
+                          only user properties are allowed for them.
+    :param bool settable: whether the properties must be settable,
+                          read-only properties are invalid if so.
+    :return: the converted properties or `None` if any property is invalid.
+             An `NVList` is returned as is if none of its values needs
+             to be converted, otherwise the converted dictionary is returned.
+    :rtype: dict of bytes:Any or NVList or None
+    '''
+    encoded = {}
+    changed = False
+    for (name, value) in props.iteritems():
+        schema = prop_schema(name)
+        if schema is None:
+            if snapshot or ':' in name:
+                return None
+            new_value = value
+        elif snapshot and schema.type != 'user':
+            return None
+        elif schema.readonly:
+            if settable:
+                return None
+            new_value = value
+        elif isinstance(value, _ffi.CData):
+            new_value = value
+        else:
+            new_value = _encode_value(schema, value)
+            if new_value is None:
+                return None
+        if new_value is not value:
+            changed = True
+        encoded[name] = new_value
+    if isinstance(props, NVList) and not changed:
+        # The prebuilt nvlist_t can be used as it is.
+        return props
+    return encoded
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
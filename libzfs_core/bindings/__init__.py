@@ -4,12 +4,51 @@
 The package that contains a module per each C library that
 `libzfs_core` uses.  The modules expose CFFI objects required
 to make calls to functions in the libraries.
+
+The C declarations of all modules are loaded from the precompiled
+``_ffi`` module generated at install time, see `_ffi_build`.
+If the module is not available or it is stale, the declarations are
+parsed at import time.
 """
 
 import threading
 import importlib
+import zlib
+
+MODULES = ["libnvpair", "libzfs_core"]
+
+
+def _cdef_digest(cdefs):
+    return zlib.crc32("".join(cdefs)) & 0x7fffffff
+
+
+def _prebuilt_ffi(cdefs):
+    try:
+        from ._ffi import ffi
+    except ImportError:
+        return None
+    try:
+        digest = ffi.typeof("enum _pyzfs_cdef").relements["_PYZFS_CDEF_DIGEST"]
+    except (ffi.error, KeyError):
+        return None
+    if digest != _cdef_digest(cdefs):
+        return None
+    return ffi
+
+
+def _load_ffi(cdefs):
+    '''
+    Return the FFI object with the declarations, the precompiled one
+    if it is up to date.
+    '''
+    ffi = _prebuilt_ffi(cdefs)
+    if ffi is None:
+        from cffi import FFI
 
-from cffi import FFI
+        ffi = FFI()
+        for cdef in cdefs:
+            ffi.cdef(cdef)
+    return ffi
 
 
 def _setup_cffi():
@@ -27,14 +66,17 @@ def _setup_cffi():
                     if self._lib is None:
                         self._lib = self._ffi.dlopen(self._libname)
 
-            return getattr(self._lib, name)
+            attr = getattr(self._lib, name)
+            # Bind the attribute, so that it is found without calling
+            # this method next time.
+            setattr(self, name, attr)
+            return attr
 
-    MODULES = ["libnvpair", "libzfs_core"]
-    ffi = FFI()
+    modules = [importlib.import_module("." + module_name, __package__)
+               for module_name in MODULES]
+    ffi = _load_ffi([module.CDEF for module in modules])
 
-    for module_name in MODULES:
-        module = importlib.import_module("." + module_name, __package__)
-        ffi.cdef(module.CDEF)
+    for module in modules:
         lib = LazyLibrary(ffi, module.LIBRARY)
         setattr(module, "ffi", ffi)
         setattr(module, "lib", lib)
@@ -0,0 +1,329 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+The builder of the optional compiled nvlist codec.
+
+Unlike the rest of the bindings the codec is built in the CFFI API mode,
+so it requires a C compiler and the libnvpair headers.  It is built
+by ``setup.py`` if possible, otherwise the package works without it.
+For a build in place run ``python libzfs_core/bindings/_codec_build.py``.
+
+The codec walks an nvlist_t in C and writes all its nvpairs to a buffer
+in a flat encoding, so that a whole nvlist_t is converted with a single
+call from Python.  The encoding is a sequence of entries in the native
+byte order:
+
+- an entry starts with a one byte kind, see ``FLAT_*`` below;
+  ``FLAT_END`` terminates an nvlist and has nothing else
+- all other kinds are followed by a 16-bit length of the name
+  and the name itself, then by the value
+- ``FLAT_NONE`` has no value, ``FLAT_BOOL`` has one byte
+- ``FLAT_INT`` and ``FLAT_UINT`` have a 64-bit integer
+- ``FLAT_STRING`` has a 32-bit length and the string itself
+- ``FLAT_NVLIST`` is followed by the entries of the nested nvlist
+- the array kinds have a 32-bit count of the elements followed by
+  the elements encoded as above; booleans take one byte each and
+  integers take eight bytes each
+"""
+
+from cffi import FFI
+
+CDEF = """
+    #define FLAT_END            0
+    #define FLAT_NONE           1
+    #define FLAT_BOOL           2
+    #define FLAT_INT            3
+    #define FLAT_UINT           4
+    #define FLAT_STRING         5
+    #define FLAT_NVLIST         6
+    #define FLAT_BOOL_ARRAY     7
+    #define FLAT_INT_ARRAY      8
+    #define FLAT_UINT_ARRAY     9
+    #define FLAT_STRING_ARRAY   10
+    #define FLAT_NVLIST_ARRAY   11
+
+    int pyzfs_nvlist_flatten(void *, char *, size_t, size_t *);
+"""
+
+SOURCE = """
+#include <errno.h>
+#include <string.h>
+#include <libzfs/sys/nvpair.h>
+
+#define FLAT_END            0
+#define FLAT_NONE           1
+#define FLAT_BOOL           2
+#define FLAT_INT            3
+#define FLAT_UINT           4
+#define FLAT_STRING         5
+#define FLAT_NVLIST         6
+#define FLAT_BOOL_ARRAY     7
+#define FLAT_INT_ARRAY      8
+#define FLAT_UINT_ARRAY     9
+#define FLAT_STRING_ARRAY   10
+#define FLAT_NVLIST_ARRAY   11
+
+typedef struct {
+    char *buf;
+    size_t size;
+    size_t used;
+} flat_t;
+
+/*
+ * The data is copied only while it fits, but the space is always counted,
+ * so that the caller learns the size of the buffer that is needed.
+ */
+static void
+flat_put(flat_t *f, const void *data, size_t len)
+{
+    if (f->used + len <= f->size)
+        memcpy(f->buf + f->used, data, len);
+    f->used += len;
+}
+
+static void
+flat_u8(flat_t *f, uint8_t v)
+{
+    flat_put(f, &v, sizeof (v));
+}
+
+static void
+flat_u32(flat_t *f, uint32_t v)
+{
+    flat_put(f, &v, sizeof (v));
+}
+
+static void
+flat_u64(flat_t *f, uint64_t v)
+{
+    flat_put(f, &v, sizeof (v));
+}
+
+static void
+flat_string(flat_t *f, const char *s)
+{
+    uint32_t len = strlen(s);
+
+    flat_u32(f, len);
+    flat_put(f, s, len);
+}
+
+static void
+flat_head(flat_t *f, uint8_t kind, const char *name)
+{
+    uint16_t len = strlen(name);
+
+    flat_u8(f, kind);
+    flat_put(f, &len, sizeof (len));
+    flat_put(f, name, len);
+}
+
+#define FLAT_INT_ARRAY_CASE(type_id, ctype, getter, kind, conv) \\
+    case type_id: { \\
+        ctype *a; \\
+        if (getter(p, &a, &n) != 0) \\
+            return (EINVAL); \\
+        flat_head(f, kind, name); \\
+        flat_u32(f, n); \\
+        for (i = 0; i < n; i++) \\
+            flat_u64(f, (conv)a[i]); \\
+        break; \\
+    }
+
+static int
+flat_nvlist(flat_t *f, nvlist_t *nvl)
+{
+    nvpair_t *p;
+    uint_t i, n;
+    int err;
+
+    for (p = nvlist_next_nvpair(nvl, NULL); p != NULL;
+        p = nvlist_next_nvpair(nvl, p)) {
+        const char *name = nvpair_name(p);
+
+        switch (nvpair_type(p)) {
+        case DATA_TYPE_BOOLEAN:
+            flat_head(f, FLAT_NONE, name);
+            break;
+        case DATA_TYPE_BOOLEAN_VALUE: {
+            boolean_t v;
+            (void) nvpair_value_boolean_value(p, &v);
+            flat_head(f, FLAT_BOOL, name);
+            flat_u8(f, v != B_FALSE);
+            break;
+        }
+        case DATA_TYPE_BYTE: {
+            uchar_t v;
+            (void) nvpair_value_byte(p, &v);
+            flat_head(f, FLAT_UINT, name);
+            flat_u64(f, v);
+            break;
+        }
+        case DATA_TYPE_INT8: {
+            int8_t v;
+            (void) nvpair_value_int8(p, &v);
+            flat_head(f, FLAT_INT, name);
+            flat_u64(f, (uint64_t)(int64_t)v);
+            break;
+        }
+        case DATA_TYPE_UINT8: {
+            uint8_t v;
+            (void) nvpair_value_uint8(p, &v);
+            flat_head(f, FLAT_UINT, name);
+            flat_u64(f, v);
+            break;
+        }
+        case DATA_TYPE_INT16: {
+            int16_t v;
+            (void) nvpair_value_int16(p, &v);
+            flat_head(f, FLAT_INT, name);
+            flat_u64(f, (uint64_t)(int64_t)v);
+            break;
+        }
+        case DATA_TYPE_UINT16: {
+            uint16_t v;
+            (void) nvpair_value_uint16(p, &v);
+            flat_head(f, FLAT_UINT, name);
+            flat_u64(f, v);
+            break;
+        }
+        case DATA_TYPE_INT32: {
+            int32_t v;
+            (void) nvpair_value_int32(p, &v);
+            flat_head(f, FLAT_INT, name);
+            flat_u64(f, (uint64_t)(int64_t)v);
+            break;
+        }
+        case DATA_TYPE_UINT32: {
+            uint32_t v;
+            (void) nvpair_value_uint32(p, &v);
+            flat_head(f, FLAT_UINT, name);
+            flat_u64(f, v);
+            break;
+        }
+        case DATA_TYPE_INT64: {
+            int64_t v;
+            (void) nvpair_value_int64(p, &v);
+            flat_head(f, FLAT_INT, name);
+            flat_u64(f, (uint64_t)v);
+            break;
+        }
+        case DATA_TYPE_UINT64: {
+            uint64_t v;
+            (void) nvpair_value_uint64(p, &v);
+            flat_head(f, FLAT_UINT, name);
+            flat_u64(f, v);
+            break;
+        }
+        case DATA_TYPE_HRTIME: {
+            hrtime_t v;
+            (void) nvpair_value_hrtime(p, &v);
+            flat_head(f, FLAT_INT, name);
+            flat_u64(f, (uint64_t)v);
+            break;
+        }
+        case DATA_TYPE_STRING: {
+            char *v;
+            (void) nvpair_value_string(p, &v);
+            flat_head(f, FLAT_STRING, name);
+            flat_string(f, v);
+            break;
+        }
+        case DATA_TYPE_NVLIST: {
+            nvlist_t *v;
+            (void) nvpair_value_nvlist(p, &v);
+            flat_head(f, FLAT_NVLIST, name);
+            if ((err = flat_nvlist(f, v)) != 0)
+                return (err);
+            break;
+        }
+        case DATA_TYPE_BOOLEAN_ARRAY: {
+            boolean_t *a;
+            if (nvpair_value_boolean_array(p, &a, &n) != 0)
+                return (EINVAL);
+            flat_head(f, FLAT_BOOL_ARRAY, name);
+            flat_u32(f, n);
+            for (i = 0; i < n; i++)
+                flat_u8(f, a[i] != B_FALSE);
+            break;
+        }
+        FLAT_INT_ARRAY_CASE(DATA_TYPE_BYTE_ARRAY, uchar_t,
+            nvpair_value_byte_array, FLAT_UINT_ARRAY, uint64_t)
+        FLAT_INT_ARRAY_CASE(DATA_TYPE_INT8_ARRAY, int8_t,
+            nvpair_value_int8_array, FLAT_INT_ARRAY, int64_t)
+        FLAT_INT_ARRAY_CASE(DATA_TYPE_UINT8_ARRAY, uint8_t,
+            nvpair_value_uint8_array, FLAT_UINT_ARRAY, uint64_t)
+        FLAT_INT_ARRAY_CASE(DATA_TYPE_INT16_ARRAY, int16_t,
+            nvpair_value_int16_array, FLAT_INT_ARRAY, int64_t)
+        FLAT_INT_ARRAY_CASE(DATA_TYPE_UINT16_ARRAY, uint16_t,
+            nvpair_value_uint16_array, FLAT_UINT_ARRAY, uint64_t)
+        FLAT_INT_ARRAY_CASE(DATA_TYPE_INT32_ARRAY, int32_t,
+            nvpair_value_int32_array, FLAT_INT_ARRAY, int64_t)
+        FLAT_INT_ARRAY_CASE(DATA_TYPE_UINT32_ARRAY, uint32_t,
+            nvpair_value_uint32_array, FLAT_UINT_ARRAY, uint64_t)
+        FLAT_INT_ARRAY_CASE(DATA_TYPE_INT64_ARRAY, int64_t,
+            nvpair_value_int64_array, FLAT_INT_ARRAY, int64_t)
+        FLAT_INT_ARRAY_CASE(DATA_TYPE_UINT64_ARRAY, uint64_t,
+            nvpair_value_uint64_array, FLAT_UINT_ARRAY, uint64_t)
+        case DATA_TYPE_STRING_ARRAY: {
+            char **a;
+            if (nvpair_value_string_array(p, &a, &n) != 0)
+                return (EINVAL);
+            flat_head(f, FLAT_STRING_ARRAY, name);
+            flat_u32(f, n);
+            for (i = 0; i < n; i++)
+                flat_string(f, a[i]);
+            break;
+        }
+        case DATA_TYPE_NVLIST_ARRAY: {
+            nvlist_t **a;
+            if (nvpair_value_nvlist_array(p, &a, &n) != 0)
+                return (EINVAL);
+            flat_head(f, FLAT_NVLIST_ARRAY, name);
+            flat_u32(f, n);
+            for (i = 0; i < n; i++) {
+                if ((err = flat_nvlist(f, a[i])) != 0)
+                    return (err);
+            }
+            break;
+        }
+        default:
+            return (ENOTSUP);
+        }
+    }
+    flat_u8(f, FLAT_END);
+    return (0);
+}
+
+/*
+ * Write the flat encoding of the nvlist to the buffer.
+ * The size of the encoding is returned via 'used' even if it does not fit
+ * the buffer, in which case ENOMEM is returned.
+ */
+int
+pyzfs_nvlist_flatten(void *nvl, char *buf, size_t size, size_t *used)
+{
+    flat_t f = { buf, size, 0 };
+    int err;
+
+    err = flat_nvlist(&f, (nvlist_t *)nvl);
+    *used = f.used;
+    if (err == 0 && f.used > size)
+        err = ENOMEM;
+    return (err);
+}
+"""
+
+ffibuilder = FFI()
+ffibuilder.cdef(CDEF)
+ffibuilder.set_source(
+    "libzfs_core.bindings._nvlist_codec", SOURCE,
+    libraries=["nvpair"],
+    include_dirs=["/usr/include/libzfs", "/usr/include/libspl"])
+
+
+if __name__ == "__main__":
+    ffibuilder.compile(verbose=True)
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
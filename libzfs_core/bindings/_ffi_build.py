@@ -0,0 +1,54 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+The builder of the precompiled CFFI declarations.
+
+Parsing the C declarations of the bindings with ``ffi.cdef()`` takes
+a noticeable part of the import time of `libzfs_core`.  This builder
+parses them once, at install time, and generates the out-of-line
+ABI mode module ``_ffi`` that loads the declarations without parsing.
+No C compiler is needed.  For a build in place run
+``python libzfs_core/bindings/_ffi_build.py``.
+
+The declarations are tagged with a digest of their source, so that
+a stale ``_ffi`` module is ignored rather than used, see `bindings`.
+"""
+
+import imp
+import os
+import zlib
+
+from cffi import FFI
+
+# Must match bindings.MODULES and bindings._cdef_digest.
+MODULES = ["libnvpair", "libzfs_core"]
+
+
+def _cdef_digest(cdefs):
+    return zlib.crc32("".join(cdefs)) & 0x7fffffff
+
+
+def _load_cdefs():
+    directory = os.path.dirname(os.path.abspath(__file__))
+    cdefs = []
+    for module_name in MODULES:
+        module = imp.load_source(
+            "_pyzfs_ffi_build_" + module_name, os.path.join(directory, module_name + ".py"))
+        cdefs.append(module.CDEF)
+    return cdefs
+
+
+_cdefs = _load_cdefs()
+
+ffibuilder = FFI()
+for _cdef in _cdefs:
+    ffibuilder.cdef(_cdef)
+ffibuilder.cdef("enum _pyzfs_cdef { _PYZFS_CDEF_DIGEST = %d };" % (_cdef_digest(_cdefs),))
+ffibuilder.set_source("libzfs_core.bindings._ffi", None)
+
+
+if __name__ == "__main__":
+    ffibuilder.compile(verbose=True)
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -46,6 +46,11 @@ CDEF = """
     int nvlist_alloc(nvlist_t **, uint_t, int);
     void nvlist_free(nvlist_t *);
 
+    #define NV_ENCODE_NATIVE 0
+    #define NV_ENCODE_XDR 1
+
+    int nvlist_size(nvlist_t *, size_t *, int);
+    int nvlist_pack(nvlist_t *, char **, size_t *, int, int);
     int nvlist_unpack(char *, size_t, nvlist_t **, int);
 
     void dump_nvlist(nvlist_t *, int);
@@ -77,6 +82,9 @@ CDEF = """
     int nvlist_add_string_array(nvlist_t *, const char *, char *const *, uint_t);
     int nvlist_add_nvlist_array(nvlist_t *, const char *, nvlist_t **, uint_t);
 
+    int nvlist_lookup_nvpair(nvlist_t *, const char *, nvpair_t **);
+    uint_t nvlist_nvflag(nvlist_t *);
+
     nvpair_t *nvlist_next_nvpair(nvlist_t *, nvpair_t *);
     nvpair_t *nvlist_prev_nvpair(nvlist_t *, nvpair_t *);
     char *nvpair_name(nvpair_t *);
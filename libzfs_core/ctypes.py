@@ -2,26 +2,65 @@
 
 """
 Utility functions for casting to a specific C type.
+
+Each of the scalar functions, e.g. `uint32_t`, checks that the value fits
+the C type and casts it.  Each of the array functions, e.g. `uint32_array`,
+creates a C array of the type from an iterable of values, the array can be
+used as an nvlist value without converting the values one by one.
 """
 
 from .bindings.libnvpair import ffi as _ffi
 
 
+def _int_bounds(type_name):
+    bits = _ffi.sizeof(type_name) * 8
+    if _ffi.cast(type_name, -1) < 0:
+        return (-2 ** (bits - 1), 2 ** (bits - 1) - 1)
+    return (0, 2 ** bits - 1)
+
+
 def _ffi_cast(type_name):
     type_info = _ffi.typeof(type_name)
 
-    def _func(value):
-        # this is for overflow / underflow checking only
-        if type_info.kind == 'enum':
-            try:
-                type_info.elements[value]
-            except KeyError as e:
+    # The checks are for overflow / underflow only.
+    if type_info.kind == 'enum':
+        valid = frozenset(type_info.elements)
+
+        def _check(value):
+            if value not in valid:
                 raise OverflowError('Invalid enum <%s> value %s' %
-                                    (type_info.cname, e.message))
-        else:
-            _ffi.new(type_name + '*', value)
+                                    (type_info.cname, value))
+    else:
+        (low, high) = _int_bounds(type_name)
+
+        def _check(value):
+            if type(value) not in (int, long):
+                # Let CFFI deal with other types.
+                _ffi.new(type_name + '*', value)
+            elif not low <= value <= high:
+                raise OverflowError('integer %s does not fit \'%s\'' %
+                                    (value, type_info.cname))
+
+    def _func(value):
+        _check(value)
         return _ffi.cast(type_name, value)
     _func.__name__ = type_name
+    _func._check = _check
+    return _func
+
+
+def _ffi_array(type_name, scalar):
+    array_type = _ffi.typeof(type_name + '[]')
+    check_enum = _ffi.typeof(type_name).kind == 'enum'
+
+    def _func(values):
+        values = list(values)
+        if check_enum:
+            for value in values:
+                scalar._check(value)
+        # CFFI checks the integer values while filling the array.
+        return _ffi.new(array_type, values)
+    _func.__name__ = type_name[:-len('_t')] + '_array'
     return _func
 
 
@@ -36,6 +75,17 @@ int64_t =       _ffi_cast('int64_t')
 boolean_t =     _ffi_cast('boolean_t')
 uchar_t =       _ffi_cast('uchar_t')
 
+uint8_array =   _ffi_array('uint8_t', uint8_t)
+int8_array =    _ffi_array('int8_t', int8_t)
+uint16_array =  _ffi_array('uint16_t', uint16_t)
+int16_array =   _ffi_array('int16_t', int16_t)
+uint32_array =  _ffi_array('uint32_t', uint32_t)
+int32_array =   _ffi_array('int32_t', int32_t)
+uint64_array =  _ffi_array('uint64_t', uint64_t)
+int64_array =   _ffi_array('int64_t', int64_t)
+boolean_array = _ffi_array('boolean_t', boolean_t)
+uchar_array =   _ffi_array('uchar_t', uchar_t)
+
 
 # First element of the value tuple is a suffix for a single value function
 # while the second element is for an array function
@@ -0,0 +1,351 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Injection of latency and failures into a *libzfs_core* backend.
+
+:class:`FaultInjector` wraps an object that implements the C interface
+of libzfs_core, either the library itself or a
+:class:`~libzfs_core.simulator.Simulator`, and can be selected with
+:func:`libzfs_core.set_backend`.  It delays the calls and makes them
+fail according to the configured rules and passes them on otherwise.
+
+The functions that modify the pool wait for a transaction group (txg)
+to be synced, as they do in the kernel.  Only one txg is synced at
+a time, so the calls made while a txg is being synced are batched into
+the next txg and all of them wait for it.  The time that it takes to
+sync a txg can grow with the number of the names passed to the calls.
+
+The delays are drawn from seeded random generators and they can be
+taken on a :class:`VirtualClock`, which makes the measurements
+reproducible and as fast as the simulator itself.
+
+Example::
+
+    clock = VirtualClock()
+    injector = FaultInjector(Simulator(), seed=1, clock=clock,
+                             sync_time=uniform(0.05, 0.2), sync_time_per_name=0.0001)
+    injector.inject('lzc_snapshot', errno.EEXIST, rate=0.01)
+    libzfs_core.set_backend(injector)
+"""
+
+import math
+import random
+import threading
+import time
+
+from ._nvlist import _nvlist_to_dict
+from .simulator import _errlist, _is_null, _set_nvlist
+
+
+def constant(seconds):
+    '''
+    Return a distribution that always produces the given delay.
+    '''
+    return lambda rng: seconds
+
+
+def uniform(low, high):
+    '''
+    Return a distribution of delays uniform between `low` and `high` seconds.
+    '''
+    return lambda rng: rng.uniform(low, high)
+
+
+def exponential(mean):
+    '''
+    Return an exponential distribution of delays with the given mean.
+    '''
+    return lambda rng: rng.expovariate(1.0 / mean)
+
+
+def lognormal(median, sigma):
+    '''
+    Return a log-normal distribution of delays with the given median,
+    it has the long tail typical of the latencies of storage.
+    '''
+    mu = math.log(median)
+    return lambda rng: rng.lognormvariate(mu, sigma)
+
+
+class VirtualClock(object):
+    """
+    A clock that advances only when it sleeps.
+
+    Sleeping returns immediately, so delays cost no real time.
+    The clock is meant for a single calling thread, concurrent sleepers
+    advance the clock one after another rather than in parallel.
+    """
+
+    def __init__(self, start=0.0):
+        self._now = start
+        self._lock = threading.Lock()
+
+    def time(self):
+        return self._now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            with self._lock:
+                self._now += seconds
+
+
+# The functions that wait for a txg sync, mapped to the position of their
+# nvlist of names, if they take one.
+_TXG_FUNCTIONS = {
+    'lzc_create': None,
+    'lzc_clone': None,
+    'lzc_rollback': None,
+    'lzc_snapshot': 0,
+    'lzc_destroy_snaps': 0,
+    'lzc_bookmark': 0,
+    'lzc_destroy_bookmarks': 0,
+    'lzc_hold': 0,
+    'lzc_release': 0,
+    'lzc_promote': None,
+    'lzc_rename': None,
+    'lzc_destroy_one': None,
+    'lzc_inherit': None,
+    'lzc_set_props': None,
+}
+
+# The functions that return an error list, mapped to its position.
+_ERRLIST_FUNCTIONS = {
+    'lzc_snapshot': 2,
+    'lzc_destroy_snaps': 2,
+    'lzc_bookmark': 1,
+    'lzc_destroy_bookmarks': 1,
+    'lzc_hold': 2,
+    'lzc_release': 1,
+}
+
+# The functions that return a boolean rather than an error number,
+# a failure can not be injected into them.
+_BOOLEAN_FUNCTIONS = frozenset(['lzc_exists'])
+
+
+class _Rule(object):
+    __slots__ = ('error', 'rate', 'count', 'names')
+
+    def __init__(self, error, rate, count, names):
+        self.error = error
+        self.rate = rate
+        self.count = count
+        self.names = names
+
+
+class _Txg(object):
+    __slots__ = ('start', 'end')
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+
+class FaultInjector(object):
+    """
+    A backend that delays the calls to another backend and injects failures.
+
+    :param backend: the object that implements the C interface.
+    :param int seed: the seed of the random generators.
+    :param clock: an object with ``time()`` and ``sleep(seconds)`` methods,
+                  the real time is used by default.
+    :param sync_time: the distribution of the time to sync a txg,
+                      no sync is simulated if `None`.
+    :param float sync_time_per_name: the time that each name passed
+                                     to a call adds to the sync of its txg.
+    :param int max_errors: the maximum number of entries in an injected
+                           error list.
+
+    The distributions are functions that take a :class:`random.Random`
+    and return a delay in seconds, see :func:`constant`, :func:`uniform`,
+    :func:`exponential` and :func:`lognormal`.
+
+    The numbers of the calls and of the synced txgs are counted in
+    :attr:`calls` and :attr:`txgs`, the number of the injected failures
+    in :attr:`failures`.
+    """
+
+    def __init__(self, backend, seed=None, clock=None, sync_time=None,
+                 sync_time_per_name=0.0, max_errors=100):
+        self._backend = backend
+        self._random = random.Random(seed)
+        # The time module has the same methods as the clocks.
+        self._clock = clock if clock is not None else time
+        self._sync_time = sync_time
+        self._sync_time_per_name = sync_time_per_name
+        self._max_errors = max_errors
+        self._latency = {}
+        self._rules = {}
+        self._txg = None
+        self._lock = threading.Lock()
+        self.calls = {}
+        self.txgs = 0
+        self.failures = 0
+
+    def set_latency(self, func_name, distribution):
+        '''
+        Delay every call of the function by a time drawn from the distribution,
+        the delay is in addition to the wait for the txg sync.
+
+        :param bytes func_name: the name of the function, e.g. ``lzc_exists``.
+        :param distribution: the distribution of the delay or `None`
+                             to remove the delay.
+        '''
+        with self._lock:
+            if distribution is None:
+                self._latency.pop(func_name, None)
+            else:
+                self._latency[func_name] = distribution
+
+    def inject(self, func_name, error, rate=1.0, count=None, names=None):
+        '''
+        Make calls of the function fail.
+
+        A function that returns an error list fails for each of the passed
+        names separately, with the probability of `rate`, and all failed names
+        are reported in the error list, like the kernel does if any of the
+        names can not be processed.  No name is processed then.
+        Other functions fail as a whole with the probability of `rate`.
+        The rules are checked in the order they are added.
+
+        :param bytes func_name: the name of the function, e.g. ``lzc_snapshot``.
+        :param int error: the error number to return, e.g. ``errno.EBUSY``.
+        :param float rate: the probability of a failure.
+        :param int count: the number of the failed calls after which
+                          the rule is removed, unlimited if `None`.
+        :param names: if not `None` then only these names fail,
+                      or the calls with one of them as the first argument.
+        :type names: set of bytes
+        :raises ValueError: if the function returns a boolean, e.g.
+                            ``lzc_exists``, for which any non-zero value
+                            means success.
+        '''
+        if func_name in _BOOLEAN_FUNCTIONS:
+            raise ValueError('%s does not return an error' % (func_name,))
+        rule = _Rule(error, rate, count, frozenset(names) if names is not None else None)
+        with self._lock:
+            self._rules.setdefault(func_name, []).append(rule)
+
+    def clear(self):
+        '''
+        Remove all latencies and failures.
+        '''
+        with self._lock:
+            self._latency.clear()
+            self._rules.clear()
+
+    def __getattr__(self, name):
+        attr = getattr(self._backend, name)
+        if name.startswith('lzc_') and callable(attr):
+            attr = self._wrap(name, attr)
+        setattr(self, name, attr)
+        return attr
+
+    def _wrap(self, name, func):
+        syncs = name in _TXG_FUNCTIONS
+        names_arg = _TXG_FUNCTIONS.get(name)
+        errlist_arg = _ERRLIST_FUNCTIONS.get(name)
+
+        def _call(*args):
+            names = self._names(args[names_arg]) if names_arg is not None else None
+            with self._lock:
+                self.calls[name] = self.calls.get(name, 0) + 1
+                delay = self._delay(name)
+                if errlist_arg is not None:
+                    ret = self._fail_errlist(name, names, args[errlist_arg])
+                else:
+                    ret = self._fail(name, args)
+            self._clock.sleep(delay)
+            if ret != 0:
+                # The checks fail before the change is submitted to a txg.
+                return ret
+            ret = func(*args)
+            if syncs:
+                self._wait_synced(len(names) if names is not None else 1)
+            return ret
+
+        _call.__name__ = name
+        return _call
+
+    @staticmethod
+    def _names(nvlist):
+        if _is_null(nvlist):
+            return []
+        return _nvlist_to_dict(nvlist, {}).keys()
+
+    def _delay(self, name):
+        distribution = self._latency.get(name)
+        if distribution is None:
+            return 0.0
+        return distribution(self._random)
+
+    def _count_failure(self, rules, rule):
+        if rule.count is not None:
+            rule.count -= 1
+            if rule.count == 0:
+                rules.remove(rule)
+        self.failures += 1
+
+    def _fail(self, name, args):
+        rules = self._rules.get(name)
+        if not rules:
+            return 0
+        for rule in list(rules):
+            if rule.names is not None:
+                if not args or not isinstance(args[0], bytes) or args[0] not in rule.names:
+                    continue
+            if self._random.random() < rule.rate:
+                self._count_failure(rules, rule)
+                return rule.error
+        return 0
+
+    def _fail_errlist(self, name, names, errlistp):
+        rules = self._rules.get(name)
+        if not rules:
+            return 0
+        failed = []
+        for rule in list(rules):
+            errors = [(n, rule.error) for n in names
+                      if (rule.names is None or n in rule.names) and
+                      self._random.random() < rule.rate]
+            if errors:
+                self._count_failure(rules, rule)
+                failed.extend(errors)
+                # A name is reported only once, for the first matching rule.
+                reported = dict(errors)
+                names = [n for n in names if n not in reported]
+        if not failed:
+            return 0
+        _set_nvlist(errlistp, _errlist(failed, self._max_errors))
+        return failed[0][1]
+
+    def _wait_synced(self, nnames):
+        '''
+        Join the open txg, or open one if there is none, and wait until
+        it is synced.
+        '''
+        if self._sync_time is None:
+            return
+        clock = self._clock
+        with self._lock:
+            now = clock.time()
+            txg = self._txg
+            if txg is not None and now < txg.start:
+                # The txg has not started to sync yet, join it.
+                txg.end += nnames * self._sync_time_per_name
+            else:
+                # Start syncing right away or after the txg being synced.
+                start = now if txg is None or now >= txg.end else txg.end
+                txg = _Txg(start, start + self._sync_time(self._random) +
+                           nnames * self._sync_time_per_name)
+                self._txg = txg
+                self.txgs += 1
+        while True:
+            # The end is extended while the txg is open.
+            remaining = txg.end - clock.time()
+            if remaining <= 0:
+                break
+            clock.sleep(remaining)
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
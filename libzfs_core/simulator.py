@@ -0,0 +1,899 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+An in-memory simulation of *libzfs_core*.
+
+:class:`Simulator` implements the C interface of libzfs_core in Python,
+so it can be selected with :func:`libzfs_core.set_backend` in place of
+the library.  The functions of `libzfs_core` then work as usual, they
+convert their arguments to nvlists, call the simulator and translate the
+errors it returns to exceptions, but no pool, kernel module or root
+privileges are needed.  This allows to test and to benchmark code built
+on top of `libzfs_core` with any number of datasets.
+
+The simulator models pools, filesystems, volumes, snapshots, bookmarks,
+user holds, clones and properties together with the error codes and
+the error lists returned by the real library.  ``lzc_list`` writes
+the records in the same binary format as the kernel and, as the kernel,
+it returns only after all records are written.  Send streams are
+not real ZFS streams, they can only be received by the simulator.
+Space accounting, mounting and cleanup of holds on close of the cleanup
+file descriptor are not simulated.
+
+The conversion of the nvlists still requires *libnvpair*.
+
+Example::
+
+    sim = Simulator()
+    sim.create_pool("pool")
+    libzfs_core.set_backend(sim)
+    libzfs_core.lzc_create("pool/fs")
+"""
+
+import errno
+import os
+import random
+import struct
+import threading
+import time
+
+from ._constants import MAXNAMELEN
+from ._libzfs_core import _PIPE_RECORD_FORMAT
+from ._error_translation import (
+    _is_valid_fs_name, _is_valid_snap_name, _is_valid_bmark_name, _pool_name
+)
+from ._nvlist import (
+    _alloc_nvlist, _dict_to_nvlist, _nvlist_to_dict, _ffi, _lib, pack_nvlist
+)
+from ._properties import prop_schema
+
+_dmu_types = _ffi.typeof('dmu_objset_type_t').relements
+_send_flags = _ffi.typeof('enum lzc_send_flags').relements
+
+# Native properties that are not inherited by descendant datasets.
+_NOT_INHERITED = frozenset([
+    "quota", "refquota", "reservation", "refreservation", "volsize",
+    "volblocksize", "filesystem_limit", "snapshot_limit", "canmount",
+    "casesensitivity", "utf8only", "version",
+])
+
+_RECORD_HEADER = struct.Struct(_PIPE_RECORD_FORMAT)
+
+# The header of a simulated send stream.
+_STREAM_MAGIC = b"PYZFSSIM"
+_STREAM_HEADER = struct.Struct('=8sQQI')
+
+
+class _Dataset(object):
+    __slots__ = ('name', 'kind', 'dmu_type', 'guid', 'createtxg', 'creation',
+                 'props', 'parent', 'children', 'snapshots', 'bookmarks',
+                 'origin', 'clones', 'holds', 'defer_destroy')
+
+    def __init__(self, name, kind, dmu_type, guid, createtxg, creation, parent):
+        self.name = name
+        self.kind = kind
+        self.dmu_type = dmu_type
+        self.guid = guid
+        self.createtxg = createtxg
+        self.creation = creation
+        self.props = {}
+        self.parent = parent
+        self.origin = None
+        self.defer_destroy = False
+        if kind == 'snapshot':
+            self.children = self.snapshots = self.bookmarks = None
+            self.clones = set()
+            self.holds = {}
+        else:
+            self.children = {}
+            self.snapshots = {}
+            self.bookmarks = {}
+            self.clones = self.holds = None
+
+
+def _is_null(value):
+    return isinstance(value, _ffi.CData) and value == _ffi.NULL
+
+
+def _string(value):
+    if _is_null(value):
+        return None
+    return value
+
+
+def _nvlist(value):
+    if _is_null(value):
+        return {}
+    return _nvlist_to_dict(value, {})
+
+
+def _set_nvlist(nvlistp, props):
+    '''
+    Return a new nvlist_t via the output parameter, the caller frees it.
+    '''
+    if _is_null(nvlistp) or not props:
+        return
+    nvlist = _alloc_nvlist()
+    try:
+        _dict_to_nvlist(props, nvlist)
+    except:
+        _lib.nvlist_free(nvlist)
+        raise
+    nvlistp[0] = nvlist
+
+
+def _errlist(errors, max_errors):
+    '''
+    Convert a list of (name, error) pairs to an error list of at most
+    `max_errors` entries, the others are counted by ``N_MORE_ERRORS``.
+    '''
+    errlist = {}
+    for (name, err) in errors[:max_errors]:
+        errlist[name] = err
+    if len(errors) > max_errors:
+        errlist["N_MORE_ERRORS"] = len(errors) - max_errors
+    return errlist
+
+
+def _split(name, sep):
+    (fs, _, short) = name.partition(sep)
+    return (fs, short)
+
+
+# The options of lzc_list that every kernel supports and the extensions.
+_LIST_OPTIONS = frozenset(["fd", "type", "recurse"])
+_LIST_EXTENDED_OPTIONS = ("props", "mintxg", "maxtxg")
+
+
+class _ListSelection(object):
+    """
+    The extended options of ``lzc_list`` that select the records
+    and the properties.
+    """
+
+    def __init__(self, props, mintxg, maxtxg):
+        self._props = props
+        self._mintxg = mintxg
+        self._maxtxg = maxtxg
+
+    def txg(self, createtxg):
+        if self._mintxg is not None and createtxg < self._mintxg:
+            return False
+        return self._maxtxg is None or createtxg <= self._maxtxg
+
+    def props(self, record):
+        if self._props is not None:
+            props = record["properties"]
+            record["properties"] = {k: v for (k, v) in props.iteritems() if k in self._props}
+        return record
+
+
+class Simulator(object):
+    """
+    An in-memory implementation of the libzfs_core C interface.
+
+    All state is kept by the simulator object, so independent simulators
+    can be used side by side.  The simulator is thread-safe, every call
+    is atomic with respect to the other calls.
+
+    :param int seed: the seed for the generation of GUIDs.
+    :param int max_errors: the maximum number of entries in an error list,
+                           the number of the other errors is reported via
+                           the ``N_MORE_ERRORS`` entry as by the kernel.
+    :param list_options: the extended options of ``lzc_list`` that are
+                         supported, ``lzc_list`` fails with ``EINVAL``
+                         if given any other option, as an older kernel.
+    :type list_options: iterable of bytes
+    """
+
+    DMU_OST_NONE = _dmu_types['DMU_OST_NONE']
+    DMU_OST_META = _dmu_types['DMU_OST_META']
+    DMU_OST_ZFS = _dmu_types['DMU_OST_ZFS']
+    DMU_OST_ZVOL = _dmu_types['DMU_OST_ZVOL']
+    DMU_OST_OTHER = _dmu_types['DMU_OST_OTHER']
+    DMU_OST_ANY = _dmu_types['DMU_OST_ANY']
+    DMU_OST_NUMTYPES = _dmu_types['DMU_OST_NUMTYPES']
+    LZC_SEND_FLAG_EMBED_DATA = _send_flags['LZC_SEND_FLAG_EMBED_DATA']
+    LZC_SEND_FLAG_LARGE_BLOCK = _send_flags['LZC_SEND_FLAG_LARGE_BLOCK']
+
+    def __init__(self, seed=None, max_errors=100, list_options=_LIST_EXTENDED_OPTIONS):
+        self._datasets = {}
+        self._txg = 1
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self.max_errors = max_errors
+        self._list_options = _LIST_OPTIONS.union(list_options)
+
+    # Management of the simulated state, not a part of the C interface.
+
+    def create_pool(self, name, props=None):
+        '''
+        Create a pool with its root filesystem.
+
+        :param bytes name: the name of the pool.
+        :param props: the properties of the root filesystem.
+        :type props: dict of bytes:Any
+        :raises ValueError: if the name is invalid or the pool exists.
+        '''
+        with self._lock:
+            if '/' in name or not _is_valid_fs_name(name) or name in self._datasets:
+                raise ValueError('Cannot create pool ' + repr(name))
+            root = self._new_dataset(name, 'filesystem', self.DMU_OST_ZFS, None)
+            if props:
+                root.props.update(props)
+
+    def datasets(self):
+        '''
+        Return the names of all datasets, including snapshots.
+
+        :rtype: list of bytes
+        '''
+        with self._lock:
+            return self._datasets.keys()
+
+    def _new_dataset(self, name, kind, dmu_type, parent):
+        ds = _Dataset(name, kind, dmu_type, self._random.getrandbits(64),
+                      self._txg, int(time.time()), parent)
+        self._datasets[name] = ds
+        if parent is not None:
+            if kind == 'snapshot':
+                parent.snapshots[_split(name, '@')[1]] = ds
+            else:
+                parent.children[name.rpartition('/')[2]] = ds
+        return ds
+
+    def _sync(self):
+        self._txg += 1
+
+    def _errlist(self, errors):
+        return _errlist(errors, self.max_errors)
+
+    def _filesystem(self, name):
+        ds = self._datasets.get(name)
+        if ds is None or ds.kind == 'snapshot':
+            return None
+        return ds
+
+    def _snapshot(self, name):
+        ds = self._datasets.get(name)
+        if ds is None or ds.kind != 'snapshot':
+            return None
+        return ds
+
+    def _has_pool(self, name):
+        return _pool_name(name) in self._datasets
+
+    def _destroy_snapshot(self, snap):
+        fs = snap.parent
+        del fs.snapshots[_split(snap.name, '@')[1]]
+        del self._datasets[snap.name]
+
+    def _maybe_destroy_deferred(self, snap):
+        if snap.defer_destroy and not snap.holds and not snap.clones:
+            self._destroy_snapshot(snap)
+
+    # The C interface.
+
+    def libzfs_core_init(self):
+        return 0
+
+    def libzfs_core_fini(self):
+        pass
+
+    def lzc_create(self, name, dmu_type, props_nv):
+        props = _nvlist(props_nv)
+        with self._lock:
+            if not _is_valid_fs_name(name) or len(name) > MAXNAMELEN:
+                return errno.EINVAL
+            if dmu_type not in (self.DMU_OST_ZFS, self.DMU_OST_ZVOL):
+                return errno.EINVAL
+            if dmu_type == self.DMU_OST_ZVOL and "volsize" not in props:
+                return errno.EINVAL
+            if not self._valid_props(props, snapshot=False):
+                return errno.EINVAL
+            if name in self._datasets:
+                return errno.EEXIST
+            parent = self._filesystem(name.rpartition('/')[0])
+            if parent is None or parent.kind != 'filesystem':
+                return errno.ENOENT
+            kind = 'filesystem' if dmu_type == self.DMU_OST_ZFS else 'volume'
+            ds = self._new_dataset(name, kind, dmu_type, parent)
+            self._set_props(ds, props)
+            self._sync()
+            return 0
+
+    def lzc_clone(self, name, origin_name, props_nv):
+        props = _nvlist(props_nv)
+        with self._lock:
+            if not _is_valid_fs_name(name) or len(name) > MAXNAMELEN:
+                return errno.EINVAL
+            if not _is_valid_snap_name(origin_name):
+                return errno.ENOENT
+            if _pool_name(name) != _pool_name(origin_name):
+                return errno.EINVAL
+            if not self._valid_props(props, snapshot=False):
+                return errno.EINVAL
+            if name in self._datasets:
+                return errno.EEXIST
+            origin = self._snapshot(origin_name)
+            parent = self._filesystem(name.rpartition('/')[0])
+            if origin is None or parent is None or parent.kind != 'filesystem':
+                return errno.ENOENT
+            kind = 'filesystem' if origin.dmu_type == self.DMU_OST_ZFS else 'volume'
+            ds = self._new_dataset(name, kind, origin.dmu_type, parent)
+            ds.origin = origin
+            origin.clones.add(ds)
+            self._set_props(ds, props)
+            self._sync()
+            return 0
+
+    def lzc_rollback(self, name, snapnamep, snapnamelen):
+        with self._lock:
+            if not _is_valid_fs_name(name):
+                return errno.ENOENT
+            fs = self._filesystem(name)
+            if fs is None:
+                return errno.ENOENT
+            if not fs.snapshots:
+                return errno.EINVAL
+            latest = max(fs.snapshots.itervalues(), key=lambda s: s.createtxg)
+            self._sync()
+            snapname = latest.name[:snapnamelen - 1] + b'\0'
+            snapnamep[0:len(snapname)] = snapname
+            return 0
+
+    def lzc_snapshot(self, snaps_nv, props_nv, errlistp):
+        snaps = _nvlist(snaps_nv).keys()
+        props = _nvlist(props_nv)
+        with self._lock:
+            if not snaps:
+                return 0
+            if any(not _is_valid_snap_name(s) or len(s) > MAXNAMELEN for s in snaps):
+                return errno.EINVAL
+            if not self._valid_props(props, snapshot=True):
+                return errno.EINVAL
+            filesystems = [_split(s, '@')[0] for s in snaps]
+            if len(set(filesystems)) != len(filesystems):
+                return errno.EXDEV
+            if len(set(_pool_name(s) for s in snaps)) != 1:
+                return errno.EXDEV
+            errors = []
+            for (snap, fsname) in zip(snaps, filesystems):
+                if self._filesystem(fsname) is None:
+                    errors.append((snap, errno.ENOENT))
+                elif snap in self._datasets:
+                    errors.append((snap, errno.EEXIST))
+            if errors:
+                _set_nvlist(errlistp, self._errlist(errors))
+                return errors[0][1]
+            for (snap, fsname) in zip(snaps, filesystems):
+                fs = self._datasets[fsname]
+                ds = self._new_dataset(snap, 'snapshot', fs.dmu_type, fs)
+                ds.props.update(props)
+            self._sync()
+            return 0
+
+    def lzc_destroy_snaps(self, snaps_nv, defer, errlistp):
+        snaps = _nvlist(snaps_nv).keys()
+        with self._lock:
+            if len(set(_pool_name(s) for s in snaps)) > 1:
+                return errno.EXDEV
+            errors = []
+            existing = []
+            for name in snaps:
+                if not self._has_pool(name):
+                    errors.append((name, errno.ENOENT))
+                    continue
+                snap = self._snapshot(name)
+                if snap is None:
+                    continue
+                if not defer and snap.clones:
+                    errors.append((name, errno.EEXIST))
+                elif not defer and snap.holds:
+                    errors.append((name, errno.EBUSY))
+                else:
+                    existing.append(snap)
+            if errors:
+                _set_nvlist(errlistp, self._errlist(errors))
+                return errors[0][1]
+            for snap in existing:
+                if snap.clones or snap.holds:
+                    snap.defer_destroy = True
+                else:
+                    self._destroy_snapshot(snap)
+            self._sync()
+            return 0
+
+    def lzc_bookmark(self, bookmarks_nv, errlistp):
+        bookmarks = _nvlist(bookmarks_nv)
+        with self._lock:
+            if len(set(_pool_name(b) for b in bookmarks)) > 1:
+                return errno.EINVAL
+            errors = []
+            for (bmark, snapname) in bookmarks.iteritems():
+                if (not _is_valid_bmark_name(bmark) or not _is_valid_snap_name(snapname) or
+                        _split(bmark, '#')[0] != _split(snapname, '@')[0]):
+                    errors.append((bmark, errno.EINVAL))
+                    continue
+                snap = self._snapshot(snapname)
+                if snap is None:
+                    errors.append((bmark, errno.ENOENT))
+                elif _split(bmark, '#')[1] in snap.parent.bookmarks:
+                    errors.append((bmark, errno.EEXIST))
+            if errors:
+                _set_nvlist(errlistp, self._errlist(errors))
+                return errors[0][1]
+            for (bmark, snapname) in bookmarks.iteritems():
+                snap = self._datasets[snapname]
+                snap.parent.bookmarks[_split(bmark, '#')[1]] = (
+                    snap.guid, snap.createtxg, snap.creation)
+            self._sync()
+            return 0
+
+    def lzc_get_bookmarks(self, fsname, props_nv, bmarksp):
+        props = _nvlist(props_nv)
+        with self._lock:
+            fs = self._filesystem(fsname)
+            if fs is None:
+                return errno.ENOENT
+            result = {}
+            for (short, (guid, createtxg, creation)) in fs.bookmarks.iteritems():
+                values = {"guid": guid, "createtxg": createtxg, "creation": creation}
+                result[short] = {p: {"value": values[p]} for p in props if p in values}
+            _set_nvlist(bmarksp, result)
+            return 0
+
+    def lzc_destroy_bookmarks(self, bmarks_nv, errlistp):
+        bmarks = _nvlist(bmarks_nv).keys()
+        with self._lock:
+            errors = [(b, errno.EINVAL) for b in bmarks if not _is_valid_bmark_name(b)]
+            if errors:
+                _set_nvlist(errlistp, self._errlist(errors))
+                return errors[0][1]
+            for bmark in bmarks:
+                (fsname, short) = _split(bmark, '#')
+                fs = self._filesystem(fsname)
+                if fs is not None:
+                    fs.bookmarks.pop(short, None)
+            self._sync()
+            return 0
+
+    def lzc_snaprange_space(self, firstname, lastname, usedp):
+        with self._lock:
+            if not _is_valid_snap_name(firstname) or not _is_valid_snap_name(lastname):
+                return errno.EINVAL
+            first = self._snapshot(firstname)
+            last = self._snapshot(lastname)
+            if first is None or last is None:
+                return errno.ENOENT
+            if first.parent is not last.parent or first.createtxg > last.createtxg:
+                return errno.EXDEV
+            usedp[0] = 0
+            return 0
+
+    def lzc_hold(self, holds_nv, cleanup_fd, errlistp):
+        holds = _nvlist(holds_nv)
+        with self._lock:
+            if len(set(_pool_name(s) for s in holds)) > 1:
+                return errno.EXDEV
+            errors = []
+            missing = []
+            for (snapname, tag) in holds.iteritems():
+                if not _is_valid_snap_name(snapname) or len(snapname) > MAXNAMELEN:
+                    errors.append((snapname, errno.EINVAL))
+                elif len(tag) > MAXNAMELEN:
+                    errors.append((snapname, errno.E2BIG))
+                elif self._snapshot(snapname) is None:
+                    missing.append((snapname, errno.ENOENT))
+                elif tag in self._datasets[snapname].holds:
+                    errors.append((snapname, errno.EEXIST))
+            if errors:
+                _set_nvlist(errlistp, self._errlist(errors))
+                return errors[0][1]
+            now = int(time.time())
+            for (snapname, tag) in holds.iteritems():
+                snap = self._snapshot(snapname)
+                if snap is not None:
+                    snap.holds[tag] = now
+            _set_nvlist(errlistp, self._errlist(missing))
+            self._sync()
+            return 0
+
+    def lzc_release(self, holds_nv, errlistp):
+        holds = _nvlist(holds_nv)
+        with self._lock:
+            if len(set(_pool_name(s) for s in holds)) > 1:
+                return errno.EXDEV
+            errors = []
+            for (snapname, tags) in holds.iteritems():
+                if not _is_valid_snap_name(snapname) or len(snapname) > MAXNAMELEN:
+                    errors.append((snapname, errno.EINVAL))
+                elif any(len(tag) > MAXNAMELEN for tag in tags):
+                    errors.append((snapname, errno.E2BIG))
+            if errors:
+                _set_nvlist(errlistp, self._errlist(errors))
+                return errors[0][1]
+            missing = []
+            for (snapname, tags) in holds.iteritems():
+                snap = self._snapshot(snapname)
+                if snap is None:
+                    missing.append((snapname, errno.ENOENT))
+                    continue
+                for tag in tags:
+                    if snap.holds.pop(tag, None) is None:
+                        missing.append((snapname + '#' + tag, errno.ENOENT))
+                self._maybe_destroy_deferred(snap)
+            _set_nvlist(errlistp, self._errlist(missing))
+            self._sync()
+            return 0
+
+    def lzc_get_holds(self, snapname, holdsp):
+        with self._lock:
+            if not _is_valid_snap_name(snapname):
+                return errno.EINVAL
+            snap = self._snapshot(snapname)
+            if snap is None:
+                return errno.ENOENT
+            _set_nvlist(holdsp, dict(snap.holds))
+            return 0
+
+    def lzc_send(self, snapname, fromname, fd, flags):
+        fromname = _string(fromname)
+        with self._lock:
+            (err, snap, fromguid) = self._check_send(snapname, fromname)
+            if err != 0:
+                return err
+            stream = self._stream(snap, fromguid)
+        try:
+            while stream:
+                written = os.write(fd, stream)
+                stream = stream[written:]
+        except OSError as e:
+            return e.errno
+        return 0
+
+    def lzc_send_space(self, snapname, fromname, spacep):
+        fromname = _string(fromname)
+        with self._lock:
+            (err, snap, fromguid) = self._check_send(snapname, fromname)
+            if err != 0:
+                return err
+            spacep[0] = len(self._stream(snap, fromguid))
+            return 0
+
+    def _check_send(self, snapname, fromname):
+        if not _is_valid_snap_name(snapname):
+            return (errno.EINVAL, None, None)
+        snap = self._snapshot(snapname)
+        if snap is None:
+            return (errno.ENOENT, None, None)
+        if fromname is None:
+            return (0, snap, 0)
+        if '#' in fromname:
+            if not _is_valid_bmark_name(fromname):
+                return (errno.EINVAL, None, None)
+            (fsname, short) = _split(fromname, '#')
+            fs = self._filesystem(fsname)
+            if fs is None or short not in fs.bookmarks:
+                return (errno.ENOENT, None, None)
+            (fromguid, fromtxg, _) = fs.bookmarks[short]
+        else:
+            if not _is_valid_snap_name(fromname):
+                return (errno.EINVAL, None, None)
+            fromsnap = self._snapshot(fromname)
+            if fromsnap is None:
+                return (errno.ENOENT, None, None)
+            (fs, fromguid, fromtxg) = (fromsnap.parent, fromsnap.guid, fromsnap.createtxg)
+        if _pool_name(fromname) != _pool_name(snapname):
+            return (errno.EXDEV, None, None)
+        if fs is not snap.parent or fromtxg >= snap.createtxg:
+            return (errno.EXDEV, None, None)
+        return (0, snap, fromguid)
+
+    def _stream(self, snap, fromguid):
+        return _STREAM_HEADER.pack(_STREAM_MAGIC, snap.guid, fromguid, snap.createtxg)
+
+    def lzc_receive(self, snapname, props_nv, originname, force, fd):
+        props = _nvlist(props_nv)
+        originname = _string(originname)
+        try:
+            header = self._read_stream(fd)
+        except OSError as e:
+            return e.errno
+        if header is None:
+            return errno.EINVAL
+        (magic, guid, fromguid, _) = header
+        if magic != _STREAM_MAGIC:
+            return errno.EINVAL
+        with self._lock:
+            if not _is_valid_snap_name(snapname) or len(snapname) > MAXNAMELEN:
+                return errno.EINVAL
+            if originname is not None and not _is_valid_snap_name(originname):
+                return errno.EINVAL
+            if snapname in self._datasets:
+                return errno.EEXIST
+            fsname = _split(snapname, '@')[0]
+            fs = self._filesystem(fsname)
+            if fromguid != 0:
+                if fs is None:
+                    return errno.ENOENT
+                if not fs.snapshots:
+                    return errno.ENODEV
+                latest = max(fs.snapshots.itervalues(), key=lambda s: s.createtxg)
+                if latest.guid != fromguid:
+                    return errno.ENODEV
+            elif fs is not None:
+                if not force or fs.snapshots or fs.children:
+                    return errno.EEXIST
+            else:
+                parent = self._filesystem(fsname.rpartition('/')[0])
+                if parent is None:
+                    return errno.ENOENT
+                origin = None
+                if originname is not None:
+                    origin = self._snapshot(originname)
+                    if origin is None:
+                        return errno.ENOENT
+                fs = self._new_dataset(fsname, 'filesystem', self.DMU_OST_ZFS, parent)
+                if origin is not None:
+                    fs.origin = origin
+                    origin.clones.add(fs)
+            self._set_props(fs, props)
+            snap = self._new_dataset(snapname, 'snapshot', fs.dmu_type, fs)
+            snap.guid = guid
+            self._sync()
+            return 0
+
+    def _read_stream(self, fd):
+        data = b''
+        while len(data) < _STREAM_HEADER.size:
+            chunk = os.read(fd, _STREAM_HEADER.size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return _STREAM_HEADER.unpack(data)
+
+    def lzc_exists(self, name):
+        with self._lock:
+            return int(name in self._datasets)
+
+    def lzc_promote(self, name, props_nv, errlistp):
+        with self._lock:
+            if not _is_valid_fs_name(name):
+                return errno.EINVAL
+            clone = self._filesystem(name)
+            if clone is None:
+                return errno.ENOENT
+            origin = clone.origin
+            if origin is None:
+                return errno.EINVAL
+            fs = origin.parent
+            moved = [s for s in fs.snapshots.itervalues() if s.createtxg <= origin.createtxg]
+            for snap in moved:
+                if _split(snap.name, '@')[1] in clone.snapshots:
+                    return errno.EEXIST
+            for snap in moved:
+                short = _split(snap.name, '@')[1]
+                self._destroy_snapshot(snap)
+                snap.name = name + '@' + short
+                snap.parent = clone
+                clone.snapshots[short] = snap
+                self._datasets[snap.name] = snap
+            origin.clones.discard(clone)
+            clone.origin = fs.origin
+            if fs.origin is not None:
+                fs.origin.clones.discard(fs)
+                fs.origin.clones.add(clone)
+            fs.origin = origin
+            origin.clones.add(fs)
+            self._sync()
+            return 0
+
+    def lzc_rename(self, source, target, props_nv, errnamep):
+        with self._lock:
+            if not _is_valid_fs_name(source) or not _is_valid_fs_name(target):
+                return errno.EINVAL
+            if len(target) > MAXNAMELEN:
+                return errno.ENAMETOOLONG
+            if _pool_name(source) != _pool_name(target):
+                return errno.EINVAL
+            ds = self._filesystem(source)
+            if ds is None or ds.parent is None:
+                return errno.ENOENT
+            if target in self._datasets:
+                return errno.EEXIST
+            parent = self._filesystem(target.rpartition('/')[0])
+            if parent is None or parent.kind != 'filesystem':
+                return errno.ENOENT
+            if (target + '/').startswith(source + '/'):
+                return errno.EINVAL
+            del ds.parent.children[source.rpartition('/')[2]]
+            ds.parent = parent
+            parent.children[target.rpartition('/')[2]] = ds
+            self._rename_tree(ds, target)
+            self._sync()
+            return 0
+
+    def _rename_tree(self, ds, name):
+        del self._datasets[ds.name]
+        ds.name = name
+        self._datasets[name] = ds
+        for (short, snap) in ds.snapshots.iteritems():
+            del self._datasets[snap.name]
+            snap.name = name + '@' + short
+            self._datasets[snap.name] = snap
+        for (short, child) in ds.children.iteritems():
+            self._rename_tree(child, name + '/' + short)
+
+    def lzc_destroy_one(self, name, props_nv):
+        with self._lock:
+            if not _is_valid_fs_name(name) and not _is_valid_snap_name(name):
+                return errno.EINVAL
+            ds = self._datasets.get(name)
+            if ds is None:
+                return errno.ENOENT
+            if ds.kind == 'snapshot':
+                if ds.clones:
+                    return errno.EEXIST
+                if ds.holds:
+                    return errno.EBUSY
+                self._destroy_snapshot(ds)
+            else:
+                if ds.parent is None or ds.children or ds.snapshots:
+                    return errno.EBUSY
+                del ds.parent.children[name.rpartition('/')[2]]
+                del self._datasets[name]
+                if ds.origin is not None:
+                    ds.origin.clones.discard(ds)
+                    self._maybe_destroy_deferred(ds.origin)
+            self._sync()
+            return 0
+
+    def lzc_inherit(self, name, prop, props_nv):
+        with self._lock:
+            if not _is_valid_fs_name(name) and not _is_valid_snap_name(name):
+                return errno.EINVAL
+            schema = prop_schema(prop)
+            if schema is None or schema.readonly:
+                return errno.EINVAL
+            ds = self._datasets.get(name)
+            if ds is None:
+                return errno.ENOENT
+            if ds.kind == 'snapshot' and schema.type != 'user':
+                return errno.EINVAL
+            ds.props.pop(prop, None)
+            self._sync()
+            return 0
+
+    def lzc_set_props(self, name, props_nv, unused1, unused2):
+        props = _nvlist(props_nv)
+        with self._lock:
+            ds = self._datasets.get(name)
+            if ds is None:
+                if not _is_valid_fs_name(name) and not _is_valid_snap_name(name):
+                    return errno.EINVAL
+                return errno.ENOENT
+            if not self._valid_props(props, snapshot=ds.kind == 'snapshot'):
+                return errno.EINVAL
+            self._set_props(ds, props)
+            self._sync()
+            return 0
+
+    def _valid_props(self, props, snapshot):
+        for name in props:
+            schema = prop_schema(name)
+            if schema is None:
+                return False
+            if snapshot and schema.type != 'user':
+                return False
+        return True
+
+    def _set_props(self, ds, props):
+        for (name, value) in props.iteritems():
+            if not prop_schema(name).readonly:
+                ds.props[name] = value
+
+    def lzc_list(self, name, opts_nv):
+        opts = _nvlist(opts_nv)
+        fd = opts.get("fd")
+        if fd is None:
+            return errno.EINVAL
+        if not self._list_options.issuperset(opts):
+            return errno.EINVAL
+        if "recurse" not in opts:
+            depth = 0
+        else:
+            depth = opts["recurse"]
+        types = opts.get("type")
+        select = _ListSelection(opts.get("props"), opts.get("mintxg"), opts.get("maxtxg"))
+        with self._lock:
+            if not _is_valid_fs_name(name) and not _is_valid_snap_name(name):
+                return errno.EINVAL
+            ds = self._datasets.get(name)
+            if ds is None:
+                return errno.ENOENT
+            records = []
+            self._collect(ds, depth, types, select, records)
+        # As the kernel does, the call returns only after all records are
+        # written, so it blocks while the pipe is full.  The state is not
+        # locked while the records are written.
+        return self._write_records(fd, records)
+
+    def _collect(self, ds, depth, types, select, records):
+        '''
+        Build the records of the dataset and its descendants up to
+        the given depth while the state is locked.
+        '''
+        if (types is None or ds.kind in types) and select.txg(ds.createtxg):
+            records.append(select.props(self._record(ds)))
+        if ds.kind == 'snapshot' or depth == 0:
+            return
+        if depth is not None:
+            depth -= 1
+        if types is None or 'snapshot' in types:
+            for snap in sorted(ds.snapshots.itervalues(), key=lambda s: s.createtxg):
+                self._collect(snap, depth, types, select, records)
+        for short in sorted(ds.children):
+            self._collect(ds.children[short], depth, types, select, records)
+
+    def _record(self, ds):
+        props = {}
+        # A snapshot inherits the user properties of its filesystem.
+        ancestor = ds.parent if ds.kind == 'snapshot' else ds
+        while ancestor is not None:
+            for (prop, value) in ancestor.props.iteritems():
+                if prop in props:
+                    continue
+                schema = prop_schema(prop)
+                if ds.kind == 'snapshot' and schema.type != 'user':
+                    continue
+                if ancestor is not ds and prop in _NOT_INHERITED:
+                    continue
+                props[prop] = {"value": value, "source": ancestor.name}
+            ancestor = ancestor.parent
+        if ds.kind == 'snapshot':
+            for (prop, value) in ds.props.iteritems():
+                props[prop] = {"value": value, "source": ds.name}
+        props["creation"] = {"value": ds.creation}
+        props["createtxg"] = {"value": ds.createtxg}
+        props["guid"] = {"value": ds.guid}
+        if ds.origin is not None:
+            props["origin"] = {"value": ds.origin.name}
+        if ds.kind == 'snapshot':
+            props["userrefs"] = {"value": len(ds.holds)}
+            props["defer_destroy"] = {"value": int(ds.defer_destroy)}
+            if ds.clones:
+                props["clones"] = {"value": {c.name: None for c in ds.clones}}
+        return {
+            "name": ds.name,
+            "dmu_objset_stats": {
+                "dds_num_clones": len(ds.clones) if ds.clones is not None else 0,
+                "dds_creation_txg": ds.createtxg,
+                "dds_guid": ds.guid,
+                "dds_type": ds.dmu_type,
+                "dds_is_snapshot": ds.kind == 'snapshot',
+                "dds_inconsistent": False,
+                "dds_origin": ds.origin.name if ds.origin is not None else "",
+            },
+            "properties": props,
+        }
+
+    def _write_records(self, fd, records):
+        try:
+            for record in records:
+                data = pack_nvlist(record)
+                self._write(fd, _RECORD_HEADER.pack(len(data), 0, 0, 0, 0) + data)
+            self._write(fd, _RECORD_HEADER.pack(0, 0, 0, 0, 0))
+        except OSError as e:
+            # The reader has gone away.
+            return e.errno
+        return 0
+
+    @staticmethod
+    def _write(fd, data):
+        while data:
+            written = os.write(fd, data)
+            data = data[written:]
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,308 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+A stub of the libzfs_core library for tests and benchmarks.
+
+The stub is a shared library with all functions declared by
+`libzfs_core.bindings.libzfs_core`.  The functions return canned
+results immediately, so calling them through the Python wrappers
+measures the overhead of the wrappers: the conversion of nvlists,
+the CFFI calls and the translation of errors.
+
+The stub is compiled with the system C compiler by :func:`build_stub`
+and linked with libnvpair.  :func:`load_stub` opens it in the same way
+as the real library is opened, but with the path of the stub in place
+of :data:`libzfs_core.bindings.libzfs_core.LIBRARY`, and the result
+can be selected with :func:`libzfs_core.set_backend`.
+
+The results of the stub are controlled with :meth:`Stub.set_result`:
+
+- all functions that return an error number return the configured one,
+  `lzc_exists` reports that a dataset exists if it is zero
+- if the error number is not zero and the error lists are enabled,
+  the functions with an error list report every passed name as failed
+- `lzc_list` writes the configured number of records to the pipe
+  before it returns, the first one describes the listed dataset and
+  the others its children
+"""
+
+import os
+import shutil
+import tempfile
+from distutils.ccompiler import new_compiler
+from distutils.errors import CCompilerError, DistutilsExecError, DistutilsPlatformError
+from distutils.sysconfig import customize_compiler
+
+from cffi import FFI
+
+from ..bindings import libzfs_core
+
+STUB_SOURCE = r"""
+#include <errno.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+
+typedef struct nvlist nvlist_t;
+typedef struct nvpair nvpair_t;
+typedef int boolean_t;
+
+extern int nvlist_alloc(nvlist_t **, unsigned int, int);
+extern void nvlist_free(nvlist_t *);
+extern int nvlist_add_int32(nvlist_t *, const char *, int32_t);
+extern int nvlist_add_string(nvlist_t *, const char *, const char *);
+extern int nvlist_add_boolean_value(nvlist_t *, const char *, boolean_t);
+extern int nvlist_add_nvlist(nvlist_t *, const char *, nvlist_t *);
+extern int nvlist_lookup_nvpair(nvlist_t *, const char *, nvpair_t **);
+extern int nvpair_value_int32(nvpair_t *, int32_t *);
+extern nvpair_t *nvlist_next_nvpair(nvlist_t *, nvpair_t *);
+extern char *nvpair_name(nvpair_t *);
+extern int nvlist_pack(nvlist_t *, char **, size_t *, int, int);
+
+#define NV_UNIQUE_NAME  1
+#define NV_ENCODE_NATIVE 0
+
+static int stub_ret = 0;
+static int stub_errlist = 0;
+static int stub_records = 1;
+
+void
+pyzfs_stub_set_result(int ret, int errlist, int records)
+{
+    stub_ret = ret;
+    stub_errlist = errlist;
+    stub_records = records;
+}
+
+static nvlist_t *
+new_nvlist(void)
+{
+    nvlist_t *nvl = NULL;
+
+    (void) nvlist_alloc(&nvl, NV_UNIQUE_NAME, 0);
+    return (nvl);
+}
+
+static int
+fail_names(nvlist_t *names, nvlist_t **errlist)
+{
+    nvpair_t *pair;
+
+    if (stub_ret == 0 || !stub_errlist || errlist == NULL)
+        return (stub_ret);
+    *errlist = new_nvlist();
+    for (pair = nvlist_next_nvpair(names, NULL); pair != NULL;
+        pair = nvlist_next_nvpair(names, pair))
+        (void) nvlist_add_int32(*errlist, nvpair_name(pair), stub_ret);
+    return (stub_ret);
+}
+
+static int
+ret_nvlist(nvlist_t **nvlp)
+{
+    if (stub_ret == 0)
+        *nvlp = new_nvlist();
+    return (stub_ret);
+}
+
+int libzfs_core_init(void) { return (0); }
+void libzfs_core_fini(void) { }
+
+int lzc_snapshot(nvlist_t *snaps, nvlist_t *props, nvlist_t **errlist)
+{ return (fail_names(snaps, errlist)); }
+int lzc_create(const char *fsname, int type, nvlist_t *props)
+{ return (stub_ret); }
+int lzc_clone(const char *fsname, const char *origin, nvlist_t *props)
+{ return (stub_ret); }
+int lzc_destroy_snaps(nvlist_t *snaps, boolean_t defer, nvlist_t **errlist)
+{ return (fail_names(snaps, errlist)); }
+int lzc_bookmark(nvlist_t *bookmarks, nvlist_t **errlist)
+{ return (fail_names(bookmarks, errlist)); }
+int lzc_get_bookmarks(const char *fsname, nvlist_t *props, nvlist_t **bmarks)
+{ return (ret_nvlist(bmarks)); }
+int lzc_destroy_bookmarks(nvlist_t *bmarks, nvlist_t **errlist)
+{ return (fail_names(bmarks, errlist)); }
+int lzc_snaprange_space(const char *firstsnap, const char *lastsnap, uint64_t *usedp)
+{ *usedp = 0; return (stub_ret); }
+int lzc_hold(nvlist_t *holds, int cleanup_fd, nvlist_t **errlist)
+{ return (fail_names(holds, errlist)); }
+int lzc_release(nvlist_t *holds, nvlist_t **errlist)
+{ return (fail_names(holds, errlist)); }
+int lzc_get_holds(const char *snapname, nvlist_t **holdsp)
+{ return (ret_nvlist(holdsp)); }
+int lzc_send(const char *snapname, const char *from, int fd, int flags)
+{ return (stub_ret); }
+int lzc_receive(const char *snapname, nvlist_t *props, const char *origin,
+    boolean_t force, int fd)
+{ return (stub_ret); }
+int lzc_send_space(const char *snapname, const char *from, uint64_t *spacep)
+{ *spacep = 0; return (stub_ret); }
+boolean_t lzc_exists(const char *dataset)
+{ return (stub_ret == 0); }
+int lzc_rollback(const char *fsname, char *snapnamebuf, int snapnamelen)
+{
+    if (stub_ret == 0)
+        (void) snprintf(snapnamebuf, snapnamelen, "%s@snap", fsname);
+    return (stub_ret);
+}
+int lzc_promote(const char *fsname, nvlist_t *opts, nvlist_t **outnvl)
+{ return (stub_ret); }
+int lzc_rename(const char *source, const char *target, nvlist_t *opts, char **errname)
+{ return (stub_ret); }
+int lzc_destroy_one(const char *fsname, nvlist_t *opts)
+{ return (stub_ret); }
+int lzc_inherit(const char *fsname, const char *name, nvlist_t *opts)
+{ return (stub_ret); }
+int lzc_set_props(const char *fsname, nvlist_t *props, nvlist_t *unused1,
+    nvlist_t *unused2)
+{ return (stub_ret); }
+
+static int
+write_all(int fd, const void *data, size_t size)
+{
+    const char *p = data;
+    ssize_t n;
+
+    while (size > 0) {
+        n = write(fd, p, size);
+        if (n < 0)
+            return (errno);
+        p += n;
+        size -= n;
+    }
+    return (0);
+}
+
+static int
+write_record(int fd, const char *name)
+{
+    nvlist_t *record = new_nvlist();
+    nvlist_t *stats = new_nvlist();
+    nvlist_t *props = new_nvlist();
+    char *buf = NULL;
+    size_t size = 0;
+    struct { uint32_t size; uint8_t pad1, err, pad2, pad3; } header;
+    int err;
+
+    (void) nvlist_add_string(record, "name", name);
+    (void) nvlist_add_boolean_value(stats, "dds_is_snapshot", 0);
+    (void) nvlist_add_nvlist(record, "dmu_objset_stats", stats);
+    (void) nvlist_add_nvlist(record, "properties", props);
+    err = nvlist_pack(record, &buf, &size, NV_ENCODE_NATIVE, 0);
+    nvlist_free(props);
+    nvlist_free(stats);
+    nvlist_free(record);
+    if (err != 0)
+        return (err);
+    memset(&header, 0, sizeof (header));
+    header.size = size;
+    err = write_all(fd, &header, sizeof (header));
+    if (err == 0)
+        err = write_all(fd, buf, size);
+    free(buf);
+    return (err);
+}
+
+int
+lzc_list(const char *name, nvlist_t *opts)
+{
+    nvpair_t *pair;
+    int32_t fd;
+    char child[256];
+    int i, err = 0;
+    struct { uint32_t size; uint8_t pad1, err, pad2, pad3; } end;
+
+    if (stub_ret != 0)
+        return (stub_ret);
+    if (nvlist_lookup_nvpair(opts, "fd", &pair) != 0 ||
+        nvpair_value_int32(pair, &fd) != 0)
+        return (EINVAL);
+    for (i = 0; i < stub_records && err == 0; i++) {
+        if (i == 0) {
+            err = write_record(fd, name);
+        } else {
+            (void) snprintf(child, sizeof (child), "%s/child%d", name, i);
+            err = write_record(fd, child);
+        }
+    }
+    if (err == 0) {
+        memset(&end, 0, sizeof (end));
+        err = write_all(fd, &end, sizeof (end));
+    }
+    return (err);
+}
+"""
+
+_STUB_CDEF = """
+    void pyzfs_stub_set_result(int ret, int errlist, int records);
+"""
+
+# The errors of a failed build, callers may skip what needs the stub.
+BUILD_ERRORS = (CCompilerError, DistutilsExecError, DistutilsPlatformError)
+
+
+def build_stub(directory):
+    '''
+    Compile the stub library in the given directory.
+
+    :return: the path of the library.
+    :raises CCompilerError: if the library can not be built,
+                            see :data:`BUILD_ERRORS` for all errors.
+    '''
+    source = os.path.join(directory, "stub.c")
+    with open(source, "w") as f:
+        f.write(STUB_SOURCE)
+    compiler = new_compiler()
+    customize_compiler(compiler)
+    objects = compiler.compile([source], output_dir=directory, extra_preargs=["-fPIC"])
+    path = os.path.join(directory, "libzfs_core_stub.so")
+    compiler.link_shared_object(objects, path, libraries=["nvpair"])
+    return path
+
+
+class Stub(object):
+    """
+    A built stub library.
+
+    :attr:`lib` is a library object like `libzfs_core.bindings.libzfs_core.lib`
+    that can be passed to :func:`libzfs_core.set_backend`.
+    The library is removed by :meth:`close`.
+    """
+
+    def __init__(self):
+        self._directory = tempfile.mkdtemp()
+        try:
+            self.path = build_stub(self._directory)
+        except:
+            shutil.rmtree(self._directory)
+            raise
+        self.lib = load_stub(self.path)
+        self._ffi = FFI()
+        self._ffi.cdef(_STUB_CDEF)
+        self._control = self._ffi.dlopen(self.path)
+
+    def set_result(self, ret=0, errlist=True, records=1):
+        '''
+        Set the results of the stub functions.
+
+        :param int ret: the error number returned by all functions.
+        :param bool errlist: whether the names are reported in the error lists.
+        :param int records: the number of the records written by ``lzc_list``.
+        '''
+        self._control.pyzfs_stub_set_result(ret, errlist, records)
+
+    def close(self):
+        shutil.rmtree(self._directory)
+
+
+def load_stub(path):
+    '''
+    Open the stub library at the given path with the same FFI and in the same
+    way as the library named by :data:`libzfs_core.bindings.libzfs_core.LIBRARY`.
+    '''
+    return type(libzfs_core.lib)(libzfs_core.ffi, path)
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
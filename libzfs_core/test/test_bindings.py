@@ -0,0 +1,71 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Tests for the loading of the C declarations of the bindings.
+The precompiled ``_ffi`` module is generated into a temporary directory,
+so the tests do not depend on whether it was generated at install time.
+"""
+
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from cffi import FFI
+
+from .. import bindings
+from ..bindings import _ffi_build, libnvpair, libzfs_core
+
+_FFI_MODULE = "libzfs_core.bindings._ffi"
+
+
+class TestPrebuiltFFI(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        path = _ffi_build.ffibuilder.compile(tmpdir=cls.tmpdir)
+        cls.module = imp.load_source("_pyzfs_test_ffi", os.path.join(cls.tmpdir, path))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def setUp(self):
+        self.cdefs = [libnvpair.CDEF, libzfs_core.CDEF]
+        self.saved = sys.modules.get(_FFI_MODULE)
+        sys.modules[_FFI_MODULE] = self.module
+
+    def tearDown(self):
+        if self.saved is None:
+            del sys.modules[_FFI_MODULE]
+        else:
+            sys.modules[_FFI_MODULE] = self.saved
+
+    def test_prebuilt(self):
+        self.assertIs(bindings._load_ffi(self.cdefs), self.module.ffi)
+
+    def test_stale(self):
+        cdefs = self.cdefs + ["typedef int _pyzfs_test_t;"]
+        self.assertIsNone(bindings._prebuilt_ffi(cdefs))
+        ffi = bindings._load_ffi(cdefs)
+        self.assertIsNot(ffi, self.module.ffi)
+        self.assertIsInstance(ffi, FFI)
+        self.assertEqual(ffi.sizeof("_pyzfs_test_t"), ffi.sizeof("int"))
+        self.assertEqual(ffi.typeof("data_type_t").kind, "enum")
+
+    def test_missing(self):
+        sys.modules[_FFI_MODULE] = None
+        self.assertIsNone(bindings._prebuilt_ffi(self.cdefs))
+        self.assertIsInstance(bindings._load_ffi(self.cdefs), FFI)
+
+    def test_installed(self):
+        if self.saved is None:
+            self.skipTest("the _ffi module is not generated")
+        self.assertIs(libnvpair.ffi, self.saved.ffi)
+        self.assertIs(libzfs_core.ffi, self.saved.ffi)
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
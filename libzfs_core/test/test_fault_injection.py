@@ -0,0 +1,154 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Tests for the fault_injection module.
+The injector wraps the simulator and is selected as the backend,
+the delays are taken on a virtual clock.
+"""
+
+import errno
+import threading
+import time
+import unittest
+
+from .. import _libzfs_core as lzc
+from .. import exceptions as lzc_exc
+from ..fault_injection import FaultInjector, VirtualClock, constant, uniform, lognormal
+from ..simulator import Simulator
+
+
+class TestFaultInjector(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = Simulator(seed=0)
+        self.sim.create_pool("pool")
+        for i in range(10):
+            self.sim.lzc_create("pool/fs%d" % i, self.sim.DMU_OST_ZFS, lzc._ffi.NULL)
+        self.clock = VirtualClock()
+        self.injector = FaultInjector(self.sim, seed=0, clock=self.clock)
+        self.previous = lzc.set_backend(self.injector)
+
+    def tearDown(self):
+        lzc.set_backend(self.previous)
+
+    def _snaps(self, count=10):
+        return ["pool/fs%d@snap" % i for i in range(count)]
+
+    def test_pass_through(self):
+        lzc.lzc_snapshot(self._snaps())
+        self.assertTrue(lzc.lzc_exists("pool/fs0@snap"))
+        self.assertEqual(self.injector.calls["lzc_snapshot"], 1)
+        self.assertEqual(self.injector.failures, 0)
+        self.assertEqual(self.clock.time(), 0)
+
+    def test_latency(self):
+        self.injector.set_latency("lzc_exists", constant(0.5))
+        lzc.lzc_exists("pool")
+        lzc.lzc_exists("pool")
+        self.assertAlmostEqual(self.clock.time(), 1.0)
+        self.injector.set_latency("lzc_exists", None)
+        lzc.lzc_exists("pool")
+        self.assertAlmostEqual(self.clock.time(), 1.0)
+
+    def test_sync_time(self):
+        injector = FaultInjector(self.sim, clock=self.clock, sync_time=constant(1.0),
+                                 sync_time_per_name=0.1)
+        lzc.set_backend(injector)
+        lzc.lzc_snapshot(self._snaps())
+        self.assertAlmostEqual(self.clock.time(), 2.0)
+        lzc.lzc_exists("pool")
+        self.assertAlmostEqual(self.clock.time(), 2.0)
+        lzc.lzc_destroy_snaps(self._snaps(5), False)
+        self.assertAlmostEqual(self.clock.time(), 3.5)
+        self.assertEqual(injector.txgs, 2)
+
+    def test_txg_batching(self):
+        # The calls made while a txg is synced share the next one.
+        injector = FaultInjector(self.sim, sync_time=constant(0.2))
+        lzc.set_backend(injector)
+        start = time.time()
+        threads = [threading.Thread(target=lzc.lzc_snapshot, args=([snap],))
+                   for snap in self._snaps()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(list(lzc.lzc_list_children("pool"))), 10)
+        self.assertLess(time.time() - start, 1.5)
+        self.assertLessEqual(injector.txgs, 3)
+
+    def test_boolean_failure_rejected(self):
+        with self.assertRaises(ValueError):
+            self.injector.inject("lzc_exists", errno.EIO)
+        self.assertFalse(lzc.lzc_exists("pool/nofs"))
+
+    def test_errlist_failure(self):
+        self.injector.inject("lzc_snapshot", errno.EEXIST, names=["pool/fs1@snap"])
+        with self.assertRaises(lzc_exc.SnapshotFailure) as ctx:
+            lzc.lzc_snapshot(self._snaps())
+        self.assertEqual(len(ctx.exception.errors), 1)
+        self.assertIsInstance(ctx.exception.errors[0], lzc_exc.SnapshotExists)
+        self.assertEqual(ctx.exception.errors[0].name, "pool/fs1@snap")
+        self.assertFalse(lzc.lzc_exists("pool/fs0@snap"))
+
+    def test_errlist_more_errors(self):
+        injector = FaultInjector(self.sim, max_errors=3)
+        lzc.set_backend(injector)
+        injector.inject("lzc_destroy_snaps", errno.EBUSY)
+        lzc.lzc_snapshot(self._snaps())
+        with self.assertRaises(lzc_exc.SnapshotDestructionFailure) as ctx:
+            lzc.lzc_destroy_snaps(self._snaps(), False)
+        self.assertEqual(len(ctx.exception.errors), 3)
+        self.assertIsInstance(ctx.exception.errors[0], lzc_exc.SnapshotIsHeld)
+        self.assertEqual(ctx.exception.suppressed_count, 7)
+        self.assertTrue(lzc.lzc_exists("pool/fs0@snap"))
+
+    def test_errlist_rate(self):
+        self.injector.inject("lzc_snapshot", errno.ENOENT, rate=0.5)
+        with self.assertRaises(lzc_exc.SnapshotFailure) as ctx:
+            lzc.lzc_snapshot(self._snaps())
+        self.assertTrue(0 < len(ctx.exception.errors) < 10)
+        for error in ctx.exception.errors:
+            self.assertIsInstance(error, lzc_exc.FilesystemNotFound)
+
+    def test_count(self):
+        self.injector.inject("lzc_create", errno.EEXIST, count=1)
+        with self.assertRaises(lzc_exc.FilesystemExists):
+            lzc.lzc_create("pool/fs")
+        lzc.lzc_create("pool/fs")
+        self.assertEqual(self.injector.failures, 1)
+
+    def test_names(self):
+        self.injector.inject("lzc_create", errno.EEXIST, names=["pool/bad"])
+        lzc.lzc_create("pool/good")
+        with self.assertRaises(lzc_exc.FilesystemExists):
+            lzc.lzc_create("pool/bad")
+
+    def test_clear(self):
+        self.injector.inject("lzc_create", errno.EEXIST)
+        self.injector.clear()
+        lzc.lzc_create("pool/fs")
+
+    def test_reproducible(self):
+        def run():
+            clock = VirtualClock()
+            injector = FaultInjector(Simulator(seed=0), seed=7, clock=clock,
+                                     sync_time=uniform(0.01, 0.1))
+            injector.create_pool("pool")
+            injector.set_latency("lzc_exists", lognormal(0.001, 1.0))
+            injector.inject("lzc_create", errno.EIO, rate=0.3)
+            lzc.set_backend(injector)
+            results = []
+            for i in range(20):
+                lzc.lzc_exists("pool")
+                try:
+                    lzc.lzc_create("pool/fs%d" % i)
+                    results.append(True)
+                except lzc_exc.ZFSError:
+                    results.append(False)
+            return (results, clock.time())
+
+        self.assertEqual(run(), run())
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
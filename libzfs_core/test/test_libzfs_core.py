@@ -23,6 +23,7 @@ import time
 import uuid
 from .. import _libzfs_core as lzc
 from .. import exceptions as lzc_exc
+from .._nvlist import NVList
 
 
 def _print(*args):
@@ -306,6 +307,26 @@ class ZFSTest(unittest.TestCase):
         lzc.lzc_create(name, props=props)
         self.assertExists(name)
 
+    def test_create_fs_with_index_prop_name(self):
+        name = ZFSTest.pool.makeName("fs1/fs/test2")
+        props = {"compression": "lz4", "atime": "off"}
+
+        lzc.lzc_create(name, props=props)
+        self.assertExists(name)
+        actual_props = lzc.lzc_get_props(name)
+        self.assertEqual(actual_props["compression"], 15)
+        self.assertEqual(actual_props["atime"], 0)
+
+    def test_create_fs_with_prebuilt_props(self):
+        names = [ZFSTest.pool.makeName("fs1/fs/test3"),
+                 ZFSTest.pool.makeName("fs1/fs/test4")]
+        props = NVList({"user:foo": "bar"})
+
+        for name in names:
+            lzc.lzc_create(name, props=props)
+            self.assertExists(name)
+            self.assertEqual(lzc.lzc_get_props(name)["user:foo"], "bar")
+
     def test_create_fs_wrong_ds_type(self):
         name = ZFSTest.pool.makeName("fs1/fs/test1")
 
@@ -397,6 +418,24 @@ class ZFSTest(unittest.TestCase):
     def test_snapshot_empty_list(self):
         lzc.lzc_snapshot([])
 
+    def test_snapshot_from_generator(self):
+        snapnames = [ZFSTest.pool.makeName("@snap"), ZFSTest.pool.makeName("fs1@snap")]
+
+        lzc.lzc_snapshot(name for name in snapnames)
+        for snapname in snapnames:
+            self.assertExists(snapname)
+
+    def test_snapshot_from_generator_error(self):
+        snapname = "no-such-pool@snap"
+
+        with self.assertRaises(lzc_exc.SnapshotFailure) as ctx:
+            lzc.lzc_snapshot(iter([snapname]))
+
+        self.assertEquals(len(ctx.exception.errors), 1)
+        for e in ctx.exception.errors:
+            self.assertIsInstance(e, lzc_exc.FilesystemNotFound)
+            self.assertEquals(e.name, snapname)
+
     def test_snapshot_user_props(self):
         snapname = ZFSTest.pool.makeName("@snap")
         snaps = [snapname]
@@ -672,6 +711,14 @@ class ZFSTest(unittest.TestCase):
         lzc.lzc_destroy_snaps([ZFSTest.pool.makeName("@nonexistent")], False)
         lzc.lzc_destroy_snaps([ZFSTest.pool.makeName("@nonexistent")], True)
 
+    def test_destroy_snapshots_from_generator(self):
+        snapnames = [ZFSTest.pool.makeName("@snap"), ZFSTest.pool.makeName("fs1@snap")]
+        lzc.lzc_snapshot(snapnames)
+
+        lzc.lzc_destroy_snaps((name for name in snapnames), False)
+        for snapname in snapnames:
+            self.assertNotExists(snapname)
+
     def test_destroy_snapshot_of_nonexistent_pool(self):
         with self.assertRaises(lzc_exc.SnapshotDestructionFailure) as ctx:
             lzc.lzc_destroy_snaps(["no-such-pool@snap"], False)
@@ -2874,6 +2921,14 @@ class ZFSTest(unittest.TestCase):
         ret = lzc.lzc_release({snap: ['tag']})
         self.assertEquals(len(ret), 0)
 
+    def test_release_prebuilt_hold(self):
+        snap = ZFSTest.pool.getRoot().getSnap()
+        lzc.lzc_snapshot([snap])
+
+        lzc.lzc_hold(NVList({snap: 'tag'}))
+        ret = lzc.lzc_release(NVList({snap: {'tag': None}}))
+        self.assertEquals(len(ret), 0)
+
     def test_release_hold_empty(self):
         ret = lzc.lzc_release({})
         self.assertEquals(len(ret), 0)
@@ -3377,6 +3432,23 @@ class ZFSTest(unittest.TestCase):
         actual_props = lzc.lzc_get_props(fs)
         self.assertDictContainsSubset({prop: val}, actual_props)
 
+    @needs_support(lzc.lzc_set_prop)
+    def test_set_index_prop_name(self):
+        fs = ZFSTest.pool.makeName("new")
+
+        lzc.lzc_create(fs)
+        lzc.lzc_set_prop(fs, "compression", "lz4")
+        actual_props = lzc.lzc_get_props(fs)
+        self.assertEqual(actual_props["compression"], 15)
+
+    @needs_support(lzc.lzc_set_prop)
+    def test_set_invalid_prop_type(self):
+        fs = ZFSTest.pool.makeName("new")
+
+        lzc.lzc_create(fs)
+        with self.assertRaises(lzc_exc.PropertyInvalid):
+            lzc.lzc_set_prop(fs, "recordsize", "128k")
+
     @needs_support(lzc.lzc_set_prop)
     def test_set_invalid_prop(self):
         fs = ZFSTest.pool.makeName("new")
@@ -8,12 +8,20 @@ The tests also check that various error conditions like unsupported
 value types or out of bounds values are detected.
 """
 
+import array
 import unittest
 
-from .._nvlist import nvlist_in, nvlist_out, _lib
+from .._nvlist import (
+    nvlist_in, nvlist_out, _ffi, _lib, NVList, NVListBuilder, NVListView, numpy,
+    set_nvlist_cache_size, set_nvlist_codec, pack_nvlist, unpack_nvlist, _InternTable,
+    _Projection, _extend_projection, _decoder
+)
+from .._nvlist_flat import flat_decoder
+from .._nvlist_native import unpack_native
 from ..ctypes import (
     uint8_t, int8_t, uint16_t, int16_t, uint32_t, int32_t,
-    uint64_t, int64_t, boolean_t, uchar_t
+    uint64_t, int64_t, boolean_t, uchar_t,
+    uint8_array, int8_array, uint32_array, uint64_array, int64_array, boolean_array
 )
 
 
@@ -26,6 +34,13 @@ class TestNVList(unittest.TestCase):
             _lib.nvlist_dup(nv_in, nv_out, 0)
         return res
 
+    def _dict_to_nvlist_to_typed_dict(self, props):
+        res = {}
+        nv_in = nvlist_in(props)
+        with nvlist_out(res, typed_arrays=True) as nv_out:
+            _lib.nvlist_dup(nv_in, nv_out, 0)
+        return res
+
     def _assertIntDictsEqual(self, dict1, dict2):
         self.assertEqual(len(dict1), len(dict1), "resulting dictionary is of different size")
         for key in dict1.keys():
@@ -379,6 +394,52 @@ class TestNVList(unittest.TestCase):
             props = {"key": [uint64_t(0), uint32_t(0)]}
             self._dict_to_nvlist_to_dict(props)
 
+    def test_c_uint64_array(self):
+        props = {"key": uint64_array([0, 1, 2 ** 64 - 1])}
+        res = self._dict_to_nvlist_to_dict(props)
+        self.assertEqual(res, {"key": [0, 1, 2 ** 64 - 1]})
+
+    def test_c_int64_array(self):
+        props = {"key": int64_array(iter([-2 ** 63, 0, 2 ** 63 - 1]))}
+        res = self._dict_to_nvlist_to_dict(props)
+        self.assertEqual(res, {"key": [-2 ** 63, 0, 2 ** 63 - 1]})
+
+    def test_c_uint32_array(self):
+        props = {"key": uint32_array(xrange(10000))}
+        res = self._dict_to_nvlist_to_dict(props)
+        self.assertEqual(res, {"key": range(10000)})
+
+    def test_c_int8_array(self):
+        props = {"key": int8_array([-128, 127])}
+        res = self._dict_to_nvlist_to_dict(props)
+        self.assertEqual(res, {"key": [-128, 127]})
+
+    def test_c_uint8_array(self):
+        props = {"key": uint8_array([])}
+        res = self._dict_to_nvlist_to_dict(props)
+        self.assertEqual(res, {"key": []})
+
+    def test_c_boolean_array(self):
+        props = {"key": boolean_array([True, False])}
+        res = self._dict_to_nvlist_to_dict(props)
+        self.assertEqual(res, {"key": [True, False]})
+
+    def test_c_array_too_large_value(self):
+        with self.assertRaises(OverflowError):
+            uint32_array([0, 2 ** 32])
+
+    def test_c_array_negative_value(self):
+        with self.assertRaises(OverflowError):
+            uint64_array([0, -1])
+
+    def test_c_boolean_array_invalid_value(self):
+        with self.assertRaises(OverflowError):
+            boolean_array([0, 2])
+
+    def test_c_array_unsupported_type(self):
+        with self.assertRaises(TypeError):
+            self._dict_to_nvlist_to_dict({"key": _ffi.new("double[]", [1.0])})
+
     def test_explict_uint64_array(self):
         props = {"key": [uint64_t(0), uint64_t(1), uint64_t(2 ** 64 - 1)]}
         res = self._dict_to_nvlist_to_dict(props)
@@ -514,11 +575,107 @@ class TestNVList(unittest.TestCase):
             props = {"key": [int8_t(0), int8_t(-(2 ** 7) - 1)]}
             self._dict_to_nvlist_to_dict(props)
 
+    def test_typed_uint64_array(self):
+        props = {"key": [0, 1, 2 ** 64 - 1]}
+        res = self._dict_to_nvlist_to_typed_dict(props)
+        self.assertIsInstance(res["key"], array.array)
+        self.assertEqual(res["key"].tolist(), props["key"])
+
+    def test_typed_int32_array(self):
+        props = {"key": [int32_t(-(2 ** 31)), int32_t(0), int32_t(2 ** 31 - 1)]}
+        res = self._dict_to_nvlist_to_typed_dict(props)
+        self.assertIsInstance(res["key"], array.array)
+        self.assertEqual(res["key"].tolist(), [-(2 ** 31), 0, 2 ** 31 - 1])
+
+    def test_typed_uint8_array(self):
+        props = {"key": [uint8_t(0), uint8_t(65), uint8_t(255)]}
+        res = self._dict_to_nvlist_to_typed_dict(props)
+        self.assertEqual(res["key"], b"\x00A\xff")
+
+    def test_typed_byte_array(self):
+        props = {"key": [uchar_t(1), uchar_t(2)]}
+        res = self._dict_to_nvlist_to_typed_dict(props)
+        self.assertEqual(res["key"], b"\x01\x02")
+
+    def test_typed_arrays_in_nested_dict(self):
+        props = {"key": {"skey": [{"sskey": [1, 2, 3]}]}}
+        res = self._dict_to_nvlist_to_typed_dict(props)
+        nested = res["key"]["skey"][0]["sskey"]
+        self.assertIsInstance(nested, array.array)
+        self.assertEqual(nested.tolist(), [1, 2, 3])
+
+    def test_typed_arrays_keep_other_arrays(self):
+        props = {"key1": ["a", "b"], "key2": [True, False]}
+        res = self._dict_to_nvlist_to_typed_dict(props)
+        self.assertEqual(props, res)
+
+    def test_array_array_uint64(self):
+        props = {"key": array.array('L', [0, 1, 2])}
+        res = self._dict_to_nvlist_to_dict(props)
+        self.assertEqual(res["key"], [0, 1, 2])
+
+    def test_array_array_int16(self):
+        props = {"key": array.array('h', [-(2 ** 15), 0, 2 ** 15 - 1])}
+        res = self._dict_to_nvlist_to_dict(props)
+        self.assertEqual(res["key"], [-(2 ** 15), 0, 2 ** 15 - 1])
+
+    def test_array_array_empty(self):
+        props = {"key": array.array('i')}
+        res = self._dict_to_nvlist_to_dict(props)
+        self.assertEqual(res["key"], [])
+
+    def test_array_array_invalid_type(self):
+        with self.assertRaises(TypeError):
+            self._dict_to_nvlist_to_dict({"key": array.array('d', [1.0])})
+
+    def test_bytearray(self):
+        props = {"key": bytearray(b"\x00\x01\xff")}
+        res = self._dict_to_nvlist_to_typed_dict(props)
+        self.assertEqual(res["key"], b"\x00\x01\xff")
+
+    def test_memoryview(self):
+        props = {"key": memoryview(b"abc")}
+        res = self._dict_to_nvlist_to_typed_dict(props)
+        self.assertEqual(res["key"], b"abc")
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_numpy_array(self):
+        props = {"key": numpy.array([1, -2, 3], dtype=numpy.int32)}
+        res = self._dict_to_nvlist_to_dict(props)
+        self.assertEqual(res["key"], [1, -2, 3])
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_numpy_non_contiguous_array(self):
+        props = {"key": numpy.arange(10, dtype=numpy.uint64)[::2]}
+        res = self._dict_to_nvlist_to_dict(props)
+        self.assertEqual(res["key"], [0, 2, 4, 6, 8])
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_numpy_float_array(self):
+        with self.assertRaises(TypeError):
+            self._dict_to_nvlist_to_dict({"key": numpy.array([1.0])})
+
     def test_dict_array(self):
         props = {"key": [{"key": 1}, {"key": None}, {"key": {}}]}
         res = self._dict_to_nvlist_to_dict(props)
         self.assertEqual(props, res)
 
+    def test_invalid_nested_dict_array(self):
+        props = {"key": [{"a": 1}, {"b": object()}]}
+        with self.assertRaises(TypeError):
+            self._dict_to_nvlist_to_dict(props)
+
+    def test_invalid_nested_dict(self):
+        props = {"key": {"a": {"b": object()}}}
+        with self.assertRaises(TypeError):
+            self._dict_to_nvlist_to_dict(props)
+
+    def test_nested_dict_array(self):
+        props = {"key": [{"skey": [{"sskey": [1, 2]}, {"sskey": [3]}]},
+                         {"skey": [{"sskey": [4, 5, 6]}]}]}
+        res = self._dict_to_nvlist_to_dict(props)
+        self.assertEqual(props, res)
+
     def test_implicit_uint32_value(self):
         props = {"rewind-request": 1}
         res = self._dict_to_nvlist_to_dict(props)
@@ -609,4 +766,600 @@ class TestNVList(unittest.TestCase):
         self.assertEqual(props, res)
 
 
+class TestNVListView(unittest.TestCase):
+
+    def _dict_to_nvlist_to_view(self, props):
+        res = NVListView()
+        nv_in = nvlist_in(props)
+        with nvlist_out(res) as nv_out:
+            _lib.nvlist_dup(nv_in, nv_out, 0)
+        return res
+
+    def test_empty(self):
+        res = self._dict_to_nvlist_to_view({})
+        self.assertEqual(len(res), 0, "expected empty view")
+        self.assertEqual(list(res), [])
+
+    def test_unattached(self):
+        res = NVListView()
+        self.assertEqual(len(res), 0, "expected empty view")
+        self.assertNotIn("key", res)
+
+    def test_lookup(self):
+        props = {"key1": "str", "key2": 10, "key3": None}
+        res = self._dict_to_nvlist_to_view(props)
+        self.assertEqual(res["key1"], "str")
+        self.assertEqual(res["key2"], 10)
+        self.assertIsNone(res["key3"])
+        self.assertIn("key3", res)
+
+    def test_non_unique_names(self):
+        nvlistp = _ffi.new("nvlist_t **")
+        self.assertEqual(_lib.nvlist_alloc(nvlistp, 0, 0), 0)
+        nv_in = _ffi.gc(nvlistp[0], _lib.nvlist_free)
+        for (key, val) in (("a", 1), ("b", 2), ("a", 3)):
+            self.assertEqual(_lib.nvlist_add_uint64(nv_in, key, val), 0)
+        view = NVListView()
+        with nvlist_out(view) as nv_out:
+            _lib.nvlist_dup(nv_in, nv_out, 0)
+        res = {}
+        with nvlist_out(res) as nv_out:
+            _lib.nvlist_dup(nv_in, nv_out, 0)
+        self.assertEqual(res, {"a": 3, "b": 2})
+        self.assertEqual(view["a"], res["a"])
+        self.assertEqual(sorted(view), ["a", "b"])
+        self.assertEqual(dict(view), res)
+
+    def test_missing_key(self):
+        res = self._dict_to_nvlist_to_view({"key": "value"})
+        with self.assertRaises(KeyError):
+            res["nokey"]
+        self.assertNotIn("nokey", res)
+        self.assertIsNone(res.get("nokey"))
+
+    def test_invalid_key_type(self):
+        res = self._dict_to_nvlist_to_view({"key": "value"})
+        with self.assertRaises(KeyError):
+            res[1]
+
+    def test_value_is_cached(self):
+        res = self._dict_to_nvlist_to_view({"key": [1, 2, 3]})
+        self.assertIs(res["key"], res["key"])
+
+    def test_keys(self):
+        props = {"key1": "str", "key2": 10, "key3": {"skey": True}}
+        res = self._dict_to_nvlist_to_view(props)
+        self.assertItemsEqual(res.keys(), props.keys())
+        self.assertEqual(len(res), len(props))
+
+    def test_nested_dict(self):
+        props = {"key": {"skey": {"sskey": 1}}}
+        res = self._dict_to_nvlist_to_view(props)
+        self.assertIsInstance(res["key"], NVListView)
+        self.assertIsInstance(res["key"]["skey"], NVListView)
+        self.assertEqual(res["key"]["skey"]["sskey"], 1)
+
+    def test_nested_dict_outlives_parent(self):
+        res = self._dict_to_nvlist_to_view({"key": {"skey": "value"}})
+        nested = res["key"]
+        del res
+        self.assertEqual(nested["skey"], "value")
+
+    def test_dict_array(self):
+        props = {"key": [{"skey": 1}, {"skey": 2}]}
+        res = self._dict_to_nvlist_to_view(props)
+        self.assertEqual([x["skey"] for x in res["key"]], [1, 2])
+
+    def test_equals_dict(self):
+        props = {
+            "key1": "str",
+            "key2": [True, False],
+            "key3": {"skey": ["a", "b"]},
+            "key4": [{"skey": 1}],
+        }
+        res = self._dict_to_nvlist_to_view(props)
+        self.assertEqual(res, props)
+
+
+class TestPrebuiltNVList(unittest.TestCase):
+
+    def tearDown(self):
+        set_nvlist_cache_size(0)
+
+    def _nvlist_to_dict(self, nv_in):
+        res = {}
+        with nvlist_out(res) as nv_out:
+            _lib.nvlist_dup(nv_in, nv_out, 0)
+        return res
+
+    def test_conversion(self):
+        props = {"key1": "str", "key2": 10, "key3": {"skey": [1, 2]}}
+        nvlist = NVList(props)
+        self.assertEqual(self._nvlist_to_dict(nvlist_in(nvlist)), props)
+
+    def test_reused(self):
+        nvlist = NVList({"key": "value"})
+        self.assertEqual(nvlist_in(nvlist), nvlist_in(nvlist))
+
+    def test_copy_of_dict(self):
+        props = {"key": "value"}
+        nvlist = NVList(props)
+        props["key"] = "other"
+        self.assertEqual(nvlist["key"], "value")
+        self.assertEqual(self._nvlist_to_dict(nvlist_in(nvlist)), {"key": "value"})
+
+    def test_mapping(self):
+        props = {"key1": "str", "key2": 10}
+        nvlist = NVList(props)
+        self.assertEqual(nvlist, props)
+        self.assertItemsEqual(nvlist.keys(), props.keys())
+        self.assertEqual(len(nvlist), 2)
+
+    def test_immutable(self):
+        nvlist = NVList({"key": "value"})
+        with self.assertRaises(TypeError):
+            nvlist["key"] = "other"
+
+    def test_nested(self):
+        nested = NVList({"skey": 1})
+        res = self._nvlist_to_dict(nvlist_in({"key": nested}))
+        self.assertEqual(res, {"key": {"skey": 1}})
+
+    def test_invalid_value(self):
+        with self.assertRaises(TypeError):
+            NVList({"key": (1, 2)})
+
+    def test_cache_disabled(self):
+        props = {"key": "value"}
+        self.assertNotEqual(nvlist_in(props, cached=True), nvlist_in(props, cached=True))
+
+    def test_cache_hit(self):
+        set_nvlist_cache_size(2)
+        nvlist = nvlist_in({"key": [1, 2], "key2": {"skey": None}}, cached=True)
+        self.assertEqual(nvlist_in({"key2": {"skey": None}, "key": [1, 2]}, cached=True), nvlist)
+
+    def test_cache_distinguishes_types(self):
+        set_nvlist_cache_size(2)
+        nvlist1 = nvlist_in({"key": 1}, cached=True)
+        nvlist2 = nvlist_in({"key": True}, cached=True)
+        nvlist3 = nvlist_in({"key": uint32_t(1)}, cached=True)
+        self.assertNotEqual(nvlist1, nvlist2)
+        self.assertNotEqual(nvlist1, nvlist3)
+        self.assertEqual(self._nvlist_to_dict(nvlist2), {"key": True})
+
+    def test_cache_eviction(self):
+        set_nvlist_cache_size(1)
+        nvlist = nvlist_in({"key": 1}, cached=True)
+        nvlist_in({"key": 2}, cached=True)
+        self.assertNotEqual(nvlist_in({"key": 1}, cached=True), nvlist)
+
+    def test_cache_bypassed_for_buffers(self):
+        set_nvlist_cache_size(2)
+        props = {"key": bytearray(b"ab")}
+        self.assertNotEqual(nvlist_in(props, cached=True), nvlist_in(props, cached=True))
+
+    def test_invalid_cache_size(self):
+        with self.assertRaises(ValueError):
+            set_nvlist_cache_size(-1)
+
+
+class TestNVListBuilder(unittest.TestCase):
+
+    def _builder_to_dict(self, builder):
+        res = {}
+        with nvlist_out(res) as nv_out:
+            _lib.nvlist_dup(nvlist_in(builder), nv_out, 0)
+        return res
+
+    def test_empty(self):
+        builder = NVListBuilder()
+        self.assertEqual(self._builder_to_dict(builder), {})
+        self.assertEqual(builder.keys(), [])
+
+    def test_typed_adds(self):
+        builder = NVListBuilder()
+        builder.add_boolean("key1")
+        builder.add_boolean_value("key2", False)
+        builder.add_string("key3", "value")
+        builder.add_integer("key4", 2 ** 64 - 1)
+        builder.add_integer("key5", int8_t(-1))
+        builder.add_nested("key6", {"skey": "value"})
+        builder.add("key7", ["a", "b"])
+        self.assertEqual(self._builder_to_dict(builder), {
+            "key1": None,
+            "key2": False,
+            "key3": "value",
+            "key4": 2 ** 64 - 1,
+            "key5": -1,
+            "key6": {"skey": "value"},
+            "key7": ["a", "b"],
+        })
+
+    def test_add_booleans_from_generator(self):
+        builder = NVListBuilder()
+        count = builder.add_booleans("key%d" % i for i in range(1000))
+        self.assertEqual(count, 1000)
+        res = self._builder_to_dict(builder)
+        self.assertEqual(len(res), 1000)
+        self.assertIsNone(res["key999"])
+
+    def test_keys_in_order(self):
+        builder = NVListBuilder()
+        builder.add_booleans(["c", "a", "b"])
+        self.assertEqual(builder.keys(), ["c", "a", "b"])
+
+    def test_nested_builder(self):
+        nested = NVListBuilder()
+        nested.add_boolean("skey")
+        builder = NVListBuilder()
+        builder.add_nested("key", nested)
+        self.assertEqual(self._builder_to_dict(builder), {"key": {"skey": None}})
+
+    def test_builder_in_dict(self):
+        nested = NVListBuilder()
+        nested.add_string("skey", "value")
+        res = {}
+        with nvlist_out(res) as nv_out:
+            _lib.nvlist_dup(nvlist_in({"key": nested}), nv_out, 0)
+        self.assertEqual(res, {"key": {"skey": "value"}})
+
+    def test_invalid_key_type(self):
+        with self.assertRaises(TypeError):
+            NVListBuilder().add_booleans([1])
+
+    def test_invalid_value_types(self):
+        builder = NVListBuilder()
+        with self.assertRaises(TypeError):
+            builder.add_string("key", 1)
+        with self.assertRaises(TypeError):
+            builder.add_integer("key", True)
+        with self.assertRaises(TypeError):
+            builder.add_boolean_value("key", 1)
+        with self.assertRaises(TypeError):
+            builder.add_nested("key", [])
+
+
+class TestPackedNVList(unittest.TestCase):
+    PROPS = {
+        "key1": "str",
+        "key2": 2 ** 64 - 1,
+        "key3": {"skey": [True, False]},
+        "key4": [{"skey": "a"}, {"skey": "b"}],
+        "key5": None,
+    }
+
+    def test_native(self):
+        packed = pack_nvlist(self.PROPS)
+        self.assertIsInstance(packed, bytes)
+        self.assertEqual(unpack_nvlist(packed), self.PROPS)
+
+    def test_xdr(self):
+        packed = pack_nvlist(self.PROPS, encoding='xdr')
+        self.assertEqual(unpack_nvlist(packed), self.PROPS)
+
+    def test_empty(self):
+        self.assertEqual(unpack_nvlist(pack_nvlist({})), {})
+
+    def test_prebuilt(self):
+        self.assertEqual(pack_nvlist(NVList(self.PROPS)), pack_nvlist(self.PROPS))
+
+    def test_invalid_encoding(self):
+        with self.assertRaises(ValueError):
+            pack_nvlist({}, encoding='json')
+
+    def test_unpack_bytearray(self):
+        packed = bytearray(pack_nvlist(self.PROPS))
+        self.assertEqual(unpack_nvlist(packed), self.PROPS)
+
+    def test_unpack_memoryview_slice(self):
+        packed = pack_nvlist(self.PROPS)
+        buf = bytearray(b"xxx" + packed + b"yyy")
+        self.assertEqual(unpack_nvlist(memoryview(buf)[3:3 + len(packed)]), self.PROPS)
+
+    def test_unpack_lazy(self):
+        res = unpack_nvlist(pack_nvlist(self.PROPS), lazy=True)
+        self.assertIsInstance(res, NVListView)
+        self.assertEqual(res["key1"], "str")
+        self.assertEqual(res, self.PROPS)
+
+    def test_unpack_typed_arrays(self):
+        res = unpack_nvlist(pack_nvlist({"key": [1, 2]}), typed_arrays=True)
+        self.assertIsInstance(res["key"], array.array)
+
+    def test_unpack_garbage(self):
+        with self.assertRaises(ValueError):
+            unpack_nvlist(b"garbage")
+
+
+class TestNativeDecoder(unittest.TestCase):
+
+    def _assertRoundTrip(self, props):
+        packed = pack_nvlist(props)
+        self.assertEqual(unpack_native(packed), unpack_nvlist(packed))
+
+    def test_empty(self):
+        self.assertEqual(unpack_native(pack_nvlist({})), {})
+
+    def test_scalars(self):
+        self._assertRoundTrip({
+            "bool": None,
+            "true": True,
+            "false": False,
+            "str": "value",
+            "empty": "",
+            "int": 1,
+            "uint": 2 ** 64 - 1,
+            "uint8": uint8_t(255),
+            "int8": int8_t(-128),
+            "uint16": uint16_t(65535),
+            "int16": int16_t(-32768),
+            "uint32": uint32_t(2 ** 32 - 1),
+            "int32": int32_t(-2 ** 31),
+            "int64": int64_t(-2 ** 63),
+            "uchar": uchar_t(7),
+            "boolean_t": boolean_t(1),
+        })
+
+    def test_arrays(self):
+        self._assertRoundTrip({
+            "bools": [True, False, True],
+            "strs": ["a", "", "bcd"],
+            "ints": [1, 2, 3],
+            "uint8s": [uint8_t(1), uint8_t(2), uint8_t(3)],
+            "int16s": [int16_t(-1)],
+            "uint32s": [uint32_t(1), uint32_t(2)],
+        })
+
+    def test_nested(self):
+        self._assertRoundTrip({
+            "nested": {"a": {"b": {"c": None}}, "d": 1},
+            "after": "value",
+            "dicts": [{"x": 1}, {}, {"y": {"z": "str"}}],
+            "last": True,
+        })
+
+    def test_long_names(self):
+        self._assertRoundTrip({"k" * n: n for n in range(1, 20)})
+
+    def test_memoryview_slice(self):
+        props = {"key": {"nested": [1, 2]}, "str": "value"}
+        packed = pack_nvlist(props)
+        buf = bytearray(b"xxx" + packed + b"yyy")
+        self.assertEqual(unpack_native(memoryview(buf)[3:3 + len(packed)]), props)
+
+    def test_xdr_rejected(self):
+        with self.assertRaises(ValueError):
+            unpack_native(pack_nvlist({"key": 1}, encoding='xdr'))
+
+    def test_truncated(self):
+        packed = pack_nvlist({"key": "value", "other": 1})
+        with self.assertRaises(ValueError):
+            unpack_native(packed[:len(packed) - 8])
+
+    def test_garbage(self):
+        with self.assertRaises(ValueError):
+            unpack_native(b"garbage")
+
+
+class TestInterning(unittest.TestCase):
+    PROPS = {
+        "name": "pool/fs@snap",
+        "properties": {"used": {"value": 1, "source": "pool/fs"}},
+    }
+
+    def _assertSharedKeys(self, res1, res2):
+        self.assertEqual(res1, res2)
+        for k1 in res1:
+            self.assertTrue(any(k1 is k2 for k2 in res2))
+
+    def test_keys_shared(self):
+        packed = pack_nvlist(self.PROPS)
+        res1 = unpack_nvlist(packed)
+        res2 = unpack_nvlist(packed)
+        self._assertSharedKeys(res1, res2)
+        self._assertSharedKeys(res1["properties"]["used"], res2["properties"]["used"])
+
+    def test_keys_shared_native(self):
+        packed = pack_nvlist(self.PROPS)
+        res1 = unpack_native(packed)
+        res2 = unpack_native(packed)
+        self._assertSharedKeys(res1["properties"]["used"], res2["properties"]["used"])
+
+    def test_keys_shared_view(self):
+        packed = pack_nvlist(self.PROPS)
+        res1 = unpack_nvlist(packed, lazy=True)
+        res2 = unpack_nvlist(packed)
+        self._assertSharedKeys(res1, res2)
+
+    def test_values_not_shared_by_default(self):
+        packed = pack_nvlist(self.PROPS)
+        res1 = unpack_nvlist(packed)
+        res2 = unpack_nvlist(packed)
+        self.assertIsNot(res1["name"], res2["name"])
+
+    def test_values_shared(self):
+        packed = pack_nvlist(self.PROPS)
+        for unpack in (unpack_nvlist, unpack_native):
+            res1 = unpack(packed, intern_values=True)
+            res2 = unpack(packed, intern_values=True)
+            self.assertEqual(res1, self.PROPS)
+            self.assertIs(res1["name"], res2["name"])
+            self.assertIs(
+                res1["properties"]["used"]["source"], res2["properties"]["used"]["source"])
+
+    def test_long_values_not_shared(self):
+        packed = pack_nvlist({"name": "x" * 100})
+        res1 = unpack_nvlist(packed, intern_values=True)
+        res2 = unpack_nvlist(packed, intern_values=True)
+        self.assertIsNot(res1["name"], res2["name"])
+
+    def test_table_bounded(self):
+        table = _InternTable(2)
+        a = table(b"".join([b"a", b"a"]))
+        self.assertIs(table(b"".join([b"a", b"a"])), a)
+        table(b"bb")
+        table(b"cc")
+        self.assertLessEqual(len(table), 2)
+        self.assertIsNot(table(b"".join([b"a", b"a"])), a)
+
+
+class TestProjection(unittest.TestCase):
+    PROPS = {
+        "name": "pool/fs",
+        "dmu_objset_stats": {"dds_is_snapshot": False, "dds_guid": 1},
+        "properties": {
+            "used": {"value": 1, "source": "pool/fs"},
+            "mountpoint": {"value": "/mnt", "source": "pool"},
+            "com.example:prop": {"value": "x", "source": "pool/fs"},
+            "clones": {"value": {"pool/clone": None}},
+        },
+        "array": [{"a": 1, "b": 2}, {"a": 3, "b": 4}],
+    }
+
+    def _assertProjection(self, projection, expected):
+        packed = pack_nvlist(self.PROPS)
+        self.assertEqual(unpack_nvlist(packed, projection=projection), expected)
+        self.assertEqual(unpack_native(packed, projection=projection), expected)
+        res = {}
+        with nvlist_out(res, projection=projection) as nvp:
+            _lib.nvlist_dup(nvlist_in(self.PROPS), nvp, 0)
+        self.assertEqual(res, expected)
+
+    def test_top_level_key(self):
+        self._assertProjection(['name'], {"name": "pool/fs"})
+
+    def test_missing_key(self):
+        self._assertProjection(['nonexistent', 'name.nonexistent'], {"name": "pool/fs"})
+
+    def test_dotted_path(self):
+        self._assertProjection(
+            ['properties.used.value'], {"properties": {"used": {"value": 1}}})
+
+    def test_tuple_path(self):
+        self._assertProjection(
+            [('properties', 'com.example:prop', 'value')],
+            {"properties": {"com.example:prop": {"value": "x"}}})
+
+    def test_whole_subtree(self):
+        self._assertProjection(
+            ['dmu_objset_stats', 'dmu_objset_stats.dds_guid'],
+            {"dmu_objset_stats": self.PROPS["dmu_objset_stats"]})
+
+    def test_wildcard(self):
+        self._assertProjection(
+            ['properties.*.value', 'properties.mountpoint.source'],
+            {"properties": {
+                "used": {"value": 1},
+                "mountpoint": {"value": "/mnt", "source": "pool"},
+                "com.example:prop": {"value": "x"},
+                "clones": {"value": {"pool/clone": None}},
+            }})
+
+    def test_nvlist_array(self):
+        self._assertProjection(['array.b'], {"array": [{"b": 2}, {"b": 4}]})
+
+    def test_empty(self):
+        self._assertProjection([], {})
+
+    def test_compiled(self):
+        projection = _Projection(['name', 'properties.used'])
+        self._assertProjection(projection, {
+            "name": "pool/fs", "properties": {"used": self.PROPS["properties"]["used"]}})
+
+    def test_extended(self):
+        projection = _extend_projection(
+            _Projection(['name', 'properties.*.value']), ['dmu_objset_stats.dds_guid', 'properties.used'])
+        self._assertProjection(projection, {
+            "name": "pool/fs",
+            "dmu_objset_stats": {"dds_guid": 1},
+            "properties": {
+                "used": self.PROPS["properties"]["used"],
+                "mountpoint": {"value": "/mnt"},
+                "com.example:prop": {"value": "x"},
+                "clones": {"value": {"pool/clone": None}},
+            }})
+
+    def test_string_rejected(self):
+        with self.assertRaises(TypeError):
+            _Projection('name')
+
+    def test_view_rejected(self):
+        with self.assertRaises(ValueError):
+            with nvlist_out(NVListView(), projection=['name']):
+                pass
+
+
+@unittest.skipIf(flat_decoder() is None, "the compiled codec is not built")
+class TestFlatDecoder(unittest.TestCase):
+
+    def _assertSameAsDecoder(self, props):
+        nvlist = nvlist_in(props)
+        expected = _decoder().to_dict(nvlist, {})
+        res = {}
+        self.assertTrue(flat_decoder().to_dict(nvlist, res))
+        self.assertEqual(res, expected)
+        for key in expected:
+            self.assertEqual(isinstance(res[key], bool), isinstance(expected[key], bool))
+
+    def test_empty(self):
+        self._assertSameAsDecoder({})
+
+    def test_scalars(self):
+        self._assertSameAsDecoder({
+            "bool": None,
+            "true": True,
+            "false": False,
+            "str": "value",
+            "empty": "",
+            "int": 1,
+            "uint": 2 ** 64 - 1,
+            "uint8": uint8_t(255),
+            "int8": int8_t(-128),
+            "uint16": uint16_t(65535),
+            "int16": int16_t(-32768),
+            "int32": int32_t(-2 ** 31),
+            "int64": int64_t(-2 ** 63),
+            "uchar": uchar_t(7),
+        })
+
+    def test_arrays(self):
+        self._assertSameAsDecoder({
+            "bools": [True, False, True],
+            "strs": ["a", "", "bcd"],
+            "ints": [1, 2, 3],
+            "int8s": [int8_t(-1), int8_t(1)],
+            "uint32s": [uint32_t(1), uint32_t(2)],
+        })
+
+    def test_nested(self):
+        self._assertSameAsDecoder({
+            "nested": {"a": {"b": {"c": None}}, "d": 1},
+            "dicts": [{"x": 1}, {}, {"y": {"z": "str"}}],
+        })
+
+    def test_buffer_grows(self):
+        self._assertSameAsDecoder({"k%d" % i: "v" * i for i in range(200)})
+
+    def test_nvlist_out(self):
+        props = {"name": "pool/fs", "props": {"used": 1}}
+        self.assertTrue(set_nvlist_codec(True))
+        try:
+            self.assertEqual(unpack_nvlist(pack_nvlist(props)), props)
+        finally:
+            set_nvlist_codec(False)
+
+
+class TestNVListCodec(unittest.TestCase):
+
+    def test_switch(self):
+        props = {"name": "pool/fs", "props": {"used": 1, "ints": [1, 2]}, "flag": None}
+        try:
+            self.assertEqual(set_nvlist_codec(True), flat_decoder() is not None)
+            enabled = unpack_nvlist(pack_nvlist(props))
+        finally:
+            self.assertEqual(set_nvlist_codec(False), flat_decoder() is not None)
+        self.assertEqual(enabled, props)
+        self.assertEqual(unpack_nvlist(pack_nvlist(props)), props)
+
+
 # vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
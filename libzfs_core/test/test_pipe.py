@@ -0,0 +1,196 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Tests for the reading of the lzc_list records from a pipe.
+The records are written by a thread in pieces of various sizes,
+so that the records are split between reads.
+"""
+
+import errno
+import fcntl
+import os
+import sys
+import threading
+import unittest
+
+from .. import _libzfs_core as lzc
+from .. import exceptions as lzc_exc
+from .._nvlist import pack_nvlist, unpack_nvlist
+from ..simulator import _nvlist
+
+
+def _record(data, err=0):
+    return lzc._pipe_record_header.pack(len(data), 0, err, 0, 0) + data
+
+
+class TestPipeRecordReader(unittest.TestCase):
+
+    def _read(self, data, chunk, size=lzc._PIPE_READ_SIZE):
+        (rfd, wfd) = os.pipe()
+
+        def write():
+            try:
+                for i in xrange(0, len(data), chunk):
+                    os.write(wfd, data[i:i + chunk])
+            finally:
+                os.close(wfd)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            reader = lzc._PipeRecordReader(rfd, size)
+            records = []
+            while True:
+                record = reader.read_record()
+                if record is None:
+                    break
+                (err, view) = record
+                records.append((err, view.tobytes()))
+            return records
+        finally:
+            writer.join()
+            os.close(rfd)
+
+    def test_empty(self):
+        self.assertEqual(self._read(b"", 1), [])
+
+    def test_records(self):
+        payloads = [b"x" * n for n in range(0, 300, 7)]
+        data = b"".join(_record(p) for p in payloads)
+        expected = [(0, p) for p in payloads]
+        for chunk in (1, 3, 8, 100, len(data)):
+            self.assertEqual(self._read(data, chunk), expected)
+
+    def test_small_buffer(self):
+        payloads = [b"y" * n for n in (10, 1000, 5, 5000)]
+        data = b"".join(_record(p) for p in payloads)
+        self.assertEqual(self._read(data, 64, size=16), [(0, p) for p in payloads])
+
+    def test_error(self):
+        data = _record(b"", errno.ESRCH)
+        self.assertEqual(self._read(data, 1), [(errno.ESRCH, b"")])
+
+    def test_truncated_header(self):
+        data = _record(b"abc")[:4]
+        with self.assertRaises(lzc_exc.ZFSGenericError):
+            self._read(data, 1)
+
+    def test_truncated_record(self):
+        data = _record(b"abcdef")[:-1]
+        with self.assertRaises(lzc_exc.ZFSGenericError):
+            self._read(data, 5)
+
+    def test_nvlist_from_view(self):
+        packed = pack_nvlist({"name": "pool/fs", "props": {"used": 1}})
+        (rfd, wfd) = os.pipe()
+        try:
+            os.write(wfd, _record(b"garbage") + _record(packed))
+            reader = lzc._PipeRecordReader(rfd)
+            reader.read_record()
+            (_, view) = reader.read_record()
+            self.assertEqual(unpack_nvlist(view), {"name": "pool/fs", "props": {"used": 1}})
+        finally:
+            os.close(rfd)
+            os.close(wfd)
+
+
+class _ListBackend(object):
+    """
+    A backend the ``lzc_list`` of which writes all records before
+    it returns, as the kernel does when the records do not fit
+    into the pipe.
+    """
+
+    def __init__(self, count, ret=0, error=None, late_ret=0):
+        self.count = count
+        self.ret = ret
+        self.error = error
+        # The error that is returned after all records are written.
+        self.late_ret = late_ret
+
+    def libzfs_core_init(self):
+        return 0
+
+    def lzc_list(self, name, opts_nv):
+        if self.error is not None:
+            raise self.error
+        if self.ret != 0:
+            return self.ret
+        fd = _nvlist(opts_nv)["fd"]
+        try:
+            for i in xrange(self.count):
+                data = _record(pack_nvlist({"name": "%s/child%d" % (name, i)}))
+                while data:
+                    data = data[os.write(fd, data):]
+            os.write(fd, _record(b""))
+        except OSError as e:
+            return e.errno
+        return self.late_ret
+
+
+def _open_fds():
+    return set(os.listdir("/proc/self/fd"))
+
+
+class TestListProducer(unittest.TestCase):
+
+    def setUp(self):
+        self.previous = lzc.set_backend(None)
+        self.pipe_size = lzc._list_pipe_size
+
+    def tearDown(self):
+        lzc.set_backend(self.previous)
+        lzc.set_list_pipe_size(self.pipe_size)
+
+    def _list(self, backend):
+        lzc.set_backend(backend)
+        return [entry["name"] for entry in lzc._list("pool", recurse=1)]
+
+    def test_larger_than_pipe(self):
+        count = 20000
+        expected = ["pool/child%d" % i for i in xrange(count)]
+        for size in (0, 1024 * 1024):
+            lzc.set_list_pipe_size(size)
+            self.assertEqual(self._list(_ListBackend(count)), expected)
+
+    def test_error(self):
+        with self.assertRaises(lzc_exc.DatasetNotFound):
+            self._list(_ListBackend(1, ret=errno.ENOENT))
+
+    def test_error_after_end(self):
+        with self.assertRaises(lzc_exc.DatasetNotFound):
+            self._list(_ListBackend(3, late_ret=errno.ENOENT))
+
+    def test_not_found(self):
+        self.assertEqual(self._list(_ListBackend(1, ret=errno.ESRCH)), [])
+
+    def test_exception(self):
+        with self.assertRaises(RuntimeError):
+            self._list(_ListBackend(1, error=RuntimeError("producer failed")))
+
+    @unittest.skipUnless(os.path.isdir("/proc/self/fd"), "requires /proc")
+    def test_early_close(self):
+        fds = _open_fds()
+        lzc.set_backend(_ListBackend(100000))
+        listing = lzc._list("pool", recurse=1)
+        self.assertEqual(next(listing)["name"], "pool/child0")
+        listing.close()
+        self.assertEqual(_open_fds(), fds)
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "requires Linux")
+    def test_pipe_size(self):
+        lzc.set_list_pipe_size(256 * 1024)
+        (rfd, wfd) = lzc._list_pipe()
+        try:
+            # F_GETPIPE_SZ
+            self.assertEqual(fcntl.fcntl(wfd, 1032), 256 * 1024)
+        finally:
+            os.close(rfd)
+            os.close(wfd)
+
+    def test_negative_pipe_size(self):
+        with self.assertRaises(ValueError):
+            lzc.set_list_pipe_size(-1)
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
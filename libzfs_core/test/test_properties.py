@@ -0,0 +1,175 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Tests for the property registry and the client-side validation
+of properties.
+"""
+
+import unittest
+
+from .. import _libzfs_core as lzc
+from .. import exceptions as lzc_exc
+from .._nvlist import NVList
+from .._properties import encode_props, prop_schema
+from ..ctypes import uint64_t
+from ..simulator import Simulator
+
+
+class TestPropSchema(unittest.TestCase):
+
+    def test_native(self):
+        schema = prop_schema("compression")
+        self.assertEqual(schema.type, 'index')
+        self.assertFalse(schema.readonly)
+
+    def test_readonly(self):
+        self.assertTrue(prop_schema("creation").readonly)
+
+    def test_user(self):
+        self.assertEqual(prop_schema("user:foo").type, 'user')
+        self.assertEqual(prop_schema("com.example:foo-bar_1").type, 'user')
+
+    def test_invalid_user(self):
+        self.assertIsNone(prop_schema("user:FOO"))
+        self.assertIsNone(prop_schema("user:" + "x" * 256))
+
+    def test_unknown(self):
+        self.assertIsNone(prop_schema("nosuchprop"))
+
+    def test_cached(self):
+        self.assertIs(prop_schema("user:foo"), prop_schema("user:foo"))
+
+
+class TestEncodeProps(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(encode_props({}), {})
+
+    def test_index_names(self):
+        props = {"compression": "lz4", "atime": "off", "copies": "2"}
+        self.assertEqual(encode_props(props), {"compression": 15, "atime": 0, "copies": 2})
+
+    def test_index_numbers(self):
+        props = {"compression": 15, "atime": 0}
+        self.assertEqual(encode_props(props), props)
+
+    def test_index_bool(self):
+        res = encode_props({"atime": True, "readonly": False})
+        self.assertEqual(res, {"atime": 1, "readonly": 0})
+        self.assertNotIsInstance(res["atime"], bool)
+
+    def test_normalization(self):
+        self.assertEqual(encode_props({"normalization": "formD"}), {"normalization": 0x10})
+        self.assertIsNone(encode_props({"normalization": "formX"}))
+
+    def test_invalid_index(self):
+        self.assertIsNone(encode_props({"atime": 20}))
+        self.assertIsNone(encode_props({"compression": "nosuchalgo"}))
+        self.assertIsNone(encode_props({"canmount": True}))
+
+    def test_number(self):
+        props = {"quota": 2 ** 30, "recordsize": 4096, "volsize": 1}
+        self.assertEqual(encode_props(props), props)
+
+    def test_invalid_number(self):
+        self.assertIsNone(encode_props({"recordsize": "128k"}))
+        self.assertIsNone(encode_props({"recordsize": 1000}))
+        self.assertIsNone(encode_props({"recordsize": 256}))
+        self.assertIsNone(encode_props({"quota": -1}))
+        self.assertIsNone(encode_props({"quota": 2 ** 64}))
+        self.assertIsNone(encode_props({"quota": True}))
+        self.assertIsNone(encode_props({"volsize": 0}))
+
+    def test_string(self):
+        for val in ("/mnt", "none", "legacy"):
+            self.assertEqual(encode_props({"mountpoint": val}), {"mountpoint": val})
+
+    def test_invalid_string(self):
+        self.assertIsNone(encode_props({"mountpoint": "mnt"}))
+        self.assertIsNone(encode_props({"sharenfs": 1}))
+        self.assertIsNone(encode_props({"sharenfs": "x" * 1024}))
+
+    def test_invalid_type(self):
+        self.assertIsNone(encode_props({"quota": 1.5}))
+        self.assertIsNone(encode_props({"mountpoint": None}))
+        self.assertIsNone(encode_props({"compression": [1]}))
+        self.assertIsNone(encode_props({"user:foo": {"bar": None}}))
+
+    def test_cdata_passed_through(self):
+        val = uint64_t(2 ** 30)
+        self.assertIs(encode_props({"quota": val})["quota"], val)
+
+    def test_user(self):
+        self.assertEqual(encode_props({"user:foo": "bar"}), {"user:foo": "bar"})
+
+    def test_invalid_user(self):
+        self.assertIsNone(encode_props({"user:foo": 1}))
+        self.assertIsNone(encode_props({"user:FOO": "bar"}))
+
+    def test_readonly_passed_through(self):
+        self.assertEqual(encode_props({"creation": 0}), {"creation": 0})
+        self.assertEqual(encode_props({"used": "x"}), {"used": "x"})
+
+    def test_readonly_not_settable(self):
+        self.assertIsNone(encode_props({"used": 5}, settable=True))
+        self.assertIsNone(encode_props({"creation": uint64_t(0)}, settable=True))
+        self.assertEqual(encode_props({"atime": "on"}, settable=True), {"atime": 1})
+
+    def test_unknown_passed_through(self):
+        self.assertEqual(encode_props({"nosuchprop": 0}), {"nosuchprop": 0})
+
+    def test_snapshot(self):
+        self.assertEqual(encode_props({"user:foo": "bar"}, snapshot=True), {"user:foo": "bar"})
+        self.assertIsNone(encode_props({"atime": 0}, snapshot=True))
+        self.assertIsNone(encode_props({"foo": "bar"}, snapshot=True))
+
+    def test_nvlist(self):
+        props = NVList({"user:foo": "bar", "atime": 0})
+        self.assertIs(encode_props(props), props)
+
+    def test_nvlist_needs_conversion(self):
+        self.assertEqual(encode_props(NVList({"compression": "lz4"})), {"compression": 15})
+        self.assertEqual(encode_props(NVList({"atime": True, "quota": 1024})),
+                         {"atime": 1, "quota": 1024})
+
+    def test_invalid_nvlist(self):
+        self.assertIsNone(encode_props(NVList({"compression": "nosuchalgo"})))
+
+    def test_input_unchanged(self):
+        props = {"compression": "lz4"}
+        encode_props(props)
+        self.assertEqual(props, {"compression": "lz4"})
+
+
+class TestWrapperProps(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = Simulator(seed=0)
+        self.sim.create_pool("pool")
+        self.previous = lzc.set_backend(self.sim)
+
+    def tearDown(self):
+        lzc.set_backend(self.previous)
+
+    def test_create(self):
+        with self.assertRaises(lzc_exc.PropertyInvalid):
+            lzc.lzc_create("pool/fs", props={"used": 5})
+        self.assertFalse(lzc.lzc_exists("pool/fs"))
+
+    def test_clone(self):
+        lzc.lzc_create("pool/fs")
+        lzc.lzc_snapshot(["pool/fs@snap"])
+        with self.assertRaises(lzc_exc.PropertyInvalid):
+            lzc.lzc_clone("pool/clone", "pool/fs@snap", props={"used": 5})
+        self.assertFalse(lzc.lzc_exists("pool/clone"))
+
+    def test_create_nvlist(self):
+        lzc.lzc_create("pool/fs", props=NVList({"compression": "lz4"}))
+        self.assertEqual(lzc.lzc_get_props("pool/fs")["compression"], 15)
+
+    def test_set_prop(self):
+        lzc.lzc_create("pool/fs")
+        lzc.lzc_set_prop("pool/fs", "used", 5)
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,451 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Tests for the simulator module.
+The tests select the simulator as the backend and call the public
+`libzfs_core` functions, so the conversion of the arguments and
+the translation of the errors are verified together with the simulated
+behavior.
+"""
+
+import tempfile
+import unittest
+
+from .. import _libzfs_core as lzc
+from .. import exceptions as lzc_exc
+from ..simulator import Simulator
+
+
+class TestSimulator(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = Simulator(seed=0)
+        self.sim.create_pool("pool")
+        self.previous = lzc.set_backend(self.sim)
+
+    def tearDown(self):
+        lzc.set_backend(self.previous)
+
+    def test_set_backend(self):
+        self.assertIs(lzc.set_backend(None), self.sim)
+        self.assertIsNone(lzc.set_backend(self.sim))
+        self.assertTrue(lzc.is_supported(lzc.lzc_list))
+
+    def test_create(self):
+        lzc.lzc_create("pool/fs")
+        self.assertTrue(lzc.lzc_exists("pool/fs"))
+        self.assertFalse(lzc.lzc_exists("pool/other"))
+
+    def test_create_exists(self):
+        lzc.lzc_create("pool/fs")
+        with self.assertRaises(lzc_exc.FilesystemExists):
+            lzc.lzc_create("pool/fs")
+
+    def test_create_no_parent(self):
+        with self.assertRaises(lzc_exc.ParentNotFound):
+            lzc.lzc_create("pool/parent/fs")
+
+    def test_create_no_pool(self):
+        with self.assertRaises(lzc_exc.ParentNotFound):
+            lzc.lzc_create("nopool/fs")
+
+    def test_create_pool_twice(self):
+        with self.assertRaises(ValueError):
+            self.sim.create_pool("pool")
+
+    def test_snapshot(self):
+        lzc.lzc_create("pool/fs")
+        lzc.lzc_snapshot(["pool/fs@snap", "pool@snap"])
+        self.assertTrue(lzc.lzc_exists("pool/fs@snap"))
+        self.assertTrue(lzc.lzc_exists("pool@snap"))
+
+    def test_snapshot_errors(self):
+        lzc.lzc_snapshot(["pool@snap"])
+        with self.assertRaises(lzc_exc.SnapshotFailure) as ctx:
+            lzc.lzc_snapshot(["pool@snap", "pool/nofs@snap"])
+        self.assertEqual(
+            sorted(type(e) for e in ctx.exception.errors),
+            sorted([lzc_exc.SnapshotExists, lzc_exc.FilesystemNotFound]))
+        self.assertFalse(lzc.lzc_exists("pool/nofs@snap"))
+
+    def test_snapshot_more_errors(self):
+        self.sim.max_errors = 2
+        snaps = ["pool/fs%d@snap" % i for i in range(5)]
+        with self.assertRaises(lzc_exc.SnapshotFailure) as ctx:
+            lzc.lzc_snapshot(snaps)
+        self.assertEqual(len(ctx.exception.errors), 2)
+        self.assertEqual(ctx.exception.suppressed_count, 3)
+
+    def test_snapshot_same_fs(self):
+        with self.assertRaises(lzc_exc.SnapshotFailure) as ctx:
+            lzc.lzc_snapshot(["pool@snap1", "pool@snap2"])
+        self.assertIsInstance(ctx.exception.errors[0], lzc_exc.DuplicateSnapshots)
+
+    def test_destroy_snaps(self):
+        lzc.lzc_snapshot(["pool@snap"])
+        lzc.lzc_destroy_snaps(["pool@snap", "pool@nosnap"], False)
+        self.assertFalse(lzc.lzc_exists("pool@snap"))
+
+    def test_destroy_held_snap(self):
+        lzc.lzc_snapshot(["pool@snap"])
+        lzc.lzc_hold({"pool@snap": "tag"})
+        with self.assertRaises(lzc_exc.SnapshotDestructionFailure) as ctx:
+            lzc.lzc_destroy_snaps(["pool@snap"], False)
+        self.assertIsInstance(ctx.exception.errors[0], lzc_exc.SnapshotIsHeld)
+
+    def test_destroy_cloned_snap(self):
+        lzc.lzc_snapshot(["pool@snap"])
+        lzc.lzc_clone("pool/clone", "pool@snap")
+        with self.assertRaises(lzc_exc.SnapshotDestructionFailure) as ctx:
+            lzc.lzc_destroy_snaps(["pool@snap"], False)
+        self.assertIsInstance(ctx.exception.errors[0], lzc_exc.SnapshotIsCloned)
+
+    def test_deferred_destroy(self):
+        lzc.lzc_snapshot(["pool@snap"])
+        lzc.lzc_hold({"pool@snap": "tag"})
+        lzc.lzc_destroy_snaps(["pool@snap"], True)
+        self.assertEqual(lzc.lzc_get_props("pool@snap")["defer_destroy"], 1)
+        lzc.lzc_release({"pool@snap": ["tag"]})
+        self.assertFalse(lzc.lzc_exists("pool@snap"))
+
+    def test_deferred_destroy_clone(self):
+        lzc.lzc_snapshot(["pool@snap"])
+        lzc.lzc_clone("pool/clone", "pool@snap")
+        lzc.lzc_destroy_snaps(["pool@snap"], True)
+        self.assertTrue(lzc.lzc_exists("pool@snap"))
+        lzc.lzc_destroy("pool/clone")
+        self.assertFalse(lzc.lzc_exists("pool@snap"))
+
+    def test_holds(self):
+        lzc.lzc_snapshot(["pool@snap"])
+        missing = lzc.lzc_hold({"pool@snap": "tag", "pool@nosnap": "tag"})
+        self.assertEqual(missing, ["pool@nosnap"])
+        self.assertEqual(lzc.lzc_get_holds("pool@snap").keys(), ["tag"])
+        with self.assertRaises(lzc_exc.HoldFailure) as ctx:
+            lzc.lzc_hold({"pool@snap": "tag"})
+        self.assertIsInstance(ctx.exception.errors[0], lzc_exc.HoldExists)
+        missing = lzc.lzc_release({"pool@snap": ["tag", "other"]})
+        self.assertEqual(missing, ["pool@snap#other"])
+        self.assertEqual(lzc.lzc_get_holds("pool@snap"), {})
+
+    def test_bookmarks(self):
+        lzc.lzc_snapshot(["pool@snap"])
+        lzc.lzc_bookmark({"pool#bmark": "pool@snap"})
+        bmarks = lzc.lzc_get_bookmarks("pool", ["guid", "createtxg"])
+        self.assertEqual(bmarks.keys(), ["bmark"])
+        self.assertEqual(bmarks["bmark"]["guid"]["value"],
+                         lzc.lzc_get_props("pool@snap")["guid"])
+        lzc.lzc_destroy_bookmarks(["pool#bmark"])
+        self.assertEqual(lzc.lzc_get_bookmarks("pool"), {})
+
+    def test_bookmark_mismatch(self):
+        lzc.lzc_create("pool/fs")
+        lzc.lzc_snapshot(["pool@snap"])
+        with self.assertRaises(lzc_exc.BookmarkFailure) as ctx:
+            lzc.lzc_bookmark({"pool/fs#bmark": "pool@snap"})
+        self.assertIsInstance(ctx.exception.errors[0], lzc_exc.BookmarkMismatch)
+
+    def test_list(self):
+        lzc.lzc_create("pool/b")
+        lzc.lzc_create("pool/a")
+        lzc.lzc_create("pool/a/c")
+        lzc.lzc_snapshot(["pool@snap1"])
+        lzc.lzc_snapshot(["pool@snap2"])
+        self.assertEqual(list(lzc.lzc_list_children("pool")), ["pool/a", "pool/b"])
+        self.assertEqual(list(lzc.lzc_list_snaps("pool")), ["pool@snap1", "pool@snap2"])
+        names = [r["name"] for r in lzc._list("pool", recurse=None)]
+        self.assertEqual(names, ["pool", "pool@snap1", "pool@snap2",
+                                 "pool/a", "pool/a/c", "pool/b"])
+
+    def test_list_limit(self):
+        lzc.lzc_create("pool/b")
+        lzc.lzc_create("pool/a")
+        lzc.lzc_snapshot(["pool@snap1"])
+        lzc.lzc_snapshot(["pool@snap2"])
+        self.assertEqual(list(lzc.lzc_list_children("pool", limit=1)), ["pool/a"])
+        self.assertEqual(list(lzc.lzc_list_children("pool", limit=5)), ["pool/a", "pool/b"])
+        self.assertEqual(list(lzc.lzc_list_snaps("pool", limit=1)), ["pool@snap1"])
+        self.assertEqual(list(lzc.lzc_list_snaps("pool", limit=0)), [])
+        with self.assertRaises(ValueError):
+            lzc.lzc_list_snaps("pool", limit=-1)
+
+    def test_list_larger_than_pipe(self):
+        # The records are written before lzc_list returns, so they must be
+        # read while the call is blocked on the full pipe.
+        pipe_size = lzc._list_pipe_size
+        lzc.set_list_pipe_size(4096)
+        try:
+            names = ["pool/fs%03d" % i for i in xrange(300)]
+            for name in names:
+                lzc.lzc_create(name)
+            self.assertEqual(list(lzc.lzc_list_children("pool")), names)
+        finally:
+            lzc.set_list_pipe_size(pipe_size)
+
+    def test_list_decoders(self):
+        lzc.lzc_create("pool/fs", props={"com.example:prop": "value"})
+        self.assertEqual(list(lzc._list("pool", recurse=None)),
+                         list(lzc._list("pool", recurse=None, decoder='python')))
+
+    def test_list_not_found(self):
+        with self.assertRaises(lzc_exc.DatasetNotFound):
+            list(lzc.lzc_list_children("pool/nofs"))
+
+    def test_get_props(self):
+        lzc.lzc_create("pool/fs", props={"com.example:prop": "value", "quota": 1024})
+        lzc.lzc_create("pool/fs/child")
+        props = lzc.lzc_get_props("pool/fs/child")
+        self.assertEqual(props["com.example:prop"], "value")
+        self.assertEqual(props["mountpoint"], "/pool/fs/child")
+        self.assertNotIn("quota", props)
+        self.assertEqual(lzc.lzc_get_props("pool/fs")["quota"], 1024)
+
+    def test_list_tree(self):
+        lzc.lzc_create("pool/b")
+        lzc.lzc_create("pool/a", props={"com.example:prop": "value"})
+        lzc.lzc_create("pool/a/vol", ds_type='zvol', props={"volsize": 1024 * 1024})
+        lzc.lzc_snapshot(["pool/a@snap"])
+        records = list(lzc.lzc_list_tree("pool", props=["com.example:prop", "mountpoint"]))
+        self.assertEqual([(r.name, r.type, r.parent) for r in records], [
+            ("pool", "filesystem", None),
+            ("pool/a", "filesystem", "pool"),
+            ("pool/a@snap", "snapshot", "pool/a"),
+            ("pool/a/vol", "volume", "pool/a"),
+            ("pool/b", "filesystem", "pool"),
+        ])
+        (pool, fs, snap, vol, _) = records
+        self.assertEqual(fs.props, {"com.example:prop": "value", "mountpoint": "/pool/a"})
+        self.assertEqual(snap.props, {"com.example:prop": "value"})
+        self.assertEqual(pool.props, {"mountpoint": "/pool"})
+        self.assertEqual(fs.guid, lzc.lzc_get_props("pool/a")["guid"])
+        self.assertEqual(snap.createtxg, lzc.lzc_get_props("pool/a@snap")["createtxg"])
+        self.assertLess(fs.createtxg, snap.createtxg)
+
+    def test_list_tree_filters(self):
+        lzc.lzc_create("pool/a")
+        lzc.lzc_create("pool/a/b")
+        lzc.lzc_snapshot(["pool/a@snap"])
+        names = lambda records: [r.name for r in records]
+        self.assertEqual(names(lzc.lzc_list_tree("pool", depth=0)), ["pool"])
+        self.assertEqual(names(lzc.lzc_list_tree("pool", depth=1)), ["pool", "pool/a"])
+        self.assertEqual(names(lzc.lzc_list_tree("pool", types=["snapshot"])), ["pool/a@snap"])
+        self.assertEqual(names(lzc.lzc_list_tree("pool/a", types=["filesystem"])),
+                         ["pool/a", "pool/a/b"])
+        self.assertEqual([r.props for r in lzc.lzc_list_tree("pool/a")], [{}, {}, {}])
+        with self.assertRaises(ValueError):
+            lzc.lzc_list_tree("pool", depth=-1)
+        with self.assertRaises(ValueError):
+            lzc.lzc_list_tree("pool", types=["bookmark"])
+        with self.assertRaises(lzc_exc.DatasetNotFound):
+            list(lzc.lzc_list_tree("pool/nofs"))
+
+    def test_get_props_many(self):
+        lzc.lzc_create("pool/fs", props={"com.example:prop": "value"})
+        lzc.lzc_create("pool/fs/child", props={"mountpoint": "/mnt"})
+        lzc.lzc_create("pool/fs/child/grandchild")
+        lzc.lzc_snapshot(["pool/fs@snap"])
+        names = ["pool", "pool/fs", "pool/fs@snap", "pool/fs/child", "pool/fs/child/grandchild"]
+        expected = [(name, lzc.lzc_get_props(name)) for name in names]
+        self.assertEqual(list(lzc.lzc_get_props_many(root="pool")), expected)
+        self.assertEqual(expected[4][1]["mountpoint"], "/mnt/grandchild")
+        self.assertEqual(list(lzc.lzc_get_props_many(root="pool/fs", types=["snapshot"])),
+                         [expected[2]])
+
+    def test_get_props_many_names(self):
+        self.sim.create_pool("other")
+        lzc.lzc_create("pool/a")
+        lzc.lzc_create("pool/a/b")
+        lzc.lzc_create("pool/c")
+        lzc.lzc_snapshot(["pool/a/b@snap"])
+        names = ["other", "pool/a/b@snap", "pool/c", "pool/a/b"]
+        result = list(lzc.lzc_get_props_many(names=names))
+        self.assertItemsEqual(result, [(name, lzc.lzc_get_props(name)) for name in names])
+        self.assertEqual([name for (name, _) in lzc.lzc_get_props_many(names=["pool/a/b@snap"])],
+                         ["pool/a/b@snap"])
+        self.assertEqual(lzc._group_names(["pool/a/b@snap", "pool/c", "other"]), [
+            ("pool", 3, ["filesystem", "snapshot", "volume"], ["pool/a/b@snap", "pool/c"]),
+            ("other", 0, ["filesystem", "volume"], ["other"]),
+        ])
+
+    def test_get_props_many_not_found(self):
+        lzc.lzc_create("pool/a")
+        result = lzc.lzc_get_props_many(names=["pool/a", "pool/nofs"])
+        self.assertEqual(next(result)[0], "pool/a")
+        with self.assertRaises(lzc_exc.DatasetNotFound) as ctx:
+            next(result)
+        self.assertEqual(ctx.exception.name, "pool/nofs")
+        with self.assertRaises(lzc_exc.DatasetNotFound) as ctx:
+            list(lzc.lzc_get_props_many(names=["nopool/fs"]))
+        self.assertEqual(ctx.exception.name, "nopool/fs")
+        with self.assertRaises(ValueError):
+            lzc.lzc_get_props_many()
+        with self.assertRaises(ValueError):
+            lzc.lzc_get_props_many(root="pool", names=["pool"])
+
+    def test_set_and_inherit(self):
+        lzc.lzc_create("pool/fs")
+        lzc.lzc_set_prop("pool", "com.example:prop", "parent")
+        lzc.lzc_set_prop("pool/fs", "com.example:prop", "child")
+        self.assertEqual(lzc.lzc_get_props("pool/fs")["com.example:prop"], "child")
+        lzc.lzc_inherit_prop("pool/fs", "com.example:prop")
+        self.assertEqual(lzc.lzc_get_props("pool/fs")["com.example:prop"], "parent")
+
+    def test_clone_and_promote(self):
+        lzc.lzc_create("pool/fs")
+        lzc.lzc_snapshot(["pool/fs@snap"])
+        lzc.lzc_clone("pool/clone", "pool/fs@snap")
+        self.assertEqual(lzc.lzc_get_props("pool/clone")["origin"], "pool/fs@snap")
+        lzc.lzc_promote("pool/clone")
+        self.assertEqual(list(lzc.lzc_list_snaps("pool/clone")), ["pool/clone@snap"])
+        self.assertEqual(lzc.lzc_get_props("pool/fs")["origin"], "pool/clone@snap")
+        self.assertNotIn("origin", lzc.lzc_get_props("pool/clone"))
+
+    def test_rename(self):
+        lzc.lzc_create("pool/fs")
+        lzc.lzc_create("pool/fs/child")
+        lzc.lzc_snapshot(["pool/fs/child@snap"])
+        lzc.lzc_rename("pool/fs", "pool/renamed")
+        self.assertFalse(lzc.lzc_exists("pool/fs"))
+        self.assertTrue(lzc.lzc_exists("pool/renamed/child@snap"))
+
+    def test_destroy_busy(self):
+        lzc.lzc_create("pool/fs")
+        lzc.lzc_snapshot(["pool/fs@snap"])
+        with self.assertRaises(lzc_exc.DatasetBusy):
+            lzc.lzc_destroy("pool/fs")
+
+    def test_rollback(self):
+        lzc.lzc_create("pool/fs")
+        lzc.lzc_snapshot(["pool/fs@snap1"])
+        lzc.lzc_snapshot(["pool/fs@snap2"])
+        self.assertEqual(lzc.lzc_rollback("pool/fs"), "pool/fs@snap2")
+
+    def test_send_receive(self):
+        lzc.lzc_create("pool/fs")
+        lzc.lzc_snapshot(["pool/fs@snap1"])
+        lzc.lzc_snapshot(["pool/fs@snap2"])
+        with tempfile.TemporaryFile() as stream:
+            lzc.lzc_send("pool/fs@snap1", None, stream.fileno())
+            lzc.lzc_send("pool/fs@snap2", "pool/fs@snap1", stream.fileno())
+            stream.seek(0)
+            lzc.lzc_receive("pool/copy@snap1", stream.fileno())
+            lzc.lzc_receive("pool/copy@snap2", stream.fileno())
+        self.assertEqual(list(lzc.lzc_list_snaps("pool/copy")),
+                         ["pool/copy@snap1", "pool/copy@snap2"])
+        self.assertEqual(lzc.lzc_get_props("pool/copy@snap2")["guid"],
+                         lzc.lzc_get_props("pool/fs@snap2")["guid"])
+
+    def test_receive_incremental_mismatch(self):
+        lzc.lzc_create("pool/fs")
+        lzc.lzc_snapshot(["pool/fs@snap1"])
+        lzc.lzc_snapshot(["pool/fs@snap2"])
+        with tempfile.TemporaryFile() as stream:
+            lzc.lzc_send("pool/fs@snap2", "pool/fs@snap1", stream.fileno())
+            stream.seek(0)
+            with self.assertRaises(lzc_exc.StreamMismatch):
+                lzc.lzc_receive("pool/fs@snap3", stream.fileno())
+
+    def test_independent_simulators(self):
+        other = Simulator()
+        other.create_pool("pool")
+        lzc.lzc_create("pool/fs")
+        self.assertNotIn("pool/fs", other.datasets())
+        self.assertIn("pool/fs", self.sim.datasets())
+
+
+class _CountingSimulator(Simulator):
+    """
+    A simulator that counts the listings.
+    """
+
+    list_calls = 0
+
+    def lzc_list(self, name, opts_nv):
+        self.list_calls += 1
+        return super(_CountingSimulator, self).lzc_list(name, opts_nv)
+
+
+class TestListOptions(unittest.TestCase):
+    """
+    The extended listing options with a simulator that supports them
+    and with one that rejects them.
+    """
+
+    def _setUp(self, list_options):
+        sim = _CountingSimulator(seed=0, list_options=list_options)
+        sim.create_pool("pool")
+        self.previous = lzc.set_backend(sim)
+        self.addCleanup(lzc.set_backend, self.previous)
+        lzc.lzc_create("pool/fs", props={"com.example:a": "a", "com.example:b": "b"})
+        for i in range(4):
+            lzc.lzc_snapshot(["pool/fs@snap%d" % i])
+        return sim
+
+    def _check(self):
+        txgs = [lzc.lzc_get_props("pool/fs@snap%d" % i)["createtxg"] for i in range(4)]
+        self.assertEqual(list(lzc.lzc_list_snaps("pool/fs", min_txg=txgs[2])),
+                         ["pool/fs@snap2", "pool/fs@snap3"])
+        self.assertEqual(list(lzc.lzc_list_snaps("pool/fs", min_txg=txgs[1], max_txg=txgs[2])),
+                         ["pool/fs@snap1", "pool/fs@snap2"])
+        self.assertEqual(list(lzc.lzc_list_children("pool", max_txg=txgs[0])), ["pool/fs"])
+        records = list(lzc.lzc_list_tree("pool/fs", types=["snapshot"], props=["com.example:a"],
+                                         max_txg=txgs[0]))
+        self.assertEqual([(r.name, r.props) for r in records],
+                         [("pool/fs@snap0", {"com.example:a": "a"})])
+        (entry,) = lzc._list("pool/fs", recurse=0, props=["com.example:b", "guid"])
+        self.assertEqual(sorted(entry["properties"]), ["com.example:b", "guid"])
+        (entry,) = lzc._list("pool/fs", recurse=0, props=[], decoder='python')
+        self.assertEqual(entry["properties"], {})
+        self.assertEqual(dict(lzc.lzc_get_props_many(root="pool/fs", types=["filesystem"],
+                                                     props=["com.example:a"])),
+                         {"pool/fs": {"com.example:a": "a"}})
+        self.assertEqual(dict(lzc.lzc_get_props_many(names=["pool/fs"], props=["mountpoint"])),
+                         {"pool/fs": {"mountpoint": "/pool/fs"}})
+
+    def test_supported(self):
+        self._setUp(("props", "mintxg", "maxtxg"))
+        self._check()
+        self.assertEqual(lzc._list_rejected_options, set())
+
+    def test_rejected(self):
+        self._setUp(())
+        self._check()
+        self.assertEqual(lzc._list_rejected_options, set(["props", "mintxg", "maxtxg"]))
+        lzc.set_backend(self.previous)
+        self.assertEqual(lzc._list_rejected_options, set())
+
+    def test_rejected_invalid_name(self):
+        self._setUp(())
+        with self.assertRaises(lzc_exc.NameInvalid):
+            list(lzc.lzc_list_snaps("pool/fs@@x"))
+        self.assertEqual(lzc._list_rejected_options, set())
+
+    def test_rejected_empty_retry(self):
+        sim = self._setUp(())
+        lzc.lzc_create("pool/empty")
+        sim.list_calls = 0
+        self.assertEqual(list(lzc.lzc_list_snaps("pool/empty", min_txg=0)), [])
+        self.assertEqual(sim.list_calls, 2)
+        self.assertEqual(lzc._list_rejected_options, set())
+        self.assertEqual(len(list(lzc.lzc_list_snaps("pool/fs", min_txg=0))), 4)
+        self.assertEqual(lzc._list_rejected_options, set(["mintxg"]))
+
+    def test_no_retry_without_options(self):
+        for list_options in ((), ("props", "mintxg", "maxtxg")):
+            sim = self._setUp(list_options)
+            sim.list_calls = 0
+            with self.assertRaises(lzc_exc.NameInvalid):
+                list(lzc.lzc_list_snaps("pool/fs@@x"))
+            with self.assertRaises(lzc_exc.DatasetNotFound):
+                list(lzc.lzc_list_children("pool/nofs"))
+            self.assertEqual(list(lzc.lzc_list_children("pool/fs")), [])
+            self.assertEqual(sim.list_calls, 3)
+            self.assertEqual(lzc._list_rejected_options, set())
+
+    def test_lazy_props(self):
+        self._setUp(())
+        with self.assertRaises(ValueError):
+            list(lzc._list("pool", lazy=True, props=[]))
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,97 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Tests of the wrappers against the stub library.
+The stub returns canned results, so the tests verify the path from
+the wrappers to a compiled library and back, including the error
+lists, independently of any pool.
+"""
+
+import errno
+import os
+import unittest
+
+from .. import _libzfs_core as lzc
+from .. import exceptions as lzc_exc
+from .stub import Stub, BUILD_ERRORS
+
+
+class TestStub(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            cls.stub = Stub()
+        except BUILD_ERRORS as e:
+            raise unittest.SkipTest("the stub library can not be built: %s" % (e,))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stub.close()
+
+    def setUp(self):
+        self.stub.set_result()
+        self.previous = lzc.set_backend(self.stub.lib)
+
+    def tearDown(self):
+        lzc.set_backend(self.previous)
+
+    def test_success(self):
+        lzc.lzc_create("pool/fs")
+        lzc.lzc_snapshot(["pool/fs@snap"])
+        lzc.lzc_destroy_snaps(["pool/fs@snap"], False)
+        self.assertEqual(lzc.lzc_hold({"pool/fs@snap": "tag"}), [])
+        self.assertEqual(lzc.lzc_get_holds("pool/fs@snap"), {})
+        self.assertEqual(lzc.lzc_snaprange_space("pool/fs@a", "pool/fs@b"), 0)
+        self.assertTrue(lzc.lzc_exists("pool/fs"))
+
+    def test_rollback(self):
+        self.assertEqual(lzc.lzc_rollback("pool/fs"), "pool/fs@snap")
+
+    def test_list(self):
+        self.stub.set_result(records=5)
+        self.assertEqual(list(lzc.lzc_list_children("pool")),
+                         ["pool/child%d" % i for i in range(1, 5)])
+        self.assertEqual(lzc.lzc_get_props("pool"), {"mountpoint": "/pool"})
+
+    def test_large_list(self):
+        # The records do not fit into the pipe.
+        self.stub.set_result(records=20000)
+        self.assertEqual(sum(1 for _ in lzc.lzc_list_children("pool")), 19999)
+
+    @unittest.skipUnless(os.path.isdir("/proc/self/fd"), "requires /proc")
+    def test_list_limit(self):
+        # The stub is blocked on the full pipe when the listing is
+        # stopped, it must be stopped too and the pipe closed.
+        self.stub.set_result(records=100000)
+        fds = os.listdir("/proc/self/fd")
+        self.assertEqual(list(lzc.lzc_list_children("pool", limit=3)),
+                         ["pool/child1", "pool/child2", "pool/child3"])
+        children = lzc.lzc_list_children("pool")
+        self.assertEqual(next(children), "pool/child1")
+        del children
+        self.assertEqual(os.listdir("/proc/self/fd"), fds)
+
+    def test_error(self):
+        self.stub.set_result(errno.ENOENT)
+        with self.assertRaises(lzc_exc.ParentNotFound):
+            lzc.lzc_create("pool/fs")
+        self.assertFalse(lzc.lzc_exists("pool/fs"))
+
+    def test_errlist(self):
+        self.stub.set_result(errno.EEXIST)
+        snaps = ["pool/fs%d@snap" % i for i in range(3)]
+        with self.assertRaises(lzc_exc.SnapshotFailure) as ctx:
+            lzc.lzc_snapshot(snaps)
+        self.assertEqual(sorted(e.name for e in ctx.exception.errors), snaps)
+        for error in ctx.exception.errors:
+            self.assertIsInstance(error, lzc_exc.SnapshotExists)
+
+    def test_error_without_errlist(self):
+        self.stub.set_result(errno.EBUSY, errlist=False)
+        with self.assertRaises(lzc_exc.SnapshotDestructionFailure) as ctx:
+            lzc.lzc_destroy_snaps(["pool/fs@snap"], False)
+        self.assertIsInstance(ctx.exception.errors[0], lzc_exc.SnapshotIsHeld)
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -1,6 +1,33 @@
 # Copyright 2015 ClusterHQ. See LICENSE file for details.
 
+from distutils.errors import CCompilerError, DistutilsExecError, DistutilsPlatformError
 from setuptools import setup, find_packages
+from setuptools.command.build_ext import build_ext
+
+
+class optional_build_ext(build_ext):
+    """
+    Build the optional compiled nvlist codec if possible.
+
+    The package falls back to the pure CFFI ABI mode when there is
+    no C compiler or there are no libnvpair headers.
+    """
+
+    def run(self):
+        try:
+            build_ext.run(self)
+        except DistutilsPlatformError as e:
+            self._skip(e)
+
+    def build_extension(self, ext):
+        try:
+            build_ext.build_extension(self, ext)
+        except (CCompilerError, DistutilsExecError, DistutilsPlatformError) as e:
+            self._skip(e)
+
+    def _skip(self, e):
+        self.warn("the optional nvlist codec is not built: %s" % (e,))
+
 
 setup(
     name="pyzfs",
@@ -25,7 +52,7 @@ setup(
         "libzfs_core",
     ],
 
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks"]),
     include_package_data=True,
     install_requires=[
         "cffi",
@@ -33,6 +60,13 @@ setup(
     setup_requires=[
         "cffi",
     ],
+    cffi_modules=[
+        "libzfs_core/bindings/_ffi_build.py:ffibuilder",
+        "libzfs_core/bindings/_codec_build.py:ffibuilder",
+    ],
+    cmdclass={
+        "build_ext": optional_build_ext,
+    },
     zip_safe=False,
     test_suite="libzfs_core.test",
 )